@@ -1,16 +1,34 @@
 import tkinter as tk, tkinter.scrolledtext as tkst, tkinter.ttk as ttk
-import inspect, time, threading, webbrowser
-from rcviz import callgraph
+import inspect, webbrowser
+from cache import RenderCache
 from pygments import lex
 from pygments.lexers import PythonLexer
 from io import BytesIO
-from zoom_advanced3 import CanvasImage
+from zoom_advanced3 import CanvasImage, SvgSource, HAS_CAIROSVG
+from treeview import TreeCanvas
+from tableview import TableCanvas
+from workers import TracePool, TraceCancelled, TraceFailed, TraceLimitExceeded
 
 from fib import *
 from binom import *
 from lis import *
 from edit_distance import *
 
+## How recursion trees are shown: 'tree' draws them on a canvas, 'graphviz' renders an image with dot
+GRAPH_VIEW = 'tree'
+## With MEMO_GRAPH, equal calls share one node and the recursion is shown as the DAG of its subproblems
+MEMO_GRAPH = False
+## Graphviz images are rendered as SVG and redrawn at each zoom when cairosvg is available, as PNG otherwise
+GRAPH_FORMAT = 'svg' if HAS_CAIROSVG else 'png'
+
+## Traces and rendered graphs of the inputs already shown
+render_cache = RenderCache()
+
+## Traced runs happen in worker processes, and are stopped after TIME_LIMIT seconds or MEMORY_LIMIT bytes
+trace_pool = TracePool(max_workers=2)
+TIME_LIMIT = 60
+MEMORY_LIMIT = 2 * 2**30
+
 ## List of all problems
 problems = ["Fibonnaci", "Binomial Coefficient", "Longest Increasing Subsequence", "Edit Distance"]
 
@@ -21,6 +39,10 @@ functions = {
     "Longest Increasing Subsequence": ('list', ['Sequence'], ((lis, lis_smaller), lis_iter)),
     "Edit Distance": ('str', ['Word 1', 'Word 2'], (edit_distance, edit_distance_iter))
 }
+for _, _, (rec, dp) in functions.values():
+    for func in (rec if type(rec) == tuple else (rec, )) + (dp, ):
+        func.cache = render_cache
+
 ## Dictionary: Problem -> Description
 descriptions = {
     "Fibonnaci":
@@ -47,7 +69,6 @@ class Application(tk.Frame):
         self.master = master
         self.create_tabs()
         self.create_viz()
-        self.reset = True
 
     def create_tabs(self):
         # Create a ttk notebook object
@@ -150,7 +171,13 @@ class Application(tk.Frame):
         self.quit.grid(row=3, column=1)
 
         self.rec_display_label = None
-        self.dp_display_loop = None
+        self.rec_time_label = None
+        self.rec_job = None
+        self.render_job = None
+        self.render_label = None
+        self.dp_view = None
+        self.dp_time_label = None
+        self.dp_job = None
         self.result_label = None
 
         # Frame to display the output of the function call
@@ -166,13 +193,24 @@ class Application(tk.Frame):
         problem = problems[problem_index]
         problem_info = functions[problem]
 
+        # Status of each side, until its time is known
+        self.rec_time_label = tk.Label(self.master, text="Running...", width=40, wraplength=320)
+        self.rec_time_label.grid(row=3, column=0, sticky='new')
+        self.dp_time_label = tk.Label(self.master, text="Running...", width=40, wraplength=320)
+        self.dp_time_label.grid(row=3, column=2, sticky='new')
+
         # Input parsing
-        if (problem_info[0] == 'list'):
-            args = [x.get() for x in self.inputs[problem_index]]
-            args = [x.split(',') for x in args]
-            args = [[int(x) for x in y] for y in args]
-        else:
-            args = [x.get() for x in self.inputs[problem_index]]
+        try:
+            if (problem_info[0] == 'list'):
+                args = [x.get() for x in self.inputs[problem_index]]
+                args = [x.split(',') for x in args]
+                args = [[int(x) for x in y] for y in args]
+            else:
+                args = [x.get() for x in self.inputs[problem_index]]
+        except ValueError:
+            for label in (self.rec_time_label, self.dp_time_label):
+                label.config(text="Invalid input: sequences are integers separated by commas", fg='red')
+            return
 
         # Recursive visualization
         if type(problem_info[2][0]) == tuple:
@@ -180,92 +218,102 @@ class Application(tk.Frame):
         else:
             func = problem_info[2][0]
 
-        try:
-            t0 = time.perf_counter_ns()
-            rec_res = func(*args)
-            t1 = time.perf_counter_ns()
-            tRec = (t1 - t0) / (10**6)
-        except:
-            pass
-        else:
-            img_data = callgraph.render('png')
-            self.rec_display_label = CanvasImage(self.master, BytesIO(img_data))
-            self.rec_display_label.grid(row=4, column=0, rowspan=4, sticky='nsew')
-
-            self.rec_time_label = tk.Label(self.master, text="Time Elapsed: " + str(tRec) + 'ms', width=40)
-            self.rec_time_label.grid(row=3, column=0, sticky='new')
-
-            self.result_label = tk.Label(self.outframe, text=str(rec_res), font=('Courier', 20))
-            self.result_label.grid(row=1, sticky='new')
+        # Both sides are traced at once in worker processes, inputs seen before come out of the cache
+        self.rec_job = trace_pool.submit(func, *args, timeout=TIME_LIMIT, memory=MEMORY_LIMIT, memo=MEMO_GRAPH)
+        self.master.after(0, self.wait_job, self.rec_job, self.rec_time_label, self.show_recursion)
 
         # DP visualization
         func = problem_info[2][1]
 
+        self.dp_job = trace_pool.submit(func, *args, timeout=TIME_LIMIT, memory=MEMORY_LIMIT)
+        self.master.after(0, self.wait_job, self.dp_job, self.dp_time_label, self.show_dp)
+
+    def wait_job(self, job, label, show):
+        # Reset cancels the jobs, a new run starts others
+        if job.cancelled:
+            return
+        if not job.future.done():
+            text = f"Running... {job.elapsed:.1f} s"
+            if job.memory is not None:
+                text += f", {job.memory / 2**20:.0f} MB"
+            label.config(text=text)
+            self.master.after(100, self.wait_job, job, label, show)
+            return
         try:
-            t0 = time.perf_counter_ns()
-            dp_res = func(*args)
-            t1 = time.perf_counter_ns()
-            tDP = (t1 - t0) / (10**6)
-        except:
-            pass
+            result = job.future.result()
+        except TraceLimitExceeded as e:
+            label.config(text=f"Stopped: the run {e}", fg='red')
+        except (TraceFailed, TraceCancelled) as e:
+            label.config(text=f"Failed: {e}", fg='red')
+        except Exception as e:
+            # Errors of the pool itself, like a worker that can't start or arguments that can't be pickled
+            label.config(text=f"Failed: {type(e).__name__}: {e}", fg='red')
         else:
-            self.reset = False
-            self.dp_display_loop = threading.Thread(target=self.loop_tables, args=(problem_info[2][1].tables, ), daemon=True)
-            self.dp_display_loop.start()
-
-            self.dp_time_label = tk.Label(self.master, text="Time Elapsed: " + str(tDP) + 'ms', width=40)
-            self.dp_time_label.grid(row=3, column=2, sticky='new')
-
-    def reset_viz(self, event=None):
-        # Tell the thread to complete
-        self.reset = True
-        # Clear the recursive visualization
-        callgraph.reset()
-        # Remove any labels if they exist
-        if self.rec_display_label:
-            self.rec_display_label.grid_forget()
-            self.rec_display_label = None
-            self.rec_time_label.grid_forget()
-            self.result_label.grid_forget()
-        if self.dp_display_loop:
-            self.dp_time_label.grid_forget()
+            show(result)
+
+    def show_recursion(self, graph):
+        # Inputs seen before keep the time their first run took
+        tRec = graph.time(0) * 1000
+        # memo graphs are DAGs, only graphviz can draw them
+        if GRAPH_VIEW == 'tree' and not graph.memo:
+            self.rec_display_label = TreeCanvas(self.master, graph)
+            self.rec_display_label.grid(row=4, column=0, rowspan=4, sticky='nsew')
         else:
-            self.begin_viz.config(state='normal')
-
-    def loop_tables(self, tables):
-        old_label = None
-        i = 0
-        length = len(tables)
-
-        # Decide how fast to animate
-        if length > 20:
-            time_incre = 10 / length
+            # Lay the graph out in the background, show_render polls for it
+            self.render_job = graph.render_async(GRAPH_FORMAT, cache=render_cache)
+            self.render_label = tk.Label(self.master, text="Rendering...")
+            self.render_label.grid(row=4, column=0, sticky='n')
+            self.master.after(50, self.show_render, self.render_job)
+
+        self.rec_time_label.config(text="Time Elapsed: " + str(tRec) + 'ms')
+
+        self.result_label = tk.Label(self.outframe, text=str(graph.result), font=('Courier', 20))
+        self.result_label.grid(row=1, sticky='new')
+
+    def show_dp(self, trace):
+        tDP = trace.elapsed * 1000
+        # Animated from the Tk event loop, each frame only redraws the cells that changed
+        self.dp_view = TableCanvas(self.master, trace.tables)
+        self.dp_view.grid(row=4, column=2, sticky='new', rowspan=4)
+        self.dp_view.play()
+
+        self.dp_time_label.config(text="Time Elapsed: " + str(tDP) + 'ms')
+
+    def show_render(self, job):
+        # Reset cancels the job, a new run starts another one
+        if job is not self.render_job or job.cancelled:
+            return
+        if not job.future.done():
+            if job.progress is not None:
+                self.render_label.config(text=f"Rendering... {job.progress:.0%}")
+            self.master.after(50, self.show_render, job)
+            return
+        try:
+            img_data = job.future.result()
+        except Exception as e:
+            self.render_label.config(text=f"Rendering failed: {e}", wraplength=400)
+            return
+        self.render_label.grid_forget()
+        self.render_label = None
+        if job.ext == 'svg':
+            self.rec_display_label = CanvasImage(self.master, source=SvgSource(img_data))
         else:
-            time_incre = 0.5
-        # Loop an animation
-        while (not self.reset):
-            table_text = np.array2string(tables[i], formatter={'all': lambda x: f'{x:3}'}, separator=',')
-            dp_label = tk.Label(self.master, text=table_text, font=('Courier', 16))
-            dp_label.grid(row=4, column=2, sticky='new', rowspan=4)
-
-            if old_label:
-                old_label.grid_forget()
-
-            old_label = dp_label
-
-            if i == length - 1:
-                time.sleep(1.5)
-            else:
-                time.sleep(time_incre)
-
-            i = (i + 1) % length
-
-        # Cleanup on loop exit
-        if old_label:
-            old_label.grid_forget()
+            self.rec_display_label = CanvasImage(self.master, BytesIO(img_data))
+        self.rec_display_label.grid(row=4, column=0, rowspan=4, sticky='nsew')
 
+    def reset_viz(self, event=None):
+        # Stop traced runs and renders that are still running
+        for job in (self.rec_job, self.dp_job, self.render_job):
+            if job:
+                job.cancel()
+        self.rec_job = self.dp_job = self.render_job = None
+        # Remove any widgets if they exist
+        for name in ('render_label', 'rec_display_label', 'rec_time_label', 'result_label', 'dp_view', 'dp_time_label'):
+            widget = getattr(self, name)
+            if widget:
+                widget.grid_forget()
+                setattr(self, name, None)
         self.begin_viz.config(state='normal')
-        self.dp_display_loop = None
 
     def link_callback(self, event):
         problem = problems[self.tabContainer.index('current')]
@@ -298,9 +346,13 @@ def highlight(tktextobj):
     tktextobj.tag_configure("Token.Literal.String", foreground="#248F24")
 
 
-# Create the application window
-root = tk.Tk()
-root.minsize(width=1150, height=650)
-root.title("DP Visualizer")
-app = Application(master=root)
-app.mainloop()
+if __name__ == '__main__':
+    # Worker processes import this module, they must not open a window
+    trace_pool.start()
+    # Create the application window
+    root = tk.Tk()
+    root.minsize(width=1150, height=650)
+    root.title("DP Visualizer")
+    app = Application(master=root)
+    app.mainloop()
+    trace_pool.shutdown()
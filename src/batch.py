@@ -0,0 +1,319 @@
+# Headless batch export
+# Traces many inputs of a problem in a pool of worker processes and writes, for each input, the call graph
+# image of the recursive formulation, the frames of the DP table and the timings, without opening a window
+#
+#   python batch.py fib 5 8 12 --out export
+#   python batch.py binom --grid n=4..10 k=1..3 --out export --format svg --max-nodes 300
+#   python batch.py edit_distance kitten,sitting sunday,saturday --frames gif --out export
+#   python batch.py lis --inputs sequences.txt --out export --workers 8
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from cache import RenderCache
+from tablestyle import FILL, CHANGED_FILL, OUTLINE, TEXT, CELL_HEIGHT, PADDING, rows, format_value
+from fib import fib, fib_iter
+from binom import binom, binom_iter
+from lis import lis, lis_iter
+from edit_distance import edit_distance, edit_distance_iter
+
+## Problems: name -> (parameters as (name, type), recursive function, DP function, check of the arguments)
+# a 'list' parameter takes the whole input as comma separated integers
+PROBLEMS = {
+    'fib': ((('n', int), ), fib, fib_iter, lambda n: n >= 1),
+    'binom': ((('n', int), ('k', int)), binom, binom_iter, lambda n, k: 0 <= k <= n),
+    'lis': ((('sequence', 'list'), ), lis, lis_iter, lambda sequence: len(sequence) > 0),
+    'edit_distance': ((('a', str), ('b', str)), edit_distance, edit_distance_iter, lambda a, b: True),
+}
+
+FRAME_FORMATS = ('png', 'gif', 'none')
+
+# every error a summary can report, each part of an export fails on its own
+ERRORS = ('trace_error', 'render_error', 'dp_error')
+
+
+def parse_input(problem, text):
+    ''' arguments of one input given as text, like '10,3' for binom or '3,1,4,1,5' for lis '''
+    params = PROBLEMS[problem][0]
+    if params[0][1] == 'list':
+        return ([int(v) for v in re.split(r'[,\s]+', text.strip()) if v], )
+    values = text.split(',')
+    if len(values) != len(params):
+        raise ValueError(f"{problem} takes {len(params)} values ({', '.join(name for name, _ in params)}), got '{text}'")
+    return tuple(kind(value.strip()) for (_, kind), value in zip(params, values))
+
+
+def parse_grid(problem, specs):
+    ''' arguments of every combination of the grid, given as 'name=values' specs
+        values are a range of integers 'a..b' (both included) or comma separated values
+    '''
+    params = PROBLEMS[problem][0]
+    if any(kind == 'list' for _, kind in params):
+        raise ValueError(f"{problem} has no grid, give its inputs one by one")
+    axes = {}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        kinds = dict(params)
+        if name not in kinds:
+            raise ValueError(f"unknown parameter '{name}' of {problem}, expected one of {', '.join(kinds)}")
+        match = re.fullmatch(r'(-?\d+)\.\.(-?\d+)', values.strip())
+        if match and kinds[name] is int:
+            axes[name] = list(range(int(match.group(1)), int(match.group(2)) + 1))
+        else:
+            axes[name] = [kinds[name](v.strip()) for v in values.split(',')]
+    missing = [name for name, _ in params if name not in axes]
+    if missing:
+        raise ValueError(f"the grid needs values of {', '.join(missing)}")
+    return list(itertools.product(*(axes[name] for name, _ in params)))
+
+
+def slug(problem, args):
+    ''' directory name of an input, like n=10_k=3 or 3-1-4-1-5 '''
+    parts = []
+    for (name, kind), arg in zip(PROBLEMS[problem][0], args):
+        parts.append('-'.join(map(str, arg)) if kind == 'list' else f'{name}={arg}')
+    return re.sub(r'[^\w.=-]+', '_', '_'.join(parts)) or '_'
+
+
+def directories(problem, inputs):
+    ''' directory name of every input, an input given again gets a numbered one, like n=10_k=3-2 '''
+    names, seen = [], set()
+    for args in inputs:
+        name = base = slug(problem, args)
+        copy = 1
+        while name in seen:
+            copy += 1
+            name = f'{base}-{copy}'
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+## Table frames as images, drawn like tableview.TableCanvas with the same tablestyle
+
+
+def frame_image(table, previous=None, font=None):
+    ''' one frame of a DP table as a PIL image, the cells that differ from previous highlighted
+        tables of one dimension are drawn as a row, like TableCanvas does
+    '''
+    font = font or ImageFont.load_default()
+    table = rows(np.asarray(table))
+    changed = np.zeros(table.shape, dtype=bool) if previous is None else rows(np.asarray(previous)) != table
+    texts = [[format_value(v) for v in row] for row in table]
+    char_width = max(font.getbbox('0')[2], 1)
+    width = max([len(text) for row in texts for text in row] + [2]) * char_width + 2 * PADDING
+    image = Image.new('RGB', (table.shape[1] * width + 1, table.shape[0] * CELL_HEIGHT + 1), FILL)
+    draw = ImageDraw.Draw(image)
+    for r, row in enumerate(texts):
+        for c, text in enumerate(row):
+            x, y = c * width, r * CELL_HEIGHT
+            draw.rectangle((x, y, x + width, y + CELL_HEIGHT), fill=CHANGED_FILL if changed[r, c] else FILL, outline=OUTLINE)
+            draw.text((x + width / 2, y + CELL_HEIGHT / 2), text, fill=TEXT, font=font, anchor='mm')
+    return image
+
+
+def write_frames(tables, directory, kind='png', duration=0.5):
+    ''' writes the frames of a table as frame_0000.png... or one animated table.gif, returns the files '''
+    if kind == 'none' or not len(tables):
+        return []
+    font = ImageFont.load_default()
+    images, previous = [], None
+    for i in range(len(tables)):
+        table = np.asarray(tables[i])
+        image = frame_image(table, previous, font)
+        previous = table
+        if kind == 'png':
+            name = os.path.join(directory, f'frame_{i:04d}.png')
+            image.save(name)
+            images.append(name)
+        else:
+            images.append(image)
+    if kind == 'gif':
+        # the last frame is larger when the table grows, every frame is padded to it
+        size = tuple(max(image.size[d] for image in images) for d in (0, 1))
+        frames = []
+        for image in images:
+            frame = Image.new('RGB', size, FILL)
+            frame.paste(image)
+            frames.append(frame)
+        name = os.path.join(directory, 'table.gif')
+        frames[0].save(name, save_all=True, append_images=frames[1:], duration=int(duration * 1000), loop=0)
+        return [name]
+    return images
+
+
+def export(problem, args, directory, options):
+    ''' traces one input both ways and writes its files to directory, returns its summary
+        runs in a worker process, an error of one input is reported in its summary instead of raised.
+        The recursive and DP sides are exported independently, and a failed render, like a missing dot,
+        only loses the graph image
+    '''
+    _, rec_func, dp_func, _ = PROBLEMS[problem]
+    summary = {'problem': problem, 'input': list(args), 'directory': directory}
+    summary.update(dict.fromkeys(ERRORS))
+    cache = RenderCache(path=options['cache']) if options['cache'] else None
+    os.makedirs(directory, exist_ok=True)
+    rec_func.cache = dp_func.cache = cache
+    graph = None
+    try:
+        start = time.perf_counter()
+        graph = rec_func.trace(*args)
+        summary['recursive_trace'] = time.perf_counter() - start
+        summary['result'] = _plain(graph.result)
+        summary['nodes'] = len(graph)
+    except Exception as e:
+        summary['trace_error'] = _error(e)
+
+    if graph is not None:
+        try:
+            start = time.perf_counter()
+            image = graph.render(options['format'], max_nodes=options['max_nodes'], cache=cache)
+            name = os.path.join(directory, 'graph.' + options['format'])
+            with open(name, 'wb') as f:
+                f.write(image)
+            summary['render'] = time.perf_counter() - start
+            summary['graph'] = name
+        except Exception as e:
+            summary['render_error'] = _error(e)
+
+    try:
+        start = time.perf_counter()
+        # lis_iter extends its list argument, so the DP side gets its own copy
+        trace = dp_func.trace(*[list(arg) if isinstance(arg, list) else arg for arg in args])
+        summary['dp_trace'] = time.perf_counter() - start
+        summary['frames'] = len(trace.tables)
+        summary.setdefault('result', _plain(trace.result))
+
+        start = time.perf_counter()
+        summary['frame_files'] = len(write_frames(trace.tables, directory, options['frames'], options['duration']))
+        summary['frames_write'] = time.perf_counter() - start
+    except Exception as e:
+        summary['dp_error'] = _error(e)
+    with open(os.path.join(directory, 'timings.json'), 'w') as f:
+        json.dump(summary, f, indent=1)
+    return summary
+
+
+def _error(e):
+    return f"{type(e).__name__}: {e}"
+
+
+def failed(summary):
+    ''' whether any part of an input's export failed '''
+    return any(summary[error] for error in ERRORS)
+
+
+def _plain(value):
+    # numpy scalars from the DP side and the like, as JSON values
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def run(problem, inputs, out, workers=None, graph_format='png', max_nodes=None, frames='png', duration=0.5, cache=None,
+        log=None):
+    ''' exports every input of the problem into out/problem/<input> with a pool of worker processes,
+        writes out/problem/summary.json and summary.csv and returns the summaries in input order
+    '''
+    if frames not in FRAME_FORMATS:
+        raise ValueError(f"unknown frame format '{frames}', expected one of {FRAME_FORMATS}")
+    check = PROBLEMS[problem][3]
+    bad = [args for args in inputs if not check(*args)]
+    if bad:
+        raise ValueError(f"invalid {problem} inputs: {', '.join(slug(problem, args) for args in bad)}")
+    root = os.path.join(out, problem)
+    options = {'format': graph_format, 'max_nodes': max_nodes, 'frames': frames, 'duration': duration, 'cache': cache}
+    summaries = [None] * len(inputs)
+    # spawn, like workers.TracePool, so the workers start from a clean interpreter
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(export, problem, args, os.path.join(root, name), options): i
+                   for i, (args, name) in enumerate(zip(inputs, directories(problem, inputs)))}
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries[futures[future]] = summary
+            if log is not None:
+                log(_describe(summary))
+    write_summary(summaries, root)
+    return summaries
+
+
+def write_summary(summaries, root):
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, 'summary.json'), 'w') as f:
+        json.dump(summaries, f, indent=1)
+    columns = ['input', 'result', 'nodes', 'frames', 'recursive_trace', 'render', 'dp_trace', 'frames_write', 'directory', *ERRORS]
+    with open(os.path.join(root, 'summary.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns, extrasaction='ignore')
+        writer.writeheader()
+        for summary in summaries:
+            writer.writerow(dict(summary, input=slug(summary['problem'], summary['input'])))
+
+
+def _describe(summary):
+    name = f"{summary['problem']}({', '.join(map(repr, summary['input']))})"
+    if summary['trace_error']:
+        parts = [f"recursive trace failed, {summary['trace_error']}"]
+    else:
+        parts = [f"{summary['nodes']} nodes traced in {summary['recursive_trace']:.3f} s"]
+        if summary['render_error']:
+            parts.append(f"not drawn, {summary['render_error']}")
+        else:
+            parts.append(f"drawn in {summary['render']:.3f} s")
+    if summary['dp_error']:
+        parts.append(f"DP failed, {summary['dp_error']}")
+    else:
+        parts.append(f"{summary['frames']} frames traced in {summary['dp_trace']:.3f} s")
+    if 'result' in summary:
+        name += f" = {summary['result']}"
+    return f"{name}: {', '.join(parts)}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trace and export many inputs of a problem, without a display")
+    parser.add_argument('problem', help=f"one of {', '.join(PROBLEMS)}")
+    parser.add_argument('inputs', nargs='*', help="inputs, with the values of one input separated by commas")
+    parser.add_argument('--grid', nargs='+', metavar='NAME=VALUES',
+                        help="every combination of parameter values, each a range a..b or comma separated values")
+    parser.add_argument('--inputs', dest='input_file', metavar='FILE', help="file with one input per line")
+    parser.add_argument('--out', default='export', help="output directory (default export)")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--format', default='png', help="graph image format, any graphviz output format (default png)")
+    parser.add_argument('--max-nodes', type=int, help="largest number of call graph nodes drawn, larger graphs are collapsed")
+    parser.add_argument('--frames', choices=FRAME_FORMATS, default='png',
+                        help="table frames as a numbered png sequence, one animated gif, or not at all")
+    parser.add_argument('--duration', type=float, default=0.5, help="seconds per frame of the gif (default 0.5)")
+    parser.add_argument('--cache', metavar='DIR', help="render cache directory, shared by the workers and later runs")
+    options = parser.parse_args(argv)
+    if options.problem not in PROBLEMS:
+        parser.error(f"unknown problem '{options.problem}', expected one of {', '.join(PROBLEMS)}")
+
+    try:
+        texts = list(options.inputs)
+        if options.input_file:
+            with open(options.input_file) as f:
+                texts += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        inputs = [parse_input(options.problem, text) for text in texts]
+        if options.grid:
+            inputs += parse_grid(options.problem, options.grid)
+        if not inputs:
+            parser.error("no inputs, give some as arguments, with --grid or with --inputs")
+        summaries = run(options.problem, inputs, options.out, options.workers, options.format, options.max_nodes,
+                        options.frames, options.duration, options.cache, log=print)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+    failures = sum(1 for summary in summaries if failed(summary))
+    print(f"{len(summaries) - failures} of {len(summaries)} inputs exported without errors to {os.path.join(options.out, options.problem)}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+# Scaling benchmarks of the recursive and DP formulations
+# Sweeps input sizes of every problem and measures the plain run time, the run time under rcviz or dpviz,
+# peak memory and the number of recorded nodes or frames, then fits a growth curve to each series.
+#
+#   python benchmark.py --out results                    all problems, default sizes
+#   python benchmark.py fib --sizes 5 10 15 20 --repeat 9
+#   python benchmark.py --baseline results/benchmark.json  fail when tracing got slower than a saved run
+
+import argparse
+import copy
+import csv
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+import types
+
+import numpy as np
+
+from rcviz import rcviz, callgraph
+from dpviz import dpviz
+from fib import fib, fib_iter
+from binom import binom, binom_iter
+from lis import lis, lis_iter
+from edit_distance import edit_distance, edit_distance_iter
+
+SEED = 338301
+
+
+def _sequence(n):
+    rng = random.Random(SEED + n)
+    return ([rng.randrange(100) for _ in range(n)], )
+
+
+def _words(n):
+    rng = random.Random(SEED + n)
+    return tuple(''.join(rng.choice('acgt') for _ in range(n)) for _ in range(2))
+
+
+## Problems: name -> (arguments for a size, recursive function, DP function, default sizes)
+# Sizes past the budget of a formulation are skipped, so the defaults reach further for the DP side
+PROBLEMS = {
+    'fib': (lambda n: (n, ), fib, fib_iter, list(range(4, 41, 2))),
+    'binom': (lambda n: (n, n // 2), binom, binom_iter, list(range(4, 41, 2))),
+    'lis': (_sequence, lis, lis_iter, list(range(2, 41, 2))),
+    'edit_distance': (_words, edit_distance, edit_distance_iter, list(range(1, 21))),
+}
+
+FORMULATIONS = ('recursive', 'dp')
+METRICS = ('untraced', 'traced', 'memory', 'count')
+UNITS = {'untraced': 's', 'traced': 's', 'memory': 'B', 'count': ''}
+
+
+def untraced(fn):
+    ''' the function under an rcviz or dpviz decorator, with its recursive calls also going to the
+        undecorated functions, so it runs as if it was never decorated
+    '''
+    if isinstance(fn, dpviz):
+        return fn.func
+    func = fn.wrapped
+    # Recursive calls look up the decorated functions in the module, give them a namespace without
+    namespace = dict(func.__globals__)
+    for name, value in func.__globals__.items():
+        if isinstance(value, rcviz):
+            wrapped = value.wrapped
+            namespace[name] = types.FunctionType(wrapped.__code__, namespace, wrapped.__name__, wrapped.__defaults__,
+                                                 wrapped.__closure__)
+    return namespace.get(func.__name__, func)
+
+
+def _fresh(args):
+    # some DP functions extend their list arguments, every call gets copies
+    return tuple(copy.copy(arg) if isinstance(arg, list) else arg for arg in args)
+
+
+def _times(call, repeat):
+    ''' seconds per call of each of repeat runs, many calls per run for quick functions, like timeit '''
+    timer = timeit.Timer(call)
+    number, _ = timer.autorange()
+    return [t / number for t in timer.repeat(repeat, number)]
+
+
+def _peak(call):
+    ''' bytes allocated at the peak of one call, as traced by tracemalloc '''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _count(result):
+    # nodes of a call graph, frames of a dpviz trace
+    return len(result) if isinstance(result, callgraph) else len(result.tables)
+
+
+def stats(values):
+    ''' median and spread of repeated measurements '''
+    values = np.asarray(values, dtype=float)
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    return {
+        'median': float(median),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'iqr': float(q3 - q1),
+        'stdev': float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+        'runs': len(values),
+    }
+
+
+def measure(fn, args, repeat):
+    ''' all metrics of one formulation at one size '''
+    plain = untraced(fn)
+    cache, fn.cache = fn.cache, None  # a cached trace would measure the cache
+    try:
+        untraced_times = _times(lambda: plain(*_fresh(args)), repeat)
+        traced_times = _times(lambda: fn.trace(*_fresh(args)), repeat)
+        result = fn.trace(*_fresh(args))
+        memory = _peak(lambda: fn.trace(*_fresh(args)))
+    finally:
+        fn.cache = cache
+    return {
+        'untraced': stats(untraced_times),
+        'traced': stats(traced_times),
+        'overhead': float(np.median(traced_times) / np.median(untraced_times)),
+        'memory': memory,
+        'count': _count(result),
+    }
+
+
+def run(problems=None, sizes=None, repeat=5, budget=1.0, log=None):
+    ''' benchmark rows of the problems over their sizes
+        A formulation stops after the first size whose traced run takes more than budget seconds, or before
+        one expected to take ten times that.
+    '''
+    rows = []
+    for problem in problems or PROBLEMS:
+        make, rec, dp, default_sizes = PROBLEMS[problem]
+        for formulation, fn in zip(FORMULATIONS, (rec, dp)):
+            traced = []
+            for size in sizes or default_sizes:
+                # exponential formulations grow fast, stop before the size expected to go over the budget too
+                if traced and (traced[-1] > budget or len(traced) > 1 and traced[-1]**2 / traced[-2] > budget * 10):
+                    break
+                row = dict(problem=problem, formulation=formulation, function=fn.__name__, size=size)
+                row.update(measure(fn, make(size), repeat))
+                rows.append(row)
+                traced.append(row['traced']['median'])
+                if log is not None:
+                    log(_describe(row))
+    return rows
+
+
+def fit(sizes, values):
+    ''' best of a power law a * n^b and an exponential a * b^n through the points, fitted in log space
+        returns a dict with the model, a, b and the r2 of the fit, or None with fewer than 3 usable points
+    '''
+    points = [(n, v) for n, v in zip(sizes, values) if n > 0 and v > 0]
+    if len(points) < 3:
+        return None
+    n, v = np.array(points, dtype=float).T
+    log_v = np.log(v)
+    best = None
+    for model, x in (('power', np.log(n)), ('exponential', n)):
+        slope, intercept = np.polyfit(x, log_v, 1)
+        residual = float(np.sum((log_v - (slope * x + intercept))**2))
+        total = float(np.sum((log_v - log_v.mean())**2))
+        r2 = 1.0 - residual / total if total > 0 else 1.0
+        b = slope if model == 'power' else float(np.exp(slope))
+        if best is None or r2 > best['r2']:
+            best = {'model': model, 'a': float(np.exp(intercept)), 'b': float(b), 'r2': r2}
+    return best
+
+
+def predict(curve, n):
+    ''' value of a fitted growth curve at size n '''
+    if curve['model'] == 'power':
+        return curve['a'] * n**curve['b']
+    return curve['a'] * curve['b']**n
+
+
+def solve(curve, value):
+    ''' size at which a fitted growth curve reaches value, to pick the largest input a demo can afford '''
+    if curve['model'] == 'power':
+        return (value / curve['a'])**(1 / curve['b']) if curve['b'] > 0 else float('inf')
+    return np.log(value / curve['a']) / np.log(curve['b']) if curve['b'] > 1 else float('inf')
+
+
+def growth(rows):
+    ''' fitted growth curve of each metric of each problem and formulation '''
+    curves = []
+    for problem in dict.fromkeys(row['problem'] for row in rows):
+        for formulation in FORMULATIONS:
+            series = [row for row in rows if row['problem'] == problem and row['formulation'] == formulation]
+            for metric in METRICS:
+                values = [_value(row, metric) for row in series]
+                curve = fit([row['size'] for row in series], values)
+                if curve is not None:
+                    curves.append(dict(problem=problem, formulation=formulation, metric=metric, **curve))
+    return curves
+
+
+def _value(row, metric):
+    value = row[metric]
+    return value['median'] if isinstance(value, dict) else value
+
+
+def regressions(rows, baseline, tolerance=0.25, min_time=1e-3):
+    ''' rows whose traced median is more than tolerance slower, relative to their untraced median, than in
+        the baseline rows. Comparing the tracing overhead rather than raw times keeps a slower machine from
+        showing up as a regression. Runs shorter than min_time seconds are too noisy to compare.
+    '''
+    before = {(row['problem'], row['formulation'], row['size']): row for row in baseline}
+    found = []
+    for row in rows:
+        old = before.get((row['problem'], row['formulation'], row['size']))
+        if old is None or row['traced']['median'] < min_time:
+            continue
+        if row['overhead'] > old['overhead'] * (1 + tolerance):
+            found.append((row, old))
+    return found
+
+
+def write(rows, curves, out):
+    ''' writes benchmark.json with everything, and the rows and curves as benchmark.csv and growth.csv '''
+    os.makedirs(out, exist_ok=True)
+    info = {
+        'python': sys.version,
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(out, 'benchmark.json'), 'w') as f:
+        json.dump({'info': info, 'rows': rows, 'growth': curves}, f, indent=1)
+    columns = ['problem', 'formulation', 'function', 'size']
+    for metric in ('untraced', 'traced'):
+        columns += [f'{metric}_{stat}' for stat in ('median', 'min', 'max', 'iqr', 'stdev')]
+    columns += ['runs', 'overhead', 'memory', 'count']
+    with open(os.path.join(out, 'benchmark.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        for row in rows:
+            flat = {k: v for k, v in row.items() if not isinstance(v, dict)}
+            for metric in ('untraced', 'traced'):
+                flat.update({f'{metric}_{stat}': v for stat, v in row[metric].items() if stat != 'runs'})
+            flat['runs'] = row['traced']['runs']
+            writer.writerow(flat)
+    with open(os.path.join(out, 'growth.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, ['problem', 'formulation', 'metric', 'model', 'a', 'b', 'r2'])
+        writer.writeheader()
+        writer.writerows(curves)
+
+
+def _describe(row):
+    return (f"{row['problem']:>13} {row['formulation']:>9} n={row['size']:<3} "
+            f"untraced {_seconds(row['untraced'])}  traced {_seconds(row['traced'])}  "
+            f"x{row['overhead']:<6.1f} {row['memory'] / 2**20:8.2f} MB  {row['count']} "
+            f"{'nodes' if row['formulation'] == 'recursive' else 'frames'}")
+
+
+def _seconds(stat):
+    return f"{stat['median'] * 1e3:9.3f} ms ±{stat['iqr'] * 1e3:.3f}"
+
+
+def _curve(curve, budget):
+    if curve['model'] == 'power':
+        shape = f"{curve['a']:.3g} * n^{curve['b']:.2f}"
+    else:
+        shape = f"{curve['a']:.3g} * {curve['b']:.3f}^n"
+    line = (f"{curve['problem']:>13} {curve['formulation']:>9} {curve['metric']:>8}: {shape} "
+            f"{UNITS[curve['metric']]} (r2 {curve['r2']:.3f})")
+    if curve['metric'] == 'traced':
+        line += f", n <= {solve(curve, budget):.0f} traces within {budget:g} s"
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling benchmarks of the recursive and DP formulations")
+    parser.add_argument('problems', nargs='*', metavar='problem', help=f"one of {', '.join(PROBLEMS)}, all by default")
+    parser.add_argument('--sizes', type=int, nargs='+', help="input sizes, instead of each problem's defaults")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per measurement (default 5)")
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help="stop a formulation after the first size whose traced run takes longer, in seconds "
+                        "(default 1), and report the largest size traced within it")
+    parser.add_argument('--out', help="directory to write benchmark.json, benchmark.csv and growth.csv to")
+    parser.add_argument('--baseline', help="benchmark.json of an earlier run, exit with 1 if tracing got slower")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="relative increase of the tracing overhead allowed against the baseline")
+    options = parser.parse_args(argv)
+    for problem in options.problems:
+        if problem not in PROBLEMS:
+            parser.error(f"unknown problem '{problem}', expected one of {', '.join(PROBLEMS)}")
+
+    rows = run(options.problems, options.sizes, options.repeat, options.budget, log=print)
+    curves = growth(rows)
+    print()
+    for curve in curves:
+        print(_curve(curve, options.budget))
+    if options.out:
+        write(rows, curves, options.out)
+    if options.baseline:
+        with open(options.baseline) as f:
+            found = regressions(rows, json.load(f)['rows'], options.tolerance)
+        print()
+        for row, old in found:
+            print(f"regression: {row['problem']} {row['formulation']} n={row['size']} "
+                  f"overhead x{old['overhead']:.1f} -> x{row['overhead']:.1f}")
+        if found:
+            return 1
+        print(f"no tracing regressions against {options.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+# Content-addressed cache for rendered graphs and recorded traces
+# Entries are keyed by a digest of what produced them (function source, arguments, options),
+# so an input that was already visualized is served without tracing or rendering it again
+
+import hashlib
+import inspect
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def source_hash(func):
+    ''' digest of a function's source, or of its bytecode when the source is not available '''
+    func = getattr(func, '__wrapped__', func)
+    try:
+        source = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        code = func.__code__
+        source = code.co_code + repr(code.co_consts).encode()
+    return hashlib.sha256(source).hexdigest()
+
+
+def make_key(*parts):
+    ''' digest of any picklable parts, falling back to their repr '''
+    try:
+        data = pickle.dumps(parts, protocol=4)
+    except Exception:
+        data = repr(parts).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+class RenderCache(object):
+    ''' two tier LRU cache of bytes by key
+        The memory tier holds up to memory_bytes. With a path, entries are also written to files in that
+        directory, and the least recently used files are removed once they take more than disk_bytes.
+        Entries evicted from memory are read back from disk on the next get.
+        get_object and put_object store pickled objects, like traces, in the same tiers.
+    '''
+
+    SUFFIX = '.bin'
+
+    def __init__(self, memory_bytes=64 * 2**20, path=None, disk_bytes=512 * 2**20):
+        self.memory_bytes = memory_bytes
+        self.path = path
+        self.disk_bytes = disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key : bytes, least recently used first
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._disk_size = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self._disk_size = sum(size for _, _, size in self._files())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._memory or (self.path is not None and os.path.exists(self._file(key)))
+
+    def get(self, key, default=None):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            elif self.path is not None:
+                data = self._read(key)
+                if data is not None:
+                    self._remember(key, data)
+            if data is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+            if self.path is not None:
+                self._write(key, data)
+
+    def get_object(self, key, default=None):
+        data = self.get(key)
+        return pickle.loads(data) if data is not None else default
+
+    def put_object(self, key, obj):
+        ''' stores obj, returns False when it can't be pickled '''
+        try:
+            data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return False
+        self.put(key, data)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            if self.path is not None:
+                for name, _, _ in self._files():
+                    _remove(os.path.join(self.path, name))
+                self._disk_size = 0
+
+    def _remember(self, key, data):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        if len(data) > self.memory_bytes:
+            return
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + self.SUFFIX)
+
+    def _files(self):
+        # (name, last use, size) of every entry on disk
+        with os.scandir(self.path) as entries:
+            return [(e.name, e.stat().st_mtime, e.stat().st_size) for e in entries if e.name.endswith(self.SUFFIX)]
+
+    def _read(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # The modification time doubles as the last use for eviction
+        os.utime(self._file(key))
+        return data
+
+    def _write(self, key, data):
+        if len(data) > self.disk_bytes:
+            return
+        path = self._file(key)
+        if os.path.exists(path):
+            self._disk_size -= os.path.getsize(path)
+        # Write to a temporary file first, so other processes never read a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._disk_size += len(data)
+        if self._disk_size > self.disk_bytes:
+            self._evict()
+
+    def _evict(self):
+        # Other processes may share the directory, so sizes are taken from it again
+        files = sorted(self._files(), key=lambda entry: entry[1])
+        self._disk_size = sum(size for _, _, size in files)
+        for name, _, size in files:
+            if self._disk_size <= self.disk_bytes:
+                break
+            _remove(os.path.join(self.path, name))
+            self._disk_size -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -2,33 +2,159 @@
 # Based on https://stackoverflow.com/questions/9186395/python-is-there-a-way-to-get-a-local-function-variable-from-within-a-decorator
 # With reference to https://realpython.com/primer-on-python-decorators/
 
-import sys, functools, numpy as np
+import sys, dis, time, ctypes, threading, functools, contextvars
+import numpy as np
+from snapshots import ListStore, DeltaStore, MemmapStore
+from tracked import TrackedArray
+from instrument import instrument
+from policies import RecordingPolicy
+from streaming import NotifyingStore, SnapshotStream
+from cache import make_key, source_hash
+
+## Tracing backends understood by dpviz
+# 'settrace'   - the original global line tracer, inspects every frame
+# 'local'      - only the wrapped function's frames get a line tracer
+# 'monitoring' - sys.monitoring (3.12+) line events on the wrapped code object only
+# 'ast'        - no tracing, the function is rewritten to call a hook after assignments to watched tables
+# 'auto'       - 'monitoring' when available, otherwise 'local'
+BACKENDS = ('auto', 'settrace', 'local', 'monitoring', 'ast')
+
+## Snapshot stores understood by dpviz, a callable returning a SnapshotStore also works
+# 'delta'  - keyframes plus sparse per-frame diffs
+# 'list'   - a full copy of every table state
+# 'memmap' - like 'delta', but spilled to files in a temporary directory and read back via np.memmap
+STORAGES = {'delta': DeltaStore, 'list': ListStore, 'memmap': MemmapStore}
+
+## How changes to the table are detected
+# 'compare' - compare the whole table against the last snapshot on every traced line
+# 'writes'  - swap dp_table for a TrackedArray that reports each assignment as it happens
+CAPTURES = ('compare', 'writes')
 
 
 class dpviz(object):
 
+    # Allow both @dpviz and @dpviz(backend=...) forms
+    def __new__(cls, func=None, **kwargs):
+        if func is None:
+            return functools.partial(cls, **kwargs)
+        return super().__new__(cls)
+
     # Initialize the dpviz wrapper
-    def __init__(self, func, arraylike=True):
-        self._tables = []
+    def __init__(self, func, arraylike=True, backend='auto', storage='delta', capture='compare', record_reads=False, watch='dp_table', policy=None, sink=None, cache=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown dpviz backend '{backend}', expected one of {BACKENDS}")
+        if not callable(storage) and storage not in STORAGES:
+            raise ValueError(f"Unknown dpviz storage '{storage}', expected one of {tuple(STORAGES)}")
+        if capture not in CAPTURES:
+            raise ValueError(f"Unknown dpviz capture '{capture}', expected one of {CAPTURES}")
+        if capture == 'writes' and not arraylike:
+            raise ValueError("capture='writes' needs an array-like dp_table")
+        # settrace would also trace the Python methods of TrackedArray on every read and write
+        if capture == 'writes' and (backend == 'settrace' or not hasattr(func, '__code__')):
+            raise ValueError("capture='writes' can not be used with the 'settrace' backend")
         self.func = func
         functools.update_wrapper(self, func)
         self.arraylike = arraylike
+        self.backend = backend
+        self.storage = storage
+        self.capture = capture
+        self.record_reads = record_reads
+        # Names of the local tables to record, tables shows the first one
+        self.watch = (watch, ) if isinstance(watch, str) else tuple(watch)
+        # RecordingPolicy deciding which states are kept, every distinct state by default
+        self.policy = policy if policy is not None else RecordingPolicy()
+        # Called with a streaming.Snapshot as soon as each state is recorded
+        self.sink = sink
+        # cache.RenderCache of traces by source and arguments, not used for calls with a sink
+        self.cache = cache
+        self._source_hash = None
+        # Latest finished trace, overall and in the current thread / context
+        self._last_trace = None
+        self._context_trace = contextvars.ContextVar(f'dpviz_{func.__name__}_trace', default=None)
+        self.clear_tables()
 
     ## This replaces any calls to the original function wrapped
     def __call__(self, *args, **kwargs):
-        # Reset the stored tables when called again
-        self.clear_tables()
+        return self.trace(*args, **kwargs).result
+
+    # Call the function and return its Trace, which holds the result and the recorded tables
+    def trace(self, *args, **kwargs):
+        key = self.cache_key(*args, **kwargs) if self.cache is not None and self.sink is None else None
+        trace = self.cache.get_object(key) if key is not None else None
+        if trace is None:
+            trace = Trace(self, self.sink)
+            try:
+                self._run(trace, args, kwargs)
+            finally:
+                self._last_trace = trace
+                self._context_trace.set(trace)
+            if key is not None:
+                self.cache.put_object(key, trace)
+        else:
+            self._last_trace = trace
+            self._context_trace.set(trace)
+        return trace
+
+    # Key of a call's trace in the cache, from everything that decides what the call records
+    def cache_key(self, *args, **kwargs):
+        if self._source_hash is None:
+            self._source_hash = source_hash(self.func)
+        return make_key('dpviz.trace', self._source_hash, args, kwargs, self.arraylike, self.backend, self.storage, self.capture,
+                        self.record_reads, self.watch, self.policy)
+
+    # Pickle by name, so decorated functions can be sent to worker processes
+    def __reduce__(self):
+        return self.__qualname__
+
+    # Run the function in a background thread, iterating over its snapshots while it runs
+    def stream(self, *args, maxsize=64, **kwargs):
+        stream = SnapshotStream(maxsize)
+        stream.trace = Trace(self, stream.put)
+        stream.start(lambda: self._run(stream.trace, args, kwargs).result)
+        return stream
+
+    def _run(self, trace, args, kwargs):
+        backend = self._resolve_backend()
+        start = time.perf_counter()
+        try:
+            if backend == 'ast':
+                trace.result = self._call_ast(trace, args, kwargs)
+            elif backend == 'monitoring':
+                trace.result = self._call_monitoring(trace, args, kwargs)
+            elif backend == 'local':
+                trace.result = self._call_local(trace, args, kwargs)
+            else:
+                trace.result = self._call_settrace(trace, args, kwargs)
+        finally:
+            trace.elapsed = time.perf_counter() - start
+            trace.finish()
+        return trace
+
+    # Pick the concrete backend for this call
+    def _resolve_backend(self):
+        backend = self.backend
+        # Scoped backends need the code object of the wrapped function
+        if backend != 'settrace' and not hasattr(self.func, '__code__'):
+            return 'settrace'
+        if backend == 'auto':
+            return 'monitoring' if hasattr(sys, 'monitoring') else 'local'
+        if backend == 'monitoring' and not hasattr(sys, 'monitoring'):
+            raise RuntimeError("The 'monitoring' backend requires Python 3.12 or newer")
+        return backend
 
+    def _call_ast(self, trace, args, kwargs):
+        # With write capture the hook is only needed where a table gets (re)bound
+        instrumented = instrument(self.func, self.watch, rebind_only=self.capture == 'writes')
+        return instrumented(trace.record)(*args, **kwargs)
+
+    def _call_settrace(self, trace, args, kwargs):
         # Define a local function used as a call trace while the function is executing
         def tracer(frame, event, arg):
-            # Store any dp_table if it exists
-            if ('dp_table' in frame.f_locals):
-                # Don't store duplicates of array-like
-                if (not self._tables or not self.arraylike or not np.array_equal(frame.f_locals['dp_table'], self._tables[-1])):
-                    self._tables.append(frame.f_locals['dp_table'].copy())
+            trace.record_frame(frame)
             return tracer
 
-        # Set tracer to the active trace
+        # Set tracer to the active trace, remembering whatever was tracing before
+        previous = sys.gettrace()
         sys.settrace(tracer)
 
         try:
@@ -36,14 +162,341 @@ class dpviz(object):
             res = self.func(*args, **kwargs)
         finally:
             # disable tracer and replace with old one
-            sys.settrace(None)
+            sys.settrace(previous)
+
+        return res
+
+    def _call_local(self, trace, args, kwargs):
+        code = self.func.__code__
+        previous = sys.gettrace()
+
+        # Only lines that can store into a table change what is recorded, with write capture only rebinding ones
+        sites = _store_lines(code, self.watch, rebind_only=self.capture == 'writes')
+
+        # Line tracer for one frame running the wrapped code, a line's effects are recorded at the next event
+        def frame_tracer():
+            pending = True
+
+            def local_tracer(frame, event, arg):
+                nonlocal pending
+                if pending or event == 'return':
+                    trace.record_frame(frame)
+                pending = frame.f_lineno in sites
+                return local_tracer
+
+            return local_tracer
+
+        # Global tracer only sees 'call' events, other code objects go to the previous tracer if any
+        def call_tracer(frame, event, arg):
+            if frame.f_code is not code:
+                return previous(frame, event, arg) if previous else None
+            trace.record_frame(frame)
+            return frame_tracer()
+
+        sys.settrace(call_tracer)
+
+        try:
+            res = self.func(*args, **kwargs)
+        finally:
+            sys.settrace(previous)
+
+        return res
+
+    def _call_monitoring(self, trace, args, kwargs):
+        code = self.func.__code__
+        # The shared callbacks find this trace through the context, so threads and nested calls stay apart
+        token = _active_traces.set({**_active_traces.get(), code: trace})
+        _monitor.enter(code)
+
+        try:
+            res = self.func(*args, **kwargs)
+        finally:
+            _monitor.exit(code)
+            _active_traces.reset(token)
 
         return res
 
     # Clear out the table when necessary
     def clear_tables(self):
-        self._tables = []
+        self._last_trace = Trace(self)
+        self._context_trace.set(None)
+
+    def _new_store(self):
+        # Tables that are not array-like can't be diffed, and every state is kept
+        if not self.arraylike:
+            return ListStore(dedupe=False)
+        if callable(self.storage):
+            return self.storage()
+        return STORAGES[self.storage]()
 
+    # Trace of the latest call made in this thread / context, or of the latest call anywhere
+    @property
+    def last_trace(self):
+        return self._context_trace.get() or self._last_trace
+
+    # Sequence of every distinct table state, each item is a numpy array
     @property
     def tables(self):
-        return self._tables
+        return self.last_trace.tables
+
+    # Table states of any watched name
+    def tables_for(self, name):
+        return self.last_trace.tables_for(name)
+
+    # WriteLog of the last traced table with capture='writes', None otherwise
+    @property
+    def write_log(self):
+        return self.last_trace.write_log
+
+    def write_log_for(self, name):
+        return self.last_trace.write_log_for(name)
+
+
+class Trace(object):
+    ''' the tables recorded during one call of a dpviz function, and its result '''
+
+    def __init__(self, viz, sink=None):
+        self.watch = viz.watch
+        self.capture = viz.capture
+        self.record_reads = viz.record_reads
+        self.result = None
+        self.elapsed = None  # seconds the call took, tracing included
+        self._stores = {name: viz._new_store() for name in self.watch}
+        # States are recorded into the targets, which also feed the sink when there is one
+        self._targets = dict(self._stores)
+        if sink is not None:
+            self._targets = {name: NotifyingStore(store, name, sink) for name, store in self._stores.items()}
+        self._tracked = {}  # name : TrackedArray with capture='writes'
+        # Without a policy to apply, states go straight to the targets
+        self._recorders = {}
+        if not viz.policy.records_all:
+            self._recorders = {name: viz.policy.recorder(target) for name, target in self._targets.items()}
+
+    # Only the result and the recorded tables are pickled, the write logs and sink belong to the live call
+    def __getstate__(self):
+        state = {k: v for k, v in self.__dict__.items() if k not in ('_targets', '_recorders', '_tracked')}
+        state['_stores'] = {name: _picklable(store) for name, store in self._stores.items()}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._targets = dict(self._stores)
+        self._recorders = {}
+        self._tracked = {}
+
+    # Store the watched tables of a frame if they exist
+    def record_frame(self, frame):
+        # f_locals builds a fresh dict on every access, so only touch it once
+        f_locals = frame.f_locals
+        for name in self.watch:
+            table = f_locals.get(name)
+            if table is not None:
+                recorded = self.record(name, table)
+                if recorded is not table:
+                    _rebind_local(frame, name, recorded)
+
+    # Record one state of a table, returns the object the function should keep using as that table
+    def record(self, name, table):
+        if self.capture == 'writes':
+            # Writes report themselves once the table is tracked, so only a new table needs work
+            if table is self._tracked.get(name):
+                return table
+            self._sync(name)
+            return self._track(name, table)
+        if name in self._recorders:
+            self._recorders[name].observe(table)
+        else:
+            # The store drops states equal to the previous one
+            self._targets[name].append(table)
+        return table
+
+    # Wrap a table in a TrackedArray feeding its store
+    def _track(self, name, table):
+        tracked = TrackedArray(table, self.record_reads)
+        if name in self._recorders:
+            self._recorders[name].observe(tracked)
+            tracked.log.listeners.append(self._recorders[name].change)
+        else:
+            self._targets[name].append(tracked)
+            tracked.log.listeners.append(self._targets[name].append_diff)
+        self._tracked[name] = tracked
+        return tracked
+
+    # Record what the writes of a tracked table didn't report, like fill or np.copyto, against the live table
+    def _sync(self, name):
+        tracked = self._tracked.get(name)
+        if tracked is None:
+            return
+        if name in self._recorders:
+            self._recorders[name].observe(np.asarray(tracked))
+        else:
+            self._targets[name].append(np.asarray(tracked))
+
+    # Record pending final states once the call is over
+    def finish(self):
+        for name in self._tracked:
+            self._sync(name)
+        for recorder in self._recorders.values():
+            recorder.finish()
+        for store in self._stores.values():
+            store.flush()
+
+    @property
+    def tables(self):
+        return self._stores[self.watch[0]]
+
+    def tables_for(self, name):
+        return self._stores[name]
+
+    @property
+    def write_log(self):
+        return self.write_log_for(self.watch[0])
+
+    def write_log_for(self, name):
+        tracked = self._tracked.get(name)
+        return tracked.log if tracked is not None else None
+
+
+# Stores backed by files are copied into memory to be pickled
+def _picklable(store):
+    if not isinstance(store, MemmapStore):
+        return store
+    copy = DeltaStore(store.keyframe_ratio)
+    for table in store:
+        copy.append(table)
+    return copy
+
+
+# Assign to a local variable of a running frame
+def _rebind_local(frame, name, value):
+    frame.f_locals[name] = value
+    # Before PEP 667 (3.13) f_locals is only a snapshot, so write it back into the frame
+    if sys.version_info < (3, 13):
+        ctypes.pythonapi.PyFrame_LocalsToFast(ctypes.py_object(frame), ctypes.c_int(0))
+
+
+# (code object, watched names, rebind_only) : line numbers of the code that can store into a watched table
+_store_cache = {}
+
+# Instructions storing into some object, which may be a watched table or a view of one
+STORE_INTO = ('STORE_SUBSCR', 'DELETE_SUBSCR', 'STORE_SLICE', 'STORE_ATTR', 'DELETE_ATTR')
+
+
+# Lines that can change a watched table: those rebinding a watched name, storing into a cell or attribute
+# of anything, or calling something on a line that mentions a watched name.
+# Only a call that gets hold of the table under another name, from a line that doesn't mention it, is missed
+def _store_lines(code, watch, rebind_only=False):
+    key = (code, watch, rebind_only)
+    lines = _store_cache.get(key)
+    if lines is None:
+        # A closure can rebind the name or write into the table from another code object, so every line counts
+        if set(watch) & set(code.co_cellvars):
+            lines = {line for _, _, line in code.co_lines()}
+        else:
+            lines = set()
+            calls, mentions = set(), set()
+            for ins in dis.get_instructions(code):
+                line = _line_of(code, ins.offset)
+                watched = bool(_names(ins.argval) & set(watch))
+                if ins.opname.startswith(('STORE_', 'DELETE_')) and watched:
+                    lines.add(line)
+                elif rebind_only:
+                    continue
+                elif ins.opname in STORE_INTO:
+                    lines.add(line)
+                elif ins.opname.startswith('CALL'):
+                    calls.add(line)
+                elif watched:
+                    mentions.add(line)
+            lines |= calls & mentions
+        lines = _store_cache[key] = frozenset(lines)
+    return lines
+
+
+# Source line of a bytecode offset
+def _line_of(code, offset):
+    for start, end, line in code.co_lines():
+        if start <= offset < end:
+            return line
+
+
+# Names an instruction refers to, some combined instructions of 3.13 take two
+def _names(argval):
+    if isinstance(argval, tuple):
+        return set(argval)
+    return {argval} if isinstance(argval, str) else set()
+
+
+# code object : Trace, for the calls running in the current context
+_active_traces = contextvars.ContextVar('dpviz_active_traces', default={})
+
+
+class _Monitor(object):
+    ''' shares one sys.monitoring tool id between every running dpviz trace
+        LINE, JUMP and PY_RETURN events are enabled on a code object while any call of it is being traced.
+        JUMP is needed because LINE does not fire again when a loop stays on one line, unlike settrace
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tool = None
+        self._codes = {}  # code object : number of traced calls running
+
+    def enter(self, code):
+        mon = sys.monitoring
+        with self._lock:
+            if self._tool is None:
+                self._tool = _claim_tool_id()
+                mon.register_callback(self._tool, mon.events.LINE, self._on_line)
+                mon.register_callback(self._tool, mon.events.JUMP, self._on_jump)
+                mon.register_callback(self._tool, mon.events.PY_RETURN, self._on_return)
+            if not self._codes.get(code):
+                mon.set_local_events(self._tool, code, mon.events.LINE | mon.events.JUMP | mon.events.PY_RETURN)
+            self._codes[code] = self._codes.get(code, 0) + 1
+
+    def exit(self, code):
+        mon = sys.monitoring
+        with self._lock:
+            self._codes[code] -= 1
+            if not self._codes[code]:
+                del self._codes[code]
+                mon.set_local_events(self._tool, code, 0)
+            if not self._codes:
+                mon.register_callback(self._tool, mon.events.LINE, None)
+                mon.register_callback(self._tool, mon.events.JUMP, None)
+                mon.register_callback(self._tool, mon.events.PY_RETURN, None)
+                mon.free_tool_id(self._tool)
+                self._tool = None
+
+    # Callbacks run as calls from the monitored frame, so it is one level up
+    @staticmethod
+    def _on_line(code, line_number):
+        trace = _active_traces.get().get(code)
+        if trace is not None:
+            trace.record_frame(sys._getframe(1))
+
+    @staticmethod
+    def _on_jump(code, instruction_offset, destination_offset):
+        trace = _active_traces.get().get(code)
+        if trace is not None:
+            trace.record_frame(sys._getframe(1))
+
+    @staticmethod
+    def _on_return(code, instruction_offset, retval):
+        trace = _active_traces.get().get(code)
+        if trace is not None:
+            trace.record_frame(sys._getframe(1))
+
+
+_monitor = _Monitor()
+
+
+# Grab a sys.monitoring tool id that no debugger, coverage or profiler tool is using
+def _claim_tool_id():
+    for tool in (3, 4, 2, 1, 0, 5):
+        try:
+            sys.monitoring.use_tool_id(tool, 'dpviz')
+        except ValueError:
+            continue
+        return tool
+    raise RuntimeError("No free sys.monitoring tool id for dpviz")
@@ -0,0 +1,129 @@
+# AST instrumentation for dpviz
+# Rewrites a DP function so a snapshot hook runs right after each assignment to a watched table,
+# instead of tracing every line with sys.settrace
+
+import ast
+import inspect
+import textwrap
+
+HOOK = '__dpviz_hook__'
+FACTORY = '__dpviz_factory__'
+
+# (code object, watched names, rebind_only) : compiled factory
+_cache = {}
+
+
+def instrument(func, watch=('dp_table', ), rebind_only=False):
+    ''' returns a factory taking hook(name, table) -> table and giving back an instrumented copy of func
+        After every statement that assigns to a watched name, or into it (name[i] = x, name.attr = x),
+        the hook is called with the name and its current value. When the statement rebinds the name itself,
+        the hook's return value is bound to it, which lets the hook swap in a tracked table.
+        With rebind_only, only statements rebinding a watched name get a hook.
+        The rewritten code is compiled once per function and cached.
+    '''
+    key = (func.__code__, tuple(watch), rebind_only)
+    factory = _cache.get(key)
+    if factory is None:
+        factory = _cache[key] = _compile(func, tuple(watch), rebind_only)
+
+    def bind(hook):
+        instrumented = factory(hook)
+        instrumented.__defaults__ = func.__defaults__
+        instrumented.__kwdefaults__ = func.__kwdefaults__
+        return instrumented
+
+    return bind
+
+
+def _compile(func, watch, rebind_only):
+    if func.__code__.co_freevars:
+        raise TypeError(f"Can not instrument '{func.__name__}', it is a closure over {func.__code__.co_freevars}")
+    source = textwrap.dedent(inspect.getsource(func))
+    tree = ast.parse(source)
+    fdef = tree.body[0]
+    if not isinstance(fdef, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        raise TypeError(f"Can not instrument '{func.__name__}', its source is not a function definition")
+    # Keep line numbers of the original file for tracebacks and debuggers
+    ast.increment_lineno(tree, func.__code__.co_firstlineno - 1)
+    fdef.decorator_list = []
+    _HookInserter(watch, rebind_only).visit_body(fdef)
+
+    # def __dpviz_factory__(__dpviz_hook__): <fdef>; return <name>
+    factory = ast.FunctionDef(name=FACTORY,
+                              args=ast.arguments(posonlyargs=[], args=[ast.arg(arg=HOOK)], kwonlyargs=[], kw_defaults=[], defaults=[]),
+                              body=[fdef, ast.Return(value=ast.Name(id=fdef.name, ctx=ast.Load()))],
+                              decorator_list=[],
+                              returns=None,
+                              type_params=[])
+    module = ast.Module(body=[ast.copy_location(factory, fdef)], type_ignores=[])
+    ast.fix_missing_locations(module)
+
+    code = compile(module, inspect.getsourcefile(func) or '<dpviz>', 'exec')
+    namespace = {}
+    # Module globals stay the globals of the instrumented function
+    exec(code, func.__globals__, namespace)
+    return namespace[FACTORY]
+
+
+class _HookInserter(ast.NodeTransformer):
+    ''' inserts hook calls after assignments to watched names, without entering nested scopes '''
+
+    def __init__(self, watch, rebind_only):
+        self.watch = watch
+        self.rebind_only = rebind_only
+
+    def visit_body(self, node):
+        # Rewrite every statement list of node (body, orelse, finalbody, ...)
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list) and value and isinstance(value[0], ast.stmt):
+                setattr(node, field, self._rewrite(value))
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, (ast.excepthandler, ast.match_case)):
+                        self.visit_body(item)
+        return node
+
+    def _rewrite(self, statements):
+        rewritten = []
+        for stmt in statements:
+            if not isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                self.visit_body(stmt)
+            rewritten.append(stmt)
+            rewritten.extend(self._hooks(stmt))
+        return rewritten
+
+    def _hooks(self, stmt):
+        if isinstance(stmt, ast.Assign):
+            targets = stmt.targets
+        elif isinstance(stmt, (ast.AugAssign, ast.AnnAssign)) and stmt.value is not None:
+            targets = [stmt.target]
+        else:
+            return []
+        rebound, mutated = set(), set()
+        for target in targets:
+            _collect(target, rebound, mutated)
+        hooks = []
+        for name in self.watch:
+            call = ast.Call(func=ast.Name(id=HOOK, ctx=ast.Load()), args=[ast.Constant(value=name), ast.Name(id=name, ctx=ast.Load())], keywords=[])
+            if name in rebound:
+                hooks.append(ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())], value=call))
+            elif name in mutated and not self.rebind_only:
+                hooks.append(ast.Expr(value=call))
+        return [ast.copy_location(hook, stmt) for hook in hooks]
+
+
+# Split the names an assignment target touches into rebound (x = ...) and mutated (x[i] = ..., x.a = ...)
+def _collect(target, rebound, mutated):
+    if isinstance(target, ast.Name):
+        rebound.add(target.id)
+    elif isinstance(target, (ast.Tuple, ast.List)):
+        for elt in target.elts:
+            _collect(elt, rebound, mutated)
+    elif isinstance(target, ast.Starred):
+        _collect(target.value, rebound, mutated)
+    elif isinstance(target, (ast.Subscript, ast.Attribute)):
+        root = target.value
+        while isinstance(root, (ast.Subscript, ast.Attribute)):
+            root = root.value
+        if isinstance(root, ast.Name):
+            mutated.add(root.id)
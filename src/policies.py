@@ -0,0 +1,136 @@
+# Recording policies for dpviz
+# Decide which of the table states seen while tracing are kept, so long runs cost bounded memory and time
+
+import time
+import numpy as np
+
+SAMPLINGS = ('even', 'adaptive')
+
+
+class RecordingPolicy(object):
+    ''' which table states dpviz records
+        max_frames   - cap on stored frames. Once reached, the frames are thinned to about half, evenly spaced
+                       in progress, and from then on the recording stride doubles
+        sampling     - how progress is measured: 'even' counts changes, 'adaptive' counts changed cells,
+                       so steps that change many cells keep more frames
+        every        - record every k-th change
+        rows         - record the table whenever writes move on to a new row (first axis)
+        min_interval - minimum seconds of wall-clock time between recorded frames
+        The first state seen and the final state are always recorded.
+    '''
+
+    def __init__(self, max_frames=None, sampling='even', every=1, rows=False, min_interval=None):
+        if max_frames is not None and max_frames < 2:
+            raise ValueError('max_frames must be at least 2, to keep the first and final states')
+        if sampling not in SAMPLINGS:
+            raise ValueError(f"Unknown sampling '{sampling}', expected one of {SAMPLINGS}")
+        if every < 1:
+            raise ValueError('every must be at least 1')
+        self.max_frames = max_frames
+        self.sampling = sampling
+        self.every = every
+        self.rows = rows
+        self.min_interval = min_interval
+
+    @property
+    def records_all(self):
+        return self.max_frames is None and self.every == 1 and not self.rows and not self.min_interval
+
+    def recorder(self, store):
+        return Recorder(store, self)
+
+
+class Recorder(object):
+    ''' applies a RecordingPolicy to the states of one table before they reach its SnapshotStore
+        States come in through observe() as whole tables or through change() as diffs, and are
+        handed to the store as diffs against the last recorded frame
+    '''
+
+    def __init__(self, store, policy):
+        self.store = store
+        self.policy = policy
+        self._last = None  # newest state seen
+        self._pending = []  # ids changed since the last recorded frame
+        self._row = None  # row the pending changes are in
+        self._rows_since = 0  # row boundaries since the last recorded frame
+        self._row_stride = 1
+        self._since = 0  # progress since the last recorded frame
+        self._progress = 0  # total progress
+        self._marks = []  # progress at each stored frame
+        self._threshold = policy.every
+        self._time = None  # when the last frame was recorded
+
+    def observe(self, table):
+        table = np.asarray(table)
+        if self._last is None or table.shape != self._last.shape or table.dtype != self._last.dtype:
+            # A new table always starts with a full frame
+            self.finish()
+            self._last = np.array(table)
+            if self.store.append(table):
+                self._mark()
+            return
+        ids = np.flatnonzero(table != self._last)
+        if len(ids):
+            self.change(ids, table.reshape(-1)[ids])
+
+    def change(self, ids, values):
+        policy = self.policy
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if policy.rows:
+            row = self._rows(ids)
+            # Writes moved on, so the pending state is the end of a row
+            if self._pending and row != self._row:
+                self._rows_since += 1
+                if self._rows_since >= self._row_stride and self._throttle():
+                    self._record()
+            self._row = row
+        self._last.reshape(-1)[ids] = values
+        self._pending.append(ids)
+        step = len(ids) if policy.sampling == 'adaptive' else 1
+        self._since += step
+        self._progress += step
+        if (not policy.rows or policy.every > 1) and self._since >= self._threshold and self._throttle():
+            self._record()
+
+    def finish(self):
+        ''' record the final state if it hasn't been '''
+        if self._pending:
+            self._record()
+
+    def _rows(self, ids):
+        # 1-D tables treat every cell as its own row
+        if self._last.ndim < 2:
+            return int(ids[0])
+        return int(ids[0]) // (self._last.size // self._last.shape[0])
+
+    def _throttle(self):
+        interval = self.policy.min_interval
+        return not interval or self._time is None or time.perf_counter() - self._time >= interval
+
+    def _record(self):
+        ids = np.concatenate(self._pending)
+        self._pending = []
+        self._since = 0
+        self._rows_since = 0
+        if self.store.append_diff(ids, self._last.reshape(-1)[ids]):
+            self._mark()
+
+    def _mark(self):
+        self._marks.append(self._progress)
+        self._time = time.perf_counter()
+        max_frames = self.policy.max_frames
+        if max_frames and len(self.store) >= max_frames:
+            self._decimate(max(2, max_frames // 2))
+
+    def _decimate(self, n):
+        # Keep the frames closest to n evenly spaced points of progress, always including first and last
+        marks = np.array(self._marks)
+        keep = np.searchsorted(marks, np.linspace(marks[0], marks[-1], n))
+        # A new table is marked at the progress of the old one's last frame, so marks can repeat and
+        # searchsorted would pick the first of them, the last frame must be kept by index
+        keep[-1] = len(marks) - 1
+        keep = np.unique(keep)
+        self.store.select(keep)
+        self._marks = list(marks[keep])
+        self._threshold *= 2
+        self._row_stride *= 2
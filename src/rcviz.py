@@ -5,169 +5,557 @@
 
 # Modified 11/2019 by Brian Ward to use graphviz over pygraphviz and to pipe image instead of render
 
-import inspect
+from array import array
 import graphviz as gviz
+from rendering import RenderJob
+from cache import make_key, source_hash
+import hashlib
 import logging
 import copy
+import contextvars
 import functools
+import heapq
+import time
 
+# how rcviz records return values and tracked data
+# 'auto'      - immutable values by reference, anything else as a label rendered at record time
+# 'reference' - always by reference, later mutation shows up in the graph
+# 'deepcopy'  - a deep copy of every value
+RECORD_MODES = ('auto', 'reference', 'deepcopy')
 
-class callgraph(object):
-    '''singleton class that stores global graph data
-       draw graph using graphviz
-    '''
-
-    _callers = {}  # caller_fn_id : node_data
-    _counter = 1  # track call order
-    _unwindcounter = 1  # track unwind order
-    _frames = []  # keep frame objects reference
-
-    @staticmethod
-    def reset():
-        callgraph._callers = {}
-        callgraph._counter = 1
-        callgraph._frames = []
-        callgraph._unwindcounter = 1
-
-    @staticmethod
-    def get_callers():
-        return callgraph._callers
-
-    @staticmethod
-    def get_counter():
-        return callgraph._counter
+# which subtrees callgraph.render keeps collapsed when over its node budget
+# 'depth'   - the deepest ones
+# 'largest' - the largest ones
+COLLAPSE_MODES = ('depth', 'largest')
 
-    @staticmethod
-    def get_unwindcounter():
-        return callgraph._unwindcounter
+# values of these types can't change after being recorded
+IMMUTABLE_TYPES = (int, float, complex, bool, str, bytes, type(None), range, frozenset)
 
-    @staticmethod
-    def increment():
-        callgraph._counter += 1
 
-    @staticmethod
-    def increment_unwind():
-        callgraph._unwindcounter += 1
+class callgraph(object):
+    '''recorder that stores the graph data of one tracing session
+       nodes get sequential ids in call order, per node data is kept in parallel arrays indexed by id
+       rcviz records into callgraph.current(): the graph of the innermost `with callgraph() as graph:`
+       block of the running thread or task, or a shared default graph outside of any
+       a graph can be pickled, to send it back from a worker process
+       with memo=True, calls with equal function and arguments share one node, which gives the DAG of
+       distinct subproblems instead of the recursion tree
+       draw graph using graphviz
+    '''
 
-    @staticmethod
-    def get_frames():
-        return callgraph._frames
+    def __init__(self, memo=False):
+        self.memo = memo
+        self.key = None  # cache key of the traced call, set by rcviz.trace
+        self.result = None
+        self._tokens = []  # one per `with` block this graph is active in
+        self.reset()
 
     @staticmethod
-    def render(ext='png', show_null_returns=True):
-
+    def current():
+        return _current_graph.get(_default_graph)
+
+    def __enter__(self):
+        self._tokens.append(_current_graph.set(self))
+        return self
+
+    def __exit__(self, *exc):
+        _current_graph.reset(self._tokens.pop())
+
+    # only the recorded graph is pickled, not the state of a running session
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tokens'] = []
+        state['_stack'] = []
+        # Nodes go as columns, much smaller and faster to pickle than one object per call
+        nodes = self._nodes
+        state['_nodes'] = ([n.args for n in nodes], [n.kwargs for n in nodes], [n.ret for n in nodes],
+                           {i: n.auxdata for i, n in enumerate(nodes) if n.auxdata is not None})
+        return state
+
+    def __setstate__(self, state):
+        args, kwargs, rets, auxdata = state['_nodes']
+        state['_nodes'] = list(map(node_data, args, kwargs, rets))
+        for node_id, data in auxdata.items():
+            state['_nodes'][node_id].auxdata = data
+        self.__dict__.update(state)
+
+    def reset(self):
+        self._nodes = []  # node id : node_data
+        self._parents = array('l')  # node id : caller node id, -1 for a root call
+        self._calls = array('l')  # node id : call order of the edge from its caller, 0 for a root call
+        self._unwinds = array('l')  # node id : unwind order of the edge from its caller, 0 until it returns
+        self._fns = array('l')  # node id : index into _fn_names
+        self._fn_names = []
+        self._fn_ids = {}  # fn name : index into _fn_names
+        self._sources = set()  # (source hash, record, max_label) of every rcviz function that recorded a call
+        self._times = array('d')  # node id : seconds spent in its calls, summed over all of them
+        self._hits = array('l')  # node id : number of calls it stands for
+        self._keys = {}  # memo only, (fn index, args, kwargs) : node id
+        self._edges = {}  # memo only, (caller node id, node id) : number of calls
+        self.total_calls = 0
+        self._counter = 1  # track call order
+        self._unwindcounter = 1  # track unwind order
+        self._stack = []  # node ids of the traced calls currently running, innermost last
+        self._subtree_cache = None
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def add_node(self, fn_name, args, kwargs, parent, source=None):
+        ''' records a call made from node parent (-1 for none) and returns its node id
+            source identifies the recording function for fingerprint()
+        '''
+        if source is not None:
+            self._sources.add(source)
+        fn = self._fn_ids.get(fn_name)
+        if fn is None:
+            fn = self._fn_ids[fn_name] = len(self._fn_names)
+            self._fn_names.append(fn_name)
+        self.total_calls += 1
+        if self.memo:
+            key = _memo_key(fn, args, kwargs)
+            node_id = self._keys.get(key)
+            if node_id is not None:
+                self._hits[node_id] += 1
+                if parent >= 0:
+                    self._edges[parent, node_id] = self._edges.get((parent, node_id), 0) + 1
+                return node_id
+            self._keys[key] = len(self._nodes)
+            if parent >= 0:
+                self._edges[parent, len(self._nodes)] = 1
+        self._nodes.append(node_data(args, kwargs))
+        self._parents.append(parent)
+        self._fns.append(fn)
+        if parent < 0:
+            self._calls.append(0)
+        else:
+            self._calls.append(self._counter)
+            self._counter += 1
+        self._unwinds.append(0)
+        self._times.append(0.0)
+        self._hits.append(1)
+        return len(self._nodes) - 1
+
+    def unwind(self, node_id, elapsed):
+        self._times[node_id] += elapsed
+        # memo nodes keep the order of their first call only
+        if self._parents[node_id] >= 0 and not (self.memo and self._unwinds[node_id]):
+            self._unwinds[node_id] = self._unwindcounter
+            self._unwindcounter += 1
+
+    def get_nodes(self):
+        return self._nodes
+
+    def get_parents(self):
+        return self._parents
+
+    def depths(self):
+        ''' depth of every node, 0 for a root call '''
+        return self._subtrees()[0]
+
+    def fn_name(self, node_id):
+        return self._fn_names[self._fns[node_id]]
+
+    def children(self):
+        ''' list of child node ids for every node, in call order '''
+        children = [[] for _ in self._nodes]
+        for node_id, parent in enumerate(self._parents):
+            if parent >= 0:
+                children[parent].append(node_id)
+        return children
+
+    def edges(self):
+        ''' (caller node id, node id, number of calls) for every edge, in order of first call '''
+        if self.memo:
+            return [(src, dst, count) for (src, dst), count in self._edges.items()]
+        return [(node_id, child_id, 1) for node_id, child_ids in enumerate(self.children()) for child_id in child_ids]
+
+    def hits(self, node_id):
+        return self._hits[node_id]
+
+    def order(self, node_id):
+        ''' (call order, unwind order) of a node, the numbers on the edge into it
+            the unwind order is 0 for a call that raised instead of returning
+        '''
+        return self._calls[node_id], self._unwinds[node_id]
+
+    def time(self, node_id):
+        ''' seconds spent in the calls of a node, including the calls it made '''
+        return self._times[node_id]
+
+    def get_counter(self):
+        return self._counter
+
+    def get_unwindcounter(self):
+        return self._unwindcounter
+
+    def get_stack(self):
+        return self._stack
+
+    def visible(self, max_nodes=None, max_depth=None, collapse='depth', expand=()):
+        ''' picks the nodes of the recursion tree to draw when it is too big to draw whole
+            Starting from the root calls, nodes are opened (their children shown) while the number of shown
+            nodes stays within max_nodes and their depth below max_depth. collapse='depth' opens shallow
+            nodes first, collapse='largest' opens small subtrees first so the largest ones stay collapsed.
+            The nodes in expand, and their ancestors, are always opened.
+            Returns the shown node ids in call order and the set of shown nodes whose subtree is hidden.
+            Memo graphs are bounded by their number of subproblems and are always shown whole.
+        '''
+        if collapse not in COLLAPSE_MODES:
+            raise ValueError("unknown collapse mode '%s', expected one of %s" % (collapse, COLLAPSE_MODES))
+        if self.memo or (max_nodes is None and max_depth is None and not expand):
+            return list(range(len(self._nodes))), set()
+
+        depth, size = self._subtrees()[:2]
+        children = self.children()
+        forced = set()
+        for node_id in expand:
+            while node_id >= 0 and node_id not in forced:
+                forced.add(node_id)
+                node_id = self._parents[node_id]
+
+        shown = [node_id for node_id, parent in enumerate(self._parents) if parent < 0]
+        budget = max_nodes - len(shown) if max_nodes is not None else len(self._nodes)
+        priority = depth if collapse == 'depth' else size
+        candidates = [(priority[node_id], node_id) for node_id in shown if children[node_id]]
+        heapq.heapify(candidates)
+        opened = set()
+        while candidates:
+            _, node_id = heapq.heappop(candidates)
+            kids = children[node_id]
+            if node_id not in forced:
+                if max_depth is not None and depth[node_id] >= max_depth:
+                    continue
+                # a smaller subtree further on may still fit
+                if len(kids) > budget:
+                    continue
+            budget -= len(kids)
+            opened.add(node_id)
+            shown.extend(kids)
+            for kid in kids:
+                if children[kid]:
+                    heapq.heappush(candidates, (priority[kid], kid))
+
+        shown.sort()
+        return shown, {node_id for node_id in shown if children[node_id] and node_id not in opened}
+
+    def summary(self, node_id):
+        ''' (calls below the node, levels below it, smallest and largest numeric return value below it) '''
+        depth, size, height, low, high = self._subtrees()
+        return size[node_id] - 1, height[node_id], low[node_id], high[node_id]
+
+    def _subtrees(self):
+        # depth, subtree size, subtree height and return range of every node, cached until the graph changes
+        key = (len(self._nodes), self._unwindcounter)
+        if self._subtree_cache and self._subtree_cache[0] == key:
+            return self._subtree_cache[1]
+        n = len(self._nodes)
+        parents = self._parents
+        depth = array('l', bytes(n * array('l').itemsize))
+        # callers always have a smaller id than their calls
+        for node_id in range(n):
+            if parents[node_id] >= 0:
+                depth[node_id] = depth[parents[node_id]] + 1
+        size = array('l', [1]) * n
+        height = array('l', bytes(n * array('l').itemsize))
+        low, high = [None] * n, [None] * n
+        for node_id in range(n - 1, -1, -1):
+            parent = parents[node_id]
+            if parent < 0:
+                continue
+            size[parent] += size[node_id]
+            height[parent] = max(height[parent], height[node_id] + 1)
+            ret = self._nodes[node_id].ret
+            for value in (low[node_id], high[node_id], ret if type(ret) in (int, float) else None):
+                if value is not None:
+                    if low[parent] is None or value < low[parent]:
+                        low[parent] = value
+                    if high[parent] is None or value > high[parent]:
+                        high[parent] = value
+        self._subtree_cache = (key, (depth, size, height, low, high))
+        return self._subtree_cache[1]
+
+    def render(self, ext='png', show_null_returns=True, max_nodes=None, max_depth=None, collapse='depth', expand=(), engine='dot', cache=None):
+        ''' draws the graph and returns the image bytes
+            see visible for how max_nodes, max_depth, collapse and expand limit the drawn nodes,
+            a collapsed node is drawn shaded, with the number of calls, levels and return values it hides
+            with a cache.RenderCache, an image drawn before with the same options is returned from it
+        '''
+        return self.render_job(ext, show_null_returns, max_nodes, max_depth, collapse, expand, engine, cache).run()
+
+    def render_async(self, ext='png', show_null_returns=True, max_nodes=None, max_depth=None, collapse='depth', expand=(), engine='dot', cache=None):
+        ''' like render, but starts a rendering.RenderJob in a worker thread and returns it
+            the image bytes arrive in job.future, job.progress tells how far along it is and job.cancel() stops it
+        '''
+        return self.render_job(ext, show_null_returns, max_nodes, max_depth, collapse, expand, engine, cache).start()
+
+    def render_job(self, ext='png', show_null_returns=True, max_nodes=None, max_depth=None, collapse='depth', expand=(), engine='dot', cache=None):
+        if cache is not None:
+            # graphs from rcviz.trace are named by their call, others by their structure
+            key = make_key('callgraph.render', self.key or self.fingerprint(), ext, show_null_returns, max_nodes, max_depth, collapse,
+                           sorted(expand), engine)
+            image = cache.get(key)
+            if image is not None:
+                return RenderJob.finished(image, ext, engine)
+
+        job = RenderJob(None, ext, engine)
+        if cache is not None:
+
+            def store(future):
+                if not future.cancelled() and future.exception() is None:
+                    cache.put(key, future.result())
+
+            job.future.add_done_callback(store)
+
+        def lines():
+            # picking the nodes is part of the job, so it runs in the worker too
+            shown, collapsed = self.visible(max_nodes, max_depth, collapse, expand)
+            job.total = len(shown) + (len(self._edges) if self.memo else len(shown))
+            yield from self._dot_lines(shown, collapsed, show_null_returns)
+
+        job.lines = lines()
+        return job
+
+    def digest(self):
+        ''' digest of the whole graph's DOT source '''
+        digest = hashlib.sha256()
+        for line in self.dot_lines():
+            digest.update(line.encode())
+        return digest.hexdigest()
+
+    def fingerprint(self):
+        ''' digest of everything the DOT source is made of, the arrays, function names and per node labels,
+            and of the functions that recorded the calls, without building any DOT
+        '''
+        digest = hashlib.sha256()
+        for column in (self._parents, self._calls, self._unwinds, self._fns, self._hits):
+            digest.update(column.tobytes())
+        # the per node columns __getstate__ pickles
+        nodes = self._nodes
+        labels = ([n.args for n in nodes], [n.kwargs for n in nodes], [n.ret for n in nodes],
+                  {i: n.auxdata for i, n in enumerate(nodes) if n.auxdata is not None})
+        digest.update(make_key(self.memo, self._fn_names, sorted(self._sources, key=repr), labels,
+                               sorted(self._edges.items())).encode())
+        return digest.hexdigest()
+
+    def dot_lines(self, show_null_returns=True, max_nodes=None, max_depth=None, collapse='depth', expand=()):
+        ''' the DOT source of the graph, one line at a time '''
+        shown, collapsed = self.visible(max_nodes, max_depth, collapse, expand)
+        return self._dot_lines(shown, collapsed, show_null_returns)
+
+    def _dot_lines(self, shown, collapsed, show_null_returns):
         g = gviz.Digraph()
         g.graph_attr['fontname'] = "helvetica"
         g.graph_attr['bgcolor'] = "transparent"
         g.node_attr['fontname'] = "helvetica"
         g.edge_attr['fontname'] = "helvetica"
         g.graph_attr['dpi'] = '100'
+        if self.memo:
+            g.graph_attr['label'] = "%d calls, %d distinct" % (self.total_calls, len(self._nodes))
+
+        # the empty graph gives the header and the closing brace, nodes and edges are streamed in between
+        header = list(g)
+        yield from header[:-1]
 
         # create nodes
-        for frame_id, node in callgraph._callers.items():
+        for node_id in shown:
+            node = self._nodes[node_id]
 
             auxstr = ""
-            for param, val in node.auxdata.items():
+            for param, val in (node.auxdata or {}).items():
                 auxstr += " | %s: %s" % (param, val)
 
+            if self.memo:
+                first = " | first call: %d" % self._calls[node_id] if self._parents[node_id] >= 0 else ""
+                auxstr += " | calls: %d%s | time: %.3f ms" % (self._hits[node_id], first, self._times[node_id] * 1000)
+
+            style = {}
+            if node_id in collapsed:
+                calls, levels, low, high = self.summary(node_id)
+                auxstr += " | %d calls in %d levels below" % (calls, levels)
+                if low is not None:
+                    auxstr += " | rets: %s .. %s" % (low, high)
+                style = {'style': 'filled', 'fillcolor': '#dddddd'}
+
+            fn_name = self.fn_name(node_id)
             if not show_null_returns and node.ret is None:
-                label = "{ %s(%s) %s }" % (node.fn_name, node.argstr(), auxstr)
+                label = "{ %s(%s) %s }" % (fn_name, node.argstr(), auxstr)
             else:
-                label = "{ %s(%s) %s | ret: %s }" % (node.fn_name, node.argstr(), auxstr, node.ret)
-            g.node(str(frame_id), shape='Mrecord', label=label, fontsize='13', labelfontsize='13')
+                label = "{ %s(%s) %s | ret: %s }" % (fn_name, node.argstr(), auxstr, node.ret)
+            yield _node_line(node_id, label, shape='Mrecord', fontsize='13', labelfontsize='13', **style)
 
         # create edges
-        for frame_id, node in callgraph._callers.items():
-            child_nodes = []
-            for child_id, counter, unwind_counter in node.child_methods:
-                child_nodes.append(child_id)
-                label = f"<{counter} (&#8593; {unwind_counter})>"
-                g.edge(str(frame_id), str(child_id), label=label, fontsize='8', labelfontsize='8', fontcolor="#999999")
-
-        return g.pipe(format=ext)
+        if self.memo:
+            for node_id, child_id, count in self.edges():
+                yield _edge_line(node_id, child_id, f"<&#215;{count}>", fontsize='8', labelfontsize='8', fontcolor="#999999")
+        else:
+            for child_id in shown:
+                node_id = self._parents[child_id]
+                if node_id < 0:
+                    continue
+                unwind = self._unwinds[child_id]
+                if unwind:
+                    label = f"<{self._calls[child_id]} (&#8593; {unwind})>"
+                else:
+                    # the call raised instead of returning
+                    label = f"<{self._calls[child_id]}>"
+                yield _edge_line(node_id, child_id, label, fontsize='8', labelfontsize='8', fontcolor="#999999")
+
+        yield header[-1]
 
 
 class node_data(object):
-    def __init__(self, _args=None, _kwargs=None, _fnname="", _ret=None, _childmethods=[]):
+    ''' the per call values that can't go in callgraph's arrays '''
+    __slots__ = ('args', 'kwargs', 'ret', 'auxdata')
+
+    def __init__(self, _args=None, _kwargs=None, _ret=None):
         self.args = _args
         self.kwargs = _kwargs
-        self.fn_name = _fnname
         self.ret = _ret
-        self.child_methods = _childmethods  # [ (method, gcounter) ]
-
-        self.auxdata = {}  # user assigned track data
-
-    def __str__(self):
-        return "%s -> child_methods: %s" % (self.nodestr(), self.child_methods)
+        self.auxdata = None  # user assigned track data, a dict once track is called
 
-    def nodestr(self):
-        return "%s = %s(%s)" % (self.ret, self.fn_name, self.argstr())
+    def nodestr(self, fn_name):
+        return "%s = %s(%s)" % (self.ret, fn_name, self.argstr())
 
     def argstr(self):
         s_args = ",".join([str(arg) for arg in self.args])
-        s_kwargs = ",".join([(str(k), str(v)) for (k, v) in self.kwargs.items()])
+        s_kwargs = ",".join(["%s=%s" % (k, v) for (k, v) in self.kwargs.items()])
         return "%s%s" % (s_args, s_kwargs)
 
 
 class rcviz(object):
-    ''' decorator to construct the call graph with args and return values as labels '''
-    def __init__(self, wrapped):
+    ''' decorator to construct the call graph with args and return values as labels
+        record picks how return values and tracked data are kept (see RECORD_MODES),
+        max_label bounds the length of labels rendered for mutable values,
+        with a cache.RenderCache, trace returns graphs recorded before for the same source and arguments
+    '''
+
+    # allow both @rcviz and @rcviz(record=...) forms
+    def __new__(cls, wrapped=None, **kwargs):
+        if wrapped is None:
+            return functools.partial(cls, **kwargs)
+        return super().__new__(cls)
+
+    def __init__(self, wrapped, record='auto', max_label=60, cache=None):
+        if record not in RECORD_MODES:
+            raise ValueError("unknown record mode '%s', expected one of %s" % (record, RECORD_MODES))
         self._verbose = False
         self.wrapped = wrapped
+        self.record = record
+        self.max_label = max_label
+        self.cache = cache
+        self._source_hash = None
         functools.update_wrapper(self, wrapped)
 
+    # Call the function in a callgraph of its own and return the graph, with the return value in graph.result
+    # With memo=True the graph is the DAG of distinct calls, as callgraph(memo=True) records it
+    def trace(self, *args, memo=False, **kwargs):
+        key = self.cache_key(*args, memo=memo, **kwargs)
+        if self.cache is not None:
+            graph = self.cache.get_object(key)
+            if graph is not None:
+                return graph
+        with callgraph(memo) as graph:
+            graph.result = self(*args, **kwargs)
+        graph.key = key
+        if self.cache is not None:
+            self.cache.put_object(key, graph)
+        return graph
+
+    # Key of a call's graph in the cache, from the function source, arguments and recording options
+    def cache_key(self, *args, memo=False, **kwargs):
+        source, record, max_label = self._source()
+        return make_key('rcviz.trace', source, args, kwargs, record, max_label, memo)
+
+    # The function source and recording options, which decide the labels of its nodes
+    def _source(self):
+        if self._source_hash is None:
+            self._source_hash = source_hash(self.wrapped)
+        return self._source_hash, self.record, self.max_label
+
     def track(self, **kwargs):
-        call_frame_id = id(inspect.stack()[2][0])
-        g_callers = callgraph.get_callers()
-        node = g_callers.get(call_frame_id)
-        if node:
-            node.auxdata.update(copy.deepcopy(kwargs))
+        # the innermost running call is the one track was called from
+        graph = callgraph.current()
+        g_stack = graph.get_stack()
+        if g_stack:
+            node = graph.get_nodes()[g_stack[-1]]
+            if node.auxdata is None:
+                node.auxdata = {}
+            node.auxdata.update({k: self.record_value(v) for k, v in kwargs.items()})
+
+    def record_value(self, value):
+        if self.record == 'deepcopy':
+            return copy.deepcopy(value)
+        if self.record == 'reference' or _immutable(value):
+            return value
+        # the same str() the label would show for the value itself
+        label = str(value)
+        if len(label) > self.max_label:
+            label = label[:self.max_label - 3] + '...'
+        return label
+
+    # pickle by name, so decorated functions can be sent to worker processes
+    def __reduce__(self):
+        return self.__qualname__
 
     def __call__(self, *args, **kwargs):
 
-        g_callers = callgraph.get_callers()
-        g_frames = callgraph.get_frames()
-
-        # find the caller frame, and add self as a child node
-        caller_frame_id = None
+        graph = callgraph.current()
+        g_stack = graph.get_stack()
 
-        fullstack = inspect.stack()
+        # the caller is the innermost traced call still running, add self as its child node
+        caller_id = g_stack[-1] if g_stack else -1
+        if (self._verbose):
+            logging.debug("caller node: %s" % caller_id)
 
+        node_id = graph.add_node(self.wrapped.__name__, args, kwargs, caller_id, self._source())
         if (self._verbose):
-            logging.debug("full stack: %s" % str(fullstack))
+            logging.info("this node: %s" % node_id)
 
-        if len(fullstack) > 2:
-            caller_frame_id = id(fullstack[2][0])
-            if (self._verbose):
-                logging.debug("caller frame: %s %s" % (caller_frame_id, fullstack[2]))
+        # invoke wraped
+        g_stack.append(node_id)
+        start = time.perf_counter()
+        try:
+            ret = self.wrapped(*args, **kwargs)
+        finally:
+            g_stack.pop()
 
-        this_frame_id = id(fullstack[0][0])
         if (self._verbose):
-            logging.info("this frame: %s %s" % (this_frame_id, fullstack[0]))
+            logging.debug('unwinding node id: %s' % node_id)
 
-        if this_frame_id not in g_frames:
-            g_frames.append(fullstack[0][0])
+        graph.unwind(node_id, time.perf_counter() - start)
+        graph.get_nodes()[node_id].ret = self.record_value(ret)
 
-        if this_frame_id not in g_callers.keys():
-            g_callers[this_frame_id] = node_data(args, kwargs, self.wrapped.__name__, None, [])
+        return ret
 
-        edgeinfo = None
-        if caller_frame_id:
-            edgeinfo = [this_frame_id, callgraph.get_counter()]
-            if (caller_frame_id in g_callers):
-                g_callers[caller_frame_id].child_methods.append(edgeinfo)
-            callgraph.increment()
 
-        # invoke wraped
-        ret = self.wrapped(*args, **kwargs)
+_default_graph = callgraph()
+_current_graph = contextvars.ContextVar('rcviz_callgraph')
 
-        if (self._verbose):
-            logging.debug('unwinding frame id: %s' % this_frame_id)
 
-        if edgeinfo:
-            edgeinfo.append(callgraph.get_unwindcounter())
-            callgraph.increment_unwind()
+# the lines graphviz.Digraph.node and edge would add
+def _node_line(node_id, label, **attrs):
+    return '\t%s%s\n' % (node_id, gviz.quoting.attr_list(label, kwargs=attrs))
 
-        g_callers[this_frame_id].ret = copy.deepcopy(ret)
 
-        return ret
+def _edge_line(tail_id, head_id, label, **attrs):
+    return '\t%s -> %s%s\n' % (tail_id, head_id, gviz.quoting.attr_list(label, kwargs=attrs))
+
+
+def _memo_key(fn, args, kwargs):
+    key = (fn, args, tuple(kwargs.items()) if kwargs else ())
+    try:
+        hash(key)
+    except TypeError:
+        # unhashable arguments like lists are compared by value through their repr
+        key = (fn, repr(args), repr(kwargs))
+    return key
+
+
+def _immutable(value, depth=2):
+    if type(value) in IMMUTABLE_TYPES:
+        return True
+    # small tuples of immutable values, like the argument tuples of a DP
+    if type(value) is tuple and depth and len(value) <= 16:
+        return all(_immutable(v, depth - 1) for v in value)
+    return False
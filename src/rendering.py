@@ -0,0 +1,152 @@
+# Out of process graph rendering
+# DOT text is written into the layout program's stdin while it is generated, from a worker thread,
+# so a large render never holds the whole source in memory and never blocks the Tk main loop
+
+import os
+import signal
+import subprocess
+import threading
+from concurrent.futures import Future
+import graphviz as gviz
+
+ENGINES = ('dot', 'neato', 'twopi', 'circo', 'fdp', 'sfdp')
+
+
+class RenderCancelled(Exception):
+    ''' raised from a render job's future once it was cancelled '''
+
+
+class RenderJob(object):
+    ''' one run of a graphviz engine over an iterable of DOT lines
+        start() runs it in a daemon thread and returns at once, run() runs it in the calling thread.
+        future is a concurrent.futures.Future that receives the image bytes, RenderCancelled after cancel(),
+        or the graphviz.ExecutableNotFound / graphviz.CalledProcessError that graphviz.pipe would raise.
+        progress is the fraction of the total expected lines written so far, None while total is unknown;
+        the engine lays the graph out after the last line, so the future completes some time after progress is 1.
+    '''
+
+    def __init__(self, lines, ext='png', engine='dot', total=None, chunk_size=1 << 16):
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine '{engine}', expected one of {ENGINES}")
+        self.lines = lines
+        self.ext = ext
+        self.engine = engine
+        self.total = total
+        self.chunk_size = chunk_size
+        self.written = 0
+        self.future = Future()
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._process = None
+
+    @classmethod
+    def finished(cls, image, ext='png', engine='dot'):
+        ''' a job that is already done, for images that don't need rendering '''
+        job = cls(iter(()), ext, engine, total=1)
+        job.written = 1
+        job.future.set_result(image)
+        return job
+
+    @property
+    def progress(self):
+        if not self.total:
+            return None
+        return min(self.written / self.total, 1.0)
+
+    def start(self):
+        threading.Thread(target=self._work, daemon=True).start()
+        return self
+
+    def run(self):
+        self._work()
+        return self.future.result()
+
+    def cancel(self):
+        ''' stops the render, killing the engine if it already started '''
+        self._cancelled.set()
+        with self._lock:
+            process = self._process
+        if process is not None and process.poll() is None:
+            _kill(process)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _work(self):
+        if self.future.done() or not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            image = self._render()
+        except BaseException as e:
+            self.future.set_exception(RenderCancelled() if self.cancelled else e)
+        else:
+            self.future.set_result(image)
+
+    def _render(self):
+        cmd = [self.engine, '-T' + self.ext]
+        with self._lock:
+            if self.cancelled:
+                raise RenderCancelled()
+            try:
+                # in a session of its own, so cancel can kill it along with anything it started
+                self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                 start_new_session=(os.name == 'posix'))
+            except FileNotFoundError as e:
+                raise gviz.ExecutableNotFound(cmd) from e
+        process = self._process
+
+        # Drain both outputs while writing, so a chatty engine can't block on a full pipe
+        stdout, stderr = [], []
+        readers = [threading.Thread(target=_drain, args=(process.stdout, stdout), daemon=True),
+                   threading.Thread(target=_drain, args=(process.stderr, stderr), daemon=True)]
+        for reader in readers:
+            reader.start()
+
+        try:
+            self._write(process.stdin)
+        except BrokenPipeError:
+            pass  # the engine exited early, its return code tells why
+        except BaseException:
+            _kill(process)
+            raise
+        finally:
+            process.wait()
+
+        for reader in readers:
+            reader.join()
+        if self.cancelled:
+            raise RenderCancelled()
+        if process.returncode:
+            raise gviz.CalledProcessError(process.returncode, cmd, output=b''.join(stdout), stderr=b''.join(stderr))
+        return b''.join(stdout)
+
+    def _write(self, stdin):
+        chunk, size = [], 0
+        with stdin:
+            for line in self.lines:
+                if self.cancelled:
+                    raise RenderCancelled()
+                chunk.append(line)
+                size += len(line)
+                self.written += 1
+                if size >= self.chunk_size:
+                    stdin.write(''.join(chunk).encode())
+                    chunk, size = [], 0
+            stdin.write(''.join(chunk).encode())
+
+
+def _kill(process):
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        process.kill()
+
+
+def _drain(pipe, out):
+    for block in iter(lambda: pipe.read(1 << 16), b''):
+        out.append(block)
+    pipe.close()
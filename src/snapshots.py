@@ -0,0 +1,566 @@
+# Snapshot storage for dpviz
+# Stores the successive states of a DP table and hands them back as a sequence of arrays
+
+import os
+import json
+import bisect
+import shutil
+import weakref
+import tempfile
+import numpy as np
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+
+
+class SnapshotStore(Sequence, ABC):
+    ''' base class for the table histories dpviz records into
+        append() returns whether a new state was actually stored
+    '''
+
+    @abstractmethod
+    def append(self, table):
+        ''' store a new state of the table, unless it equals the previous one '''
+
+    def append_diff(self, ids, values):
+        ''' store a new frame given as the flat indices and new values of the cells that changed '''
+        table = np.array(self[-1])
+        table.reshape(-1)[ids] = values
+        return self.append(table)
+
+    @abstractmethod
+    def clear(self):
+        ''' drop every stored state '''
+
+    def flush(self):
+        ''' called once a trace is complete '''
+        pass
+
+    @abstractmethod
+    def select(self, indices):
+        ''' keep only the frames at the given sorted indices '''
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    @abstractmethod
+    def _get(self, i):
+        ''' frame i, with 0 <= i < len(self) '''
+
+    def diff(self, i):
+        ''' (flat indices, values) of the cells that turn frame i - 1 into frame i, or None when frame i
+            is only stored whole. Stores that keep diffs return them without rebuilding any frame.
+        '''
+        return None
+
+    def cursor(self):
+        ''' a Cursor over the frames, for stepping through them in order '''
+        return Cursor(self)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get(j) for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('snapshot index out of range')
+        return self._get(i)
+
+
+class Cursor(object):
+    ''' steps through the frames of a SnapshotStore, or any sequence of tables, keeping one working copy
+        seek(i) returns frame i. Moving forward only applies the diffs of the frames in between, so playing
+        frames in order costs the number of changed cells rather than the table size; frames that are only
+        stored whole (and moving backwards) rebuild the table. changed holds the flat indices of the cells
+        that differ from the frame seeked before, empty on the first one. The returned table is the
+        cursor's working array and changes with the next seek, it must not be modified.
+    '''
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.index = None
+        self.table = None
+        self.changed = np.empty(0, dtype=np.int64)
+        self._diff = getattr(tables, 'diff', None)
+        self._owned = False  # whether table is the cursor's own copy, which diffs can be applied to
+
+    def seek(self, index):
+        n = len(self.tables)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('snapshot index out of range')
+        previous = self.table
+        # Diffs of the frames after the nearest whole one, newest first
+        base, diffs = index, []
+        if previous is not None and self.index < index and self._diff is not None:
+            while base > self.index:
+                diff = self._diff(base)
+                if diff is None:
+                    break
+                diffs.append(diff)
+                base -= 1
+        if previous is not None and base == self.index:
+            if not self._owned:
+                previous = self.table = previous.copy()
+                self._owned = True
+            flat = previous.reshape(-1)
+            ids = np.unique(np.concatenate([ids for ids, _ in diffs])) if diffs else np.empty(0, dtype=np.int64)
+            before = flat[ids]
+            for ids_k, values in reversed(diffs):
+                flat[ids_k] = values
+            self.changed = ids[flat[ids] != before]
+        else:
+            # Whole frames are used as they are until a diff has to be applied to them
+            table = np.asarray(self.tables[base])
+            self._owned = bool(diffs)
+            if diffs:
+                table = table.copy()
+                flat = table.reshape(-1)
+                for ids_k, values in reversed(diffs):
+                    flat[ids_k] = values
+            if previous is not None and previous.shape == table.shape:
+                self.changed = np.flatnonzero(table != previous)
+            else:
+                self.changed = np.empty(0, dtype=np.int64)
+            self.table = table
+        self.index = index
+        return self.table
+
+
+def value_range(tables):
+    ''' (smallest, largest) finite value over every frame of a SnapshotStore or sequence of numeric tables,
+        None when there is none. A store with diffs is read once, whole frames and then only the diffs' values
+    '''
+    diff = getattr(tables, 'diff', None)
+    low, high = np.inf, -np.inf
+    for i in range(len(tables)):
+        changed = diff(i) if diff is not None and i else None
+        values = np.asarray(tables[i] if changed is None else changed[1]).reshape(-1)
+        values = values[np.isfinite(values)] if values.dtype.kind == 'f' else values
+        if values.size:
+            low, high = min(low, values.min()), max(high, values.max())
+    return (low, high) if low <= high else None
+
+
+class ListStore(SnapshotStore):
+    ''' keeps a full copy of every state, like dpviz originally did
+        dedupe=False stores every state handed to it (for tables that are not array-like)
+    '''
+
+    def __init__(self, dedupe=True):
+        self.dedupe = dedupe
+        self._tables = []
+
+    def append(self, table):
+        # Don't store duplicates of array-like
+        if self.dedupe and self._tables and np.array_equal(table, self._tables[-1]):
+            return False
+        self._tables.append(table.copy())
+        return True
+
+    def clear(self):
+        self._tables = []
+
+    def select(self, indices):
+        self._tables = [self._tables[i] for i in indices]
+
+    def __len__(self):
+        return len(self._tables)
+
+    def _get(self, i):
+        return self._tables[i]
+
+    def __iter__(self):
+        return iter(self._tables)
+
+
+class _Buffer(object):
+    ''' append-only numpy buffer with amortized doubling '''
+
+    def __init__(self, dtype, capacity=64):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def _grow(self, n):
+        grown = np.empty(max(n, 2 * len(self._data)), dtype=self._data.dtype)
+        grown[:self._size] = self._data[:self._size]
+        self._data = grown
+
+    def extend(self, values):
+        n = self._size + len(values)
+        if n > len(self._data):
+            self._grow(n)
+        self._data[self._size:n] = values
+        self._size = n
+
+    def append(self, value):
+        if self._size == len(self._data):
+            self._grow(self._size + 1)
+        self._data[self._size] = value
+        self._size += 1
+
+    def view(self):
+        return self._data[:self._size]
+
+    @property
+    def nbytes(self):
+        return self._size * self._data.itemsize
+
+    def __len__(self):
+        return self._size
+
+
+class _Segment(object):
+    ''' a keyframe followed by the sparse diffs (flat indices, new values) of later frames
+        The diffs live in the ids/values/offsets buffers the store keeps for the keyframe's dtype, shared by
+        all segments of that dtype, the segment only remembers where its part starts
+    '''
+
+    def __init__(self, start, keyframe, ids, values, offsets):
+        self.start = start
+        self.keyframe = keyframe
+        self.ids = ids
+        self.values = values
+        self.offsets = offsets  # end of each frame's diff in ids/values
+        self.diff_start = len(ids)
+        self.offset_start = len(offsets)
+        self.frames = 1
+
+    def __len__(self):
+        return self.frames
+
+    def add_diff(self, ids, values):
+        self.ids.extend(ids)
+        self.values.extend(values)
+        self.offsets.append(len(self.ids))
+        self.frames += 1
+
+    @property
+    def cells(self):
+        return len(self.ids) - self.diff_start
+
+    def diffs(self):
+        # (ids, values) of every frame after the keyframe, in order
+        ids, values, offsets = self.ids.view(), self.values.view(), self.offsets.view()
+        begin = self.diff_start
+        for end in offsets[self.offset_start:self.offset_start + self.frames - 1]:
+            yield ids[begin:end], values[begin:end]
+            begin = end
+
+    def diff(self, k):
+        # (ids, values) of the k-th frame's diff, k >= 1
+        offsets = self.offsets.view()
+        begin = self.diff_start if k == 1 else offsets[self.offset_start + k - 2]
+        end = offsets[self.offset_start + k - 1]
+        return self.ids.view()[begin:end], self.values.view()[begin:end]
+
+    def frame(self, k, keyframe):
+        # Read-only (memory-mapped) keyframes can be handed out without a copy
+        if k == 0 and not keyframe.flags.writeable:
+            return keyframe
+        # Rebuild the k-th frame of this segment from the keyframe
+        table = np.array(keyframe)
+        if k:
+            end = self.offsets.view()[self.offset_start + k - 1]
+            ids, values = self.ids.view()[self.diff_start:end], self.values.view()[self.diff_start:end]
+            # Only the latest write to each cell matters
+            last, first = np.unique(ids[::-1], return_index=True)
+            table.reshape(-1)[last] = values[::-1][first]
+        return table
+
+
+class DeltaStore(SnapshotStore):
+    ''' keeps periodic keyframes plus per-frame sparse diffs
+        A new keyframe starts once the current segment has stored keyframe_ratio * table.size changed cells,
+        so memory stays proportional to the number of cell writes and rebuilding any frame costs O(table size)
+    '''
+
+    def __init__(self, keyframe_ratio=1.0):
+        self.keyframe_ratio = keyframe_ratio
+        self.clear()
+
+    def clear(self):
+        self._segments = []
+        self._starts = []
+        # dtype : (ids, values, offsets) buffers of the diffs of all segments of that dtype, kept apart so
+        # positions in ids and offsets always index the values buffer of the same segments
+        self._diffs = {}
+        self._last = None  # copy of the newest state
+        self._len = 0
+
+    def _new_buffer(self, name, dtype):
+        return _Buffer(dtype)
+
+    def _store_keyframe(self, table):
+        return table.copy()
+
+    def _keyframe(self, segment):
+        return segment.keyframe
+
+    def _diff_buffers(self, dtype):
+        if dtype not in self._diffs:
+            name = dtype.str.strip('<>|=')
+            self._diffs[dtype] = (self._new_buffer('ids-' + name, np.int64), self._new_buffer('values-' + name, dtype),
+                                  self._new_buffer('offsets-' + name, np.int64))
+        return self._diffs[dtype]
+
+    def _start_segment(self, table):
+        segment = _Segment(self._len, self._store_keyframe(table), *self._diff_buffers(table.dtype))
+        self._segments.append(segment)
+        self._starts.append(self._len)
+        self._last = np.array(table)
+        self._len += 1
+
+    def append(self, table):
+        table = np.asarray(table)
+        last = self._last
+        if last is None or table.shape != last.shape or table.dtype != last.dtype:
+            self._start_segment(table)
+            return True
+        ids = np.flatnonzero(table != last)
+        if not len(ids):
+            return False
+        return self.append_diff(ids, table.reshape(-1)[ids])
+
+    def append_diff(self, ids, values):
+        if self._last is None:
+            raise ValueError('append_diff needs a first full table')
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        flat = self._last.reshape(-1)
+        if not np.any(flat[ids] != values):
+            return False
+        flat[ids] = values
+        segment = self._segments[-1]
+        if segment.cells + len(ids) > self.keyframe_ratio * self._last.size:
+            self._start_segment(self._last)
+        else:
+            segment.add_diff(ids, self._last.reshape(-1)[ids])
+            self._len += 1
+        return True
+
+    def __len__(self):
+        return self._len
+
+    def _get(self, i):
+        if i == self._len - 1 and self._last is not None:
+            return self._last.copy()
+        s = bisect.bisect_right(self._starts, i) - 1
+        segment = self._segments[s]
+        return segment.frame(i - segment.start, self._keyframe(segment))
+
+    def diff(self, i):
+        if i < 0:
+            i += self._len
+        s = bisect.bisect_right(self._starts, i) - 1
+        segment = self._segments[s]
+        k = i - segment.start
+        return segment.diff(k) if k else None
+
+    def __iter__(self):
+        for table in self._replay():
+            yield table.copy()
+
+    def _replay(self):
+        # Replay diffs in order instead of rebuilding each frame from its keyframe,
+        # the same working array is yielded for every frame
+        for segment in self._segments:
+            table = np.array(self._keyframe(segment))
+            flat = table.reshape(-1)
+            yield table
+            for ids, values in segment.diffs():
+                flat[ids] = values
+                yield table
+
+    def _empty(self):
+        return type(self)(self.keyframe_ratio)
+
+    def select(self, indices):
+        # Re-encode the kept frames into a fresh store, then take over its state
+        selected = self._empty()
+        indices = iter(indices)
+        wanted = next(indices, None)
+        for i, table in enumerate(self._replay()):
+            if wanted is None:
+                break
+            if i == wanted:
+                selected.append(table)
+                wanted = next(indices, None)
+        self._adopt(selected)
+
+    def _adopt(self, other):
+        self.__dict__.update(other.__dict__)
+
+    @property
+    def nbytes(self):
+        total = sum(buffer.nbytes for buffers in self._diffs.values() for buffer in buffers)
+        return total + sum(self._keyframe(segment).nbytes for segment in self._segments)
+
+
+class _SpillBuffer(object):
+    ''' append-only buffer backed by a raw file, at most ram_budget bytes are held in memory before spilling '''
+
+    def __init__(self, path, dtype, ram_budget, size=0):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.ram_budget = ram_budget
+        self._pending = _Buffer(self.dtype)
+        self._flushed = size  # elements already on disk
+        self._map = None
+        if not size:
+            open(path, 'wb').close()
+
+    def extend(self, values):
+        self._pending.extend(values)
+        if self._pending.nbytes >= self.ram_budget:
+            self.flush()
+
+    def append(self, value):
+        self.extend((value, ))
+
+    def flush(self):
+        if len(self._pending):
+            with open(self.path, 'ab') as f:
+                self._pending.view().tofile(f)
+            self._flushed += len(self._pending)
+            self._pending = _Buffer(self.dtype)
+
+    def view(self):
+        # Zero-copy view of the whole buffer, remapped only when the file has grown
+        self.flush()
+        if not self._flushed:
+            return np.empty(0, dtype=self.dtype)
+        if self._map is None or len(self._map) != self._flushed:
+            self._map = np.memmap(self.path, dtype=self.dtype, mode='r', shape=(self._flushed, ))
+        return self._map
+
+    @property
+    def nbytes(self):
+        return len(self) * self.dtype.itemsize
+
+    def __len__(self):
+        return self._flushed + len(self._pending)
+
+
+class MemmapStore(DeltaStore):
+    ''' DeltaStore that streams keyframes and diffs into raw files under path
+        Only about ram_budget bytes of diffs plus the newest table are kept in memory, and keyframes
+        are read back as zero-copy np.memmap views. Without a path a temporary directory is used
+        and removed with the store; with one, MemmapStore.load(path) reopens the trace after flush()
+    '''
+
+    INDEX = 'index.json'
+    KEYFRAMES = 'keyframes'
+    ALIGN = 64  # keyframe alignment in the keyframe file
+
+    def __init__(self, path=None, ram_budget=64 * 2**20, keyframe_ratio=1.0):
+        if path is None:
+            path = tempfile.mkdtemp(prefix='dpviz-')
+            weakref.finalize(self, shutil.rmtree, path, True)
+        else:
+            os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.ram_budget = ram_budget
+        self._generation = 0  # bumped each time select() re-encodes the trace into new files
+        super().__init__(keyframe_ratio)
+
+    def _file(self, name):
+        suffix = f'.{self._generation}.raw' if self._generation else '.raw'
+        return os.path.join(self.path, name + suffix)
+
+    def clear(self):
+        open(self._file(self.KEYFRAMES), 'wb').close()
+        self._keyframe_bytes = 0
+        self._keyframe_map = None
+        super().clear()
+
+    def _new_buffer(self, name, dtype, size=0):
+        buffer = _SpillBuffer(self._file(name), dtype, self.ram_budget // 4, size)
+        buffer.name = name
+        return buffer
+
+    def _empty(self):
+        store = type(self).__new__(type(self))
+        store.path, store.ram_budget, store.keyframe_ratio = self.path, self.ram_budget, self.keyframe_ratio
+        store._generation = self._generation + 1
+        store.clear()
+        return store
+
+    def _adopt(self, other):
+        old = [self._file(self.KEYFRAMES)] + [buffer.path for buffers in self._diffs.values() for buffer in buffers]
+        super()._adopt(other)
+        for path in old:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _store_keyframe(self, table):
+        if table.dtype.hasobject:
+            raise TypeError('MemmapStore can not store object arrays')
+        offset = -self._keyframe_bytes % self.ALIGN + self._keyframe_bytes
+        with open(self._file(self.KEYFRAMES), 'ab') as f:
+            f.write(b'\0' * (offset - self._keyframe_bytes))
+            np.ascontiguousarray(table).tofile(f)
+        self._keyframe_bytes = offset + table.nbytes
+        # Segments only keep where their keyframe lives, views are made on demand
+        return (offset, table.dtype, table.shape)
+
+    def _keyframe(self, segment):
+        offset, dtype, shape = segment.keyframe
+        if not self._keyframe_bytes:
+            return np.empty(shape, dtype=dtype)
+        if self._keyframe_map is None or len(self._keyframe_map) != self._keyframe_bytes:
+            path = self._file(self.KEYFRAMES)
+            self._keyframe_map = np.memmap(path, dtype=np.uint8, mode='r', shape=(self._keyframe_bytes, ))
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        return self._keyframe_map[offset:offset + nbytes].view(dtype).reshape(shape)
+
+    def flush(self):
+        # Write out pending diffs and the index needed to reopen the trace
+        buffers = {buffer.name: buffer for buffers in self._diffs.values() for buffer in buffers}
+        for buffer in buffers.values():
+            buffer.flush()
+        index = {
+            'generation': self._generation,
+            'keyframe_ratio': self.keyframe_ratio,
+            'length': self._len,
+            'keyframe_bytes': self._keyframe_bytes,
+            'buffers': {name: [buffer.dtype.str, len(buffer)] for name, buffer in buffers.items()},
+            'segments': [[s.start, s.keyframe[0], s.keyframe[1].str, list(s.keyframe[2]), s.diff_start, s.offset_start, s.frames]
+                         for s in self._segments]
+        }
+        with open(os.path.join(self.path, self.INDEX), 'w') as f:
+            json.dump(index, f)
+
+    @classmethod
+    def load(cls, path, ram_budget=64 * 2**20):
+        ''' reopen a trace written by a flushed MemmapStore '''
+        with open(os.path.join(path, cls.INDEX)) as f:
+            index = json.load(f)
+        store = cls.__new__(cls)
+        store.path = path
+        store.ram_budget = ram_budget
+        store.keyframe_ratio = index['keyframe_ratio']
+        store._generation = index['generation']
+        store._keyframe_bytes = index['keyframe_bytes']
+        store._keyframe_map = None
+        buffers = {name: store._new_buffer(name, dtype, size) for name, (dtype, size) in index['buffers'].items()}
+        store._diffs = {}
+        for name, buffer in buffers.items():
+            if name.startswith('values-'):
+                suffix = name[len('values-'):]
+                store._diffs[buffer.dtype] = (buffers['ids-' + suffix], buffer, buffers['offsets-' + suffix])
+        store._segments, store._starts = [], []
+        for start, offset, dtype, shape, diff_start, offset_start, frames in index['segments']:
+            dtype = np.dtype(dtype)
+            segment = _Segment(start, (offset, dtype, tuple(shape)), *store._diff_buffers(dtype))
+            segment.diff_start, segment.offset_start, segment.frames = diff_start, offset_start, frames
+            store._segments.append(segment)
+            store._starts.append(start)
+        store._len = index['length']
+        store._last = None
+        if store._len:
+            store._last = np.array(store._get(store._len - 1))
+        return store
@@ -0,0 +1,149 @@
+# Streaming access to dpviz snapshots while the traced function is still running
+
+import queue
+import threading
+from collections import namedtuple
+
+## One recorded table state
+# name  - the watched table name
+# index - position of the state in that table's store when it was recorded
+# table - a copy of the table
+Snapshot = namedtuple('Snapshot', ['name', 'index', 'table'])
+
+
+class TraceCancelled(Exception):
+    ''' raised inside a traced function whose SnapshotStream was closed '''
+    pass
+
+
+class NotifyingStore(object):
+    ''' wraps a SnapshotStore and hands every newly stored state to sink(Snapshot) '''
+
+    def __init__(self, store, name, sink):
+        self.store = store
+        self.name = name
+        self.sink = sink
+
+    def append(self, table):
+        stored = self.store.append(table)
+        if stored:
+            self._emit()
+        return stored
+
+    def append_diff(self, ids, values):
+        stored = self.store.append_diff(ids, values)
+        if stored:
+            self._emit()
+        return stored
+
+    def _emit(self):
+        self.sink(Snapshot(self.name, len(self.store) - 1, self.store[-1]))
+
+    def select(self, indices):
+        self.store.select(indices)
+
+    def flush(self):
+        self.store.flush()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        return self.store[i]
+
+
+class SnapshotStream(object):
+    ''' iterates over the snapshots of one traced call running in a background thread
+        put is the sink the traced call sends each Snapshot to, and start(run) performs the call.
+        At most maxsize snapshots wait in the queue; once it is full the traced function blocks until
+        the consumer catches up. When iteration ends, result holds the return value of run, and an
+        exception raised by it is re-raised to the consumer. close() stops the traced function early.
+    '''
+
+    _DONE = object()
+
+    def __init__(self, maxsize=64):
+        self.result = None
+        self.done = False
+        self._error = None
+        self._queue = queue.Queue(maxsize)
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self, run):
+        self._thread = threading.Thread(target=self._work, args=(run, ), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        # Wait for room in the queue, unless the consumer went away
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def put(self, snapshot):
+        if not self._put(snapshot):
+            raise TraceCancelled()
+
+    def _work(self, run):
+        try:
+            self.result = run()
+        except TraceCancelled:
+            pass
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._put(self._DONE)
+
+    def _finish(self):
+        self.done = True
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        item = self._queue.get()
+        if item is self._DONE:
+            self._finish()
+            raise StopIteration
+        return item
+
+    def poll(self, limit=None):
+        ''' snapshots available right now, without blocking (for event loops such as Tk's after()) '''
+        snapshots = []
+        while not self.done and (limit is None or len(snapshots) < limit):
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._DONE:
+                self._finish()
+            else:
+                snapshots.append(item)
+        return snapshots
+
+    def close(self, timeout=None):
+        ''' stop the traced function at its next recorded state and wait for its thread '''
+        self._closed.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.done = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
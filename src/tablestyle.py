@@ -0,0 +1,37 @@
+# How DP table frames look, shared by tableview.TableCanvas and the images of batch
+# Colours, cell sizes and value formatting, with no Tk import so headless exports can use them
+
+import numpy as np
+
+FILL = 'white'
+CHANGED_FILL = '#ffd966'  # cells changed by the frame shown
+OUTLINE = '#b0b0b0'
+TEXT = 'black'
+CELL_HEIGHT = 28
+PADDING = 8
+HEAT_LOW = (255, 255, 255)  # heat map colour of the smallest value
+HEAT_HIGH = (33, 102, 172)  # heat map colour of the largest value
+
+
+def rows(table):
+    ''' the table as rows and columns, a view: tables of one dimension are drawn as a row,
+        more than two are flattened after the first
+    '''
+    if table.ndim < 2:
+        return table.reshape(1, -1)
+    return table.reshape(table.shape[0], -1)
+
+
+def format_value(value):
+    ''' text of a cell '''
+    if isinstance(value, (float, np.floating)):
+        return '%g' % value
+    return str(value)
+
+
+def heat(values, low, high, colours=(HEAT_LOW, HEAT_HIGH)):
+    ''' float (r, g, b) of each value on the heat map from low to high, values outside clipped '''
+    span = (high - low) or 1
+    t = np.nan_to_num(np.clip((np.asarray(values, dtype=float) - low) / span, 0, 1))[..., None]
+    start, end = np.array(colours[0]), np.array(colours[1])
+    return start + t * (end - start)
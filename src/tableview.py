@@ -0,0 +1,292 @@
+# DP tables drawn on a Tk canvas
+# Only the cells inside the visible part of the canvas are drawn, and moving to another frame only rewrites
+# the visible cells whose value changed, so the Tk work follows the size of the view and not of the table
+
+import tkinter as tk
+from tkinter import ttk
+import numpy as np
+from PIL import Image, ImageTk
+
+from zoom_advanced3 import AutoScrollbar
+from snapshots import Cursor, value_range
+import tablestyle
+from tablestyle import rows as _rows, format_value as _format
+
+MODES = ('auto', 'numbers', 'heat')
+
+
+class TableCanvas(object):
+    ''' the frames of a DP table, like dpviz tables, drawn on a canvas with scrolling and zoom
+        show(i) draws frame i: the cells that differ from the frame before get their new value and are
+        highlighted until the next frame. play() loops over the frames with after(), on the Tk thread.
+        Only the cells in view are drawn. In mode 'numbers' they show their values, in mode 'heat' the
+        table is a heat map of the values, and 'auto' uses numbers while they are large enough to read.
+        Works in a grid like TreeCanvas and CanvasImage.
+    '''
+
+    FONT = ('Courier', 16)
+    CHAR_WIDTH = 13  # width of a character of FONT, in pixels at scale 1
+    CELL_HEIGHT = tablestyle.CELL_HEIGHT
+    PADDING = tablestyle.PADDING
+    MAX_CHARS = 12  # cells are never wider than this many characters
+    MAX_WIDTH = 560  # largest size the canvas asks for, larger tables scroll
+    MAX_HEIGHT = 480
+    FILL = tablestyle.FILL
+    CHANGED_FILL = tablestyle.CHANGED_FILL  # cells changed by the frame shown
+    OUTLINE = tablestyle.OUTLINE
+    HEAT_LOW = tablestyle.HEAT_LOW  # heat map colour of the smallest value
+    HEAT_HIGH = tablestyle.HEAT_HIGH  # heat map colour of the largest value
+    MIN_TEXT_SCALE = 0.5  # 'auto' switches to the heat map below this zoom
+    MAX_ITEMS = 5000  # cells drawn as canvas items at most, larger views use the heat map
+    MAX_FPS = 60
+
+    def __init__(self, placeholder, tables, mode='auto'):
+        if mode not in MODES:
+            raise ValueError(f"unknown mode '{mode}', expected one of {MODES}")
+        if not len(tables):
+            raise ValueError("TableCanvas needs at least one frame")
+        self.tables = tables
+        self.mode = mode
+        self.scale = 1.0
+        self.index = None  # frame shown
+        self.__delta = 1.3  # zoom magnitude
+        self.__cursor = Cursor(tables)  # steps through the frames applying only their diffs
+        self.__values = None  # frame shown, as a 2d view of the cursor's table
+        self.__changed_ids = np.empty(0, dtype=np.int64)  # flat indices of the cells it changed
+        self.__window = (0, 0, 0, 0)  # rows and columns drawn, (first row, end row, first column, end column)
+        self.__items = {}  # (row, column) : (rectangle, text) of the cells drawn
+        self.__changed = None  # cells of the window highlighted
+        self.__heat = None  # (canvas item, PhotoImage) of the heat map
+        self.__pending = None  # scheduled redraw
+        self.__after = None  # scheduled frame of play()
+
+        first, last = _rows(np.asarray(tables[0])), _rows(np.asarray(tables[len(tables) - 1]))
+        self.rows, self.columns = last.shape
+        self.__numeric = last.dtype.kind in 'biuf'
+        if self.__numeric:
+            # The heat map spans the values of every frame, middle ones can go beyond the first and last
+            self.__low, self.__high = value_range(tables) or (0, 1)
+            ends = [v for frame in (first, last) if frame.size for v in (frame.min(), frame.max())]
+            chars = max([len(_format(v)) for v in ends + [self.__low, self.__high]] + [2])
+        else:
+            chars = max(len(_format(v)) for frame in (first, last) for v in frame.flat[:1000])
+        self.cell_width = min(chars, self.MAX_CHARS) * self.CHAR_WIDTH + 2 * self.PADDING
+        self.width = self.columns * self.cell_width
+        self.height = self.rows * self.CELL_HEIGHT
+
+        self.__frame_widget = ttk.Frame(placeholder)
+        hbar = AutoScrollbar(self.__frame_widget, orient='horizontal')
+        vbar = AutoScrollbar(self.__frame_widget, orient='vertical')
+        hbar.grid(row=1, column=0, sticky='we')
+        vbar.grid(row=0, column=1, sticky='ns')
+        self.canvas = tk.Canvas(self.__frame_widget, highlightthickness=0, xscrollcommand=hbar.set, yscrollcommand=vbar.set,
+                                width=min(self.width + 1, self.MAX_WIDTH), height=min(self.height + 1, self.MAX_HEIGHT))
+        self.canvas.grid(row=0, column=0, sticky='nswe')
+        hbar.configure(command=self.__scroll_x)
+        vbar.configure(command=self.__scroll_y)
+        self.canvas.bind('<Configure>', lambda event: self.redraw())
+        self.canvas.bind('<ButtonPress-1>', lambda event: self.canvas.scan_mark(event.x, event.y))
+        self.canvas.bind('<B1-Motion>', self.__move_to)
+        self.canvas.bind('<MouseWheel>', self.__wheel)
+        self.canvas.bind('<Button-5>', self.__wheel)
+        self.canvas.bind('<Button-4>', self.__wheel)
+        self.__update_scrollregion()
+        self.show(0)
+        self.redraw()
+
+    def grid(self, **kw):
+        self.__frame_widget.grid(**kw)
+        self.__frame_widget.rowconfigure(0, weight=1)
+        self.__frame_widget.columnconfigure(0, weight=1)
+
+    def grid_forget(self, **kw):
+        self.__frame_widget.grid_forget(**kw)
+        self.destroy()
+
+    def destroy(self):
+        self.stop()
+        if self.__pending is not None:
+            self.canvas.after_cancel(self.__pending)
+            self.__pending = None
+        self.canvas.destroy()
+        self.__frame_widget.destroy()
+
+    def set_mode(self, mode):
+        ''' switches between 'auto', 'numbers' and 'heat' '''
+        if mode not in MODES:
+            raise ValueError(f"unknown mode '{mode}', expected one of {MODES}")
+        self.mode = mode
+        self.redraw()
+
+    def show(self, index):
+        ''' draws frame index, only touching the visible cells that changed
+            Showing the frames in order only costs their changed cells, the whole table is only rebuilt
+            when seeking elsewhere
+        '''
+        # A view of the cursor's table, only the window in view is ever sliced out of it
+        self.__values = _rows(self.__cursor.seek(index))
+        self.__changed_ids = self.__cursor.changed
+        self.index = index
+        if self.__pending is not None:
+            return  # the redraw draws this frame
+        if self.__heat is not None:
+            self.__draw_heat()
+            return
+        r0, r1, c0, c1 = self.__window
+        changed = self.__changes(r0, r1, c0, c1)
+        # Cells changed now, and cells that were highlighted and go back to normal
+        update = changed | self.__changed if self.__changed is not None else changed
+        itemconfigure = self.canvas.itemconfigure
+        values = self.__values
+        for row, column in np.argwhere(update):
+            rect, text = self.__items[(r0 + row, c0 + column)]
+            itemconfigure(text, text=_format(values[r0 + row, c0 + column]))
+            itemconfigure(rect, fill=self.CHANGED_FILL if changed[row, column] else self.FILL)
+        self.__changed = changed
+
+    def play(self, duration=10.0, interval=0.5, pause=1.5):
+        ''' loops over the frames until stop(): each frame is shown for interval seconds, or less so that
+            a loop takes at most duration seconds, and the last one for pause seconds.
+            At most MAX_FPS frames are drawn a second, frames in between are skipped.
+        '''
+        self.stop()
+        n = len(self.tables)
+        per_frame = min(interval, duration / n)
+        self.__delay = max(int(per_frame * 1000), 1000 // self.MAX_FPS)
+        self.__step = max(1, round(self.__delay / (per_frame * 1000)))
+        self.__pause = int(pause * 1000)
+        self.__tick(0)
+
+    def stop(self):
+        if self.__after is not None:
+            self.canvas.after_cancel(self.__after)
+            self.__after = None
+
+    def __tick(self, index):
+        self.show(index)
+        last = len(self.tables) - 1
+        if index == last:
+            self.__after = self.canvas.after(self.__pause, self.__tick, 0)
+        else:
+            self.__after = self.canvas.after(self.__delay, self.__tick, min(index + self.__step, last))
+
+    def redraw(self):
+        ''' schedules one redraw for the next idle moment, however many events ask for it '''
+        if self.__pending is None:
+            self.__pending = self.canvas.after_idle(self.__draw)
+
+    def visible(self):
+        ''' (first row, end row, first column, end column) of the cells inside the visible part of the canvas '''
+        c = self.canvas
+        width, height = self.cell_width * self.scale, self.CELL_HEIGHT * self.scale
+        x0, y0 = max(c.canvasx(0), 0), max(c.canvasy(0), 0)
+        x1, y1 = c.canvasx(c.winfo_width()), c.canvasy(c.winfo_height())
+        return (min(int(y0 // height), self.rows), min(int(y1 // height) + 1, self.rows),
+                min(int(x0 // width), self.columns), min(int(x1 // width) + 1, self.columns))
+
+    def __changes(self, r0, r1, c0, c1, row_step=1, column_step=1):
+        # cells of the window, every row_step-th row and column_step-th column, changed by the frame shown
+        rows, columns = np.divmod(self.__changed_ids, self.__values.shape[1])
+        inside = (rows >= r0) & (rows < r1) & (columns >= c0) & (columns < c1)
+        rows, columns = rows[inside] - r0, columns[inside] - c0
+        on_grid = (rows % row_step == 0) & (columns % column_step == 0)
+        changed = np.zeros((-(-(r1 - r0) // row_step), -(-(c1 - c0) // column_step)), dtype=bool)
+        changed[rows[on_grid] // row_step, columns[on_grid] // column_step] = True
+        return changed
+
+    def __use_heat(self, window):
+        r0, r1, c0, c1 = window
+        if not self.__numeric:
+            return False
+        if (r1 - r0) * (c1 - c0) > self.MAX_ITEMS:
+            return True
+        if self.mode == 'auto':
+            return self.scale < self.MIN_TEXT_SCALE
+        return self.mode == 'heat'
+
+    def __draw(self):
+        self.__pending = None
+        c = self.canvas
+        c.delete('all')
+        self.__items.clear()
+        self.__heat = None
+        self.__window = window = self.visible()
+        if self.__use_heat(window):
+            self.__draw_heat()
+            return
+        r0, r1, c0, c1 = window
+        s = self.scale
+        width, height = self.cell_width * s, self.CELL_HEIGHT * s
+        font = (self.FONT[0], max(1, int(round(self.FONT[1] * s))))
+        changed = self.__changes(r0, r1, c0, c1)
+        values = self.__values
+        for row in range(r0, r1):
+            for column in range(c0, c1):
+                x, y = column * width, row * height
+                fill = self.CHANGED_FILL if changed[row - r0, column - c0] else self.FILL
+                rect = c.create_rectangle(x, y, x + width, y + height, fill=fill, outline=self.OUTLINE)
+                text = c.create_text(x + width / 2, y + height / 2, text=_format(values[row, column]), font=font)
+                self.__items[(row, column)] = (rect, text)
+        self.__changed = changed
+
+    def __draw_heat(self):
+        # The visible cells as one image, with at most one cell per pixel
+        c = self.canvas
+        if self.__heat is not None and self.__heat[0] is not None:
+            c.delete(self.__heat[0])
+        r0, r1, c0, c1 = self.__window
+        if r1 <= r0 or c1 <= c0:
+            self.__heat = (None, None)
+            return
+        s = self.scale
+        width, height = self.cell_width * s, self.CELL_HEIGHT * s
+        row_step, column_step = max(1, int(1 / height)), max(1, int(1 / width))
+        window = self.__values[r0:r1:row_step, c0:c1:column_step]
+        rgb = tablestyle.heat(window, self.__low, self.__high, (self.HEAT_LOW, self.HEAT_HIGH))
+        changed = self.__changes(r0, r1, c0, c1, row_step, column_step)
+        rgb[changed] = _rgb(c, self.CHANGED_FILL)
+        image = Image.fromarray(rgb.astype(np.uint8), 'RGB')
+        size = (max(1, round((c1 - c0) * width)), max(1, round((r1 - r0) * height)))
+        imagetk = ImageTk.PhotoImage(image.resize(size, Image.NEAREST))
+        item = c.create_image(c0 * width, r0 * height, anchor='nw', image=imagetk)
+        self.__heat = (item, imagetk)  # keep a reference to prevent garbage-collection
+
+    def __update_scrollregion(self):
+        self.canvas.configure(scrollregion=(0, 0, self.width * self.scale, self.height * self.scale))
+
+    def __scroll_x(self, *args):
+        self.canvas.xview(*args)
+        self.redraw()
+
+    def __scroll_y(self, *args):
+        self.canvas.yview(*args)
+        self.redraw()
+
+    def __move_to(self, event):
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self.redraw()
+
+    def __wheel(self, event):
+        # Zoom around the pointer, Linux reports buttons 4 and 5, Windows and macOS a delta
+        if event.num == 5 or event.delta < 0:
+            factor = 1 / self.__delta
+        elif event.num == 4 or event.delta > 0:
+            factor = self.__delta
+        else:
+            return
+        c = self.canvas
+        x, y = c.canvasx(event.x) / self.scale, c.canvasy(event.y) / self.scale
+        self.scale *= factor
+        self.__update_scrollregion()
+        # keep the point under the pointer in place
+        width, height = self.width * self.scale, self.height * self.scale
+        if width > 0:
+            c.xview_moveto(max(0.0, (x * self.scale - event.x) / width))
+        if height > 0:
+            c.yview_moveto(max(0.0, (y * self.scale - event.y) / height))
+        self.redraw()
+
+
+def _rgb(widget, colour):
+    # Tk colour name as 8 bit (r, g, b)
+    return tuple(v >> 8 for v in widget.winfo_rgb(colour))
@@ -0,0 +1,250 @@
+# Write-capturing arrays for dpviz
+# A TrackedArray records every assignment into it (and optionally every read) in an append-only WriteLog,
+# so changes to a DP table are captured in O(1) per write instead of comparing whole tables
+
+import numpy as np
+from snapshots import _Buffer
+
+
+class WriteLog(object):
+    ''' append-only log of the cells written to (and read from) one tracked table
+        Each written cell is an (index, old, new, step) event, where index is the flat index into the table
+        and step counts __setitem__ calls, so every cell of a slice assignment shares one step.
+        A read is stored with the step of the write that follows it, which gives the DP dependency edges.
+    '''
+
+    def __init__(self, table, record_reads=False):
+        self.shape = table.shape
+        self.dtype = table.dtype
+        self.record_reads = record_reads
+        self.step = 0
+        self.listeners = []  # called with (ids, new values) after every write that changed something
+        self._flat = np.asarray(table).reshape(-1)  # shares memory with the tracked table
+        self._ids = _Buffer(np.int64)
+        self._old = _Buffer(self.dtype)
+        self._new = _Buffer(self.dtype)
+        self._steps = _Buffer(np.int64)
+        self._read_ids = _Buffer(np.int64)
+        self._read_steps = _Buffer(np.int64)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def before_write(self, ids):
+        return self._flat[ids].copy()
+
+    def write(self, ids, old):
+        if not isinstance(ids, np.ndarray):
+            return self._write_one(ids, old)
+        ids = np.ravel(ids)
+        new = self._flat[ids]
+        self._ids.extend(ids)
+        self._old.extend(np.ravel(old))
+        self._new.extend(new)
+        self._steps.extend(np.full(len(ids), self.step))
+        self.step += 1
+        if self.listeners and np.any(new != np.ravel(old)):
+            for listener in self.listeners:
+                listener(ids, new)
+
+    # Fast path for the usual single cell assignment
+    def _write_one(self, i, old):
+        new = self._flat[i]
+        self._ids.append(i)
+        self._old.append(old)
+        self._new.append(new)
+        self._steps.append(self.step)
+        self.step += 1
+        if self.listeners and new != old:
+            ids, new = np.array((i, )), self._flat[i:i + 1]
+            for listener in self.listeners:
+                listener(ids, new)
+
+    def read(self, ids):
+        ids = np.ravel(ids)
+        self._read_ids.extend(ids)
+        self._read_steps.extend(np.full(len(ids), self.step))
+
+    @property
+    def events(self):
+        ''' structured array of every written cell with fields index, old, new and step '''
+        events = np.empty(len(self), dtype=[('index', np.int64), ('old', self.dtype), ('new', self.dtype), ('step', np.int64)])
+        events['index'] = self._ids.view()
+        events['old'] = self._old.view()
+        events['new'] = self._new.view()
+        events['step'] = self._steps.view()
+        return events
+
+    @property
+    def reads(self):
+        ''' structured array of every read cell with fields index and step '''
+        reads = np.empty(len(self._read_ids), dtype=[('index', np.int64), ('step', np.int64)])
+        reads['index'] = self._read_ids.view()
+        reads['step'] = self._read_steps.view()
+        return reads
+
+    def edges(self, unique=True):
+        ''' (read cell, written cell) pairs of flat indices, the dependencies the DP followed '''
+        write_ids, write_steps = self._ids.view(), self._steps.view()
+        read_ids, read_steps = self._read_ids.view(), self._read_steps.view()
+        # Reads after the last write didn't feed any write
+        fed = read_steps < self.step
+        read_ids, read_steps = read_ids[fed], read_steps[fed]
+        # Match each read with every cell written at its step
+        first = np.searchsorted(write_steps, read_steps, side='left')
+        last = np.searchsorted(write_steps, read_steps, side='right')
+        counts = last - first
+        src = np.repeat(read_ids, counts)
+        dst = write_ids[np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+        edges = np.stack((src, dst), axis=1)
+        return np.unique(edges, axis=0) if unique else edges
+
+    def unravel(self, ids):
+        ''' turn flat indices into table indices '''
+        return np.unravel_index(ids, self.shape)
+
+
+class TrackedArray(np.ndarray):
+    ''' ndarray that reports assignments into it to a WriteLog
+        Views into the table (rows, slices, reshapes) report into the same log, so dp_table[i][j] = x is captured.
+        A view finds its cells from its offset and strides into the root table, so taking one runs no Python
+        indexing code and reads cost next to nothing unless record_reads is set.
+        In-place arithmetic (row += x) is captured through __array_ufunc__. Other mutation, like fill or np.copyto,
+        bypasses both, and dpviz only sees it when it compares the table with its store at the end of the call.
+        Results of arithmetic or fancy indexing are fresh arrays and are not tracked.
+    '''
+
+    def __new__(cls, table, record_reads=False):
+        # Only tables recording reads pay for a Python __getitem__
+        if record_reads and cls is TrackedArray:
+            cls = _ReadTrackedArray
+        obj = np.ascontiguousarray(table).view(cls)
+        obj._root = obj
+        obj._address = _address(obj)
+        obj._log = WriteLog(obj, record_reads)
+        return obj
+
+    def __array_finalize__(self, obj):
+        # Views and fresh results alike inherit the root, _tracked_root tells them apart
+        self._root = getattr(obj, '_root', None)
+        self._log = None
+        self._index = None
+
+    @property
+    def log(self):
+        root = self._tracked_root()
+        return root._log if root is not None else None
+
+    # The root table when this array is a view into it, None otherwise
+    def _tracked_root(self):
+        root = self._root
+        if root is self:
+            return root
+        # numpy points the base of a view of a view straight at the root, which doesn't own its data
+        if root is None or self.base is not root or self.dtype != root.dtype:
+            return None
+        return root
+
+    # Flat index into the root table of this array's first element
+    def _offset(self):
+        if self._root is self:
+            return 0
+        return (_address(self) - self._root._address) // self.itemsize
+
+    def _index_map(self):
+        # Flat index into the root table for every element of this array, built lazily
+        if self._index is None:
+            if self._root is self:
+                self._index = np.arange(self.size, dtype=np.int64).reshape(self.shape)
+            else:
+                # The same offset and strides, in elements, over the root's flat index map
+                flat = self._root._index_map().reshape(-1)
+                strides = tuple(s // self.itemsize * flat.itemsize for s in self.strides)
+                self._index = np.lib.stride_tricks.as_strided(flat[self._offset():], self.shape, strides, writeable=False)
+        return self._index
+
+    # Flat index into the root table of the one cell key picks, None for any other key
+    def _cell(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        if len(key) != self.ndim:
+            return None
+        cell = self._offset()
+        for k, n, stride in zip(key, self.shape, self.strides):
+            if not isinstance(k, (int, np.integer)) or isinstance(k, bool):
+                return None
+            if k < 0:
+                k += n
+            if not 0 <= k < n:
+                raise IndexError(f'index {k} is out of bounds for axis with size {n}')
+            cell += k * (stride // self.itemsize)
+        return cell
+
+    def __setitem__(self, key, value):
+        root = self._tracked_root()
+        if root is None:
+            return super().__setitem__(key, value)
+        ids = self._cell(key)
+        if ids is None:
+            ids = self._index_map()[key]
+        old = root._log.before_write(ids)
+        super().__setitem__(key, value)
+        root._log.write(ids, old)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        # In-place ufuncs (row += x, np.add(a, b, out=row), np.add.at) write without calling __setitem__
+        targets = inputs[:1] if method == 'at' else out or ()
+        writes = []
+        for target in targets:
+            root = target._tracked_root() if isinstance(target, TrackedArray) else None
+            if root is not None:
+                ids = target._index_map()
+                writes.append((root._log, ids, root._log.before_write(ids)))
+        inputs = tuple(_plain(x) for x in inputs)
+        if out is not None:
+            kwargs['out'] = tuple(_plain(x) for x in out)
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+        for log, ids, old in writes:
+            log.write(ids, old)
+        if out is not None:
+            return out[0] if len(out) == 1 else out
+        if isinstance(result, tuple):
+            return tuple(_fresh(r) for r in result)
+        return _fresh(result)
+
+
+class _ReadTrackedArray(TrackedArray):
+    ''' TrackedArray that also logs the cells read with indexing '''
+
+    def __getitem__(self, key):
+        result = super().__getitem__(key)
+        # Basic indexing gives a view, which logs its own reads when it is indexed in turn
+        if isinstance(result, TrackedArray) and _is_basic(key):
+            return result
+        root = self._tracked_root()
+        if root is not None:
+            root._log.read(self._index_map()[key])
+        return result
+
+
+def _is_basic(key):
+    # Basic indexing returns a view, advanced indexing returns a copy
+    if not isinstance(key, tuple):
+        key = (key, )
+    for k in key:
+        if not (k is None or k is Ellipsis or isinstance(k, (int, np.integer, slice))):
+            return False
+    return True
+
+
+def _address(array):
+    return array.__array_interface__['data'][0]
+
+
+def _plain(x):
+    return np.asarray(x) if isinstance(x, TrackedArray) else x
+
+
+# Results of ufuncs stay TrackedArrays, without a log
+def _fresh(result):
+    return result.view(TrackedArray) if isinstance(result, np.ndarray) else result
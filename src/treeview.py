@@ -0,0 +1,341 @@
+# Call trees drawn directly on a Tk canvas
+# The recorded tree is laid out once with a linear time tidy tree algorithm, and only the nodes inside
+# the visible part of the canvas are turned into canvas items, so graphviz isn't needed to show a trace
+
+import tkinter as tk
+from tkinter import ttk
+import numpy as np
+
+from zoom_advanced3 import AutoScrollbar
+
+
+def tidy_layout(parents, widths, gap=10.0):
+    ''' x position of the center of every node of a forest, in the style of Reingold and Tilford
+        Uses the linear time version of Walker's algorithm by Buchheim, Juenger and Leipert:
+        parents are centered over their children, subtrees are packed as close as gap allows, and
+        equal subtrees are drawn the same. parents[i] is the parent of node i (-1 for a root) and must be
+        smaller than i, like node ids in call order, widths[i] is the width of node i. Several roots are
+        laid out side by side. Returns a numpy array of x positions, the leftmost node edge is at 0.
+    '''
+    n = len(parents)
+    if n == 0:
+        return np.zeros(0)
+    # A virtual root over all roots turns the forest into one tree
+    root = n
+    children = [[] for _ in range(n + 1)]
+    for node, parent in enumerate(parents):
+        children[parent if parent >= 0 else root].append(node)
+    width = list(widths) + [0.0]
+    parent_of = [p if p >= 0 else root for p in parents] + [-1]
+
+    prelim = [0.0] * (n + 1)
+    mod = [0.0] * (n + 1)
+    shift = [0.0] * (n + 1)
+    change = [0.0] * (n + 1)
+    thread = [-1] * (n + 1)
+    ancestor = list(range(n + 1))
+    number = [0] * (n + 1)  # index among siblings
+    for kids in children:
+        for i, kid in enumerate(kids):
+            number[kid] = i
+
+    def left_sibling(v):
+        return children[parent_of[v]][number[v] - 1] if number[v] > 0 else -1
+
+    def next_left(v):
+        return children[v][0] if children[v] else thread[v]
+
+    def next_right(v):
+        return children[v][-1] if children[v] else thread[v]
+
+    def separation(a, b):
+        return (width[a] + width[b]) / 2 + gap
+
+    def move_subtree(wm, wp, amount):
+        subtrees = number[wp] - number[wm]
+        change[wp] -= amount / subtrees
+        shift[wp] += amount
+        change[wm] += amount / subtrees
+        prelim[wp] += amount
+        mod[wp] += amount
+
+    def apportion(v, default_ancestor):
+        w = left_sibling(v)
+        if w < 0:
+            return default_ancestor
+        vip = vop = v
+        vim = w
+        vom = children[parent_of[v]][0]
+        sip, sop, sim, som = mod[vip], mod[vop], mod[vim], mod[vom]
+        while next_right(vim) >= 0 and next_left(vip) >= 0:
+            vim, vip = next_right(vim), next_left(vip)
+            vom, vop = next_left(vom), next_right(vop)
+            ancestor[vop] = v
+            amount = (prelim[vim] + sim) - (prelim[vip] + sip) + separation(vim, vip)
+            if amount > 0:
+                a = ancestor[vim]
+                move_subtree(a if parent_of[a] == parent_of[v] else default_ancestor, v, amount)
+                sip += amount
+                sop += amount
+            sim += mod[vim]
+            sip += mod[vip]
+            som += mod[vom]
+            sop += mod[vop]
+        if next_right(vim) >= 0 and next_right(vop) < 0:
+            thread[vop] = next_right(vim)
+            mod[vop] += sim - sop
+        if next_left(vip) >= 0 and next_left(vom) < 0:
+            thread[vom] = next_left(vip)
+            mod[vom] += sip - som
+            default_ancestor = v
+        return default_ancestor
+
+    def finish(v):
+        # every child of v is placed, place v
+        kids = children[v]
+        w = left_sibling(v) if v != root else -1
+        if kids:
+            total_shift = total_change = 0.0
+            for kid in reversed(kids):
+                prelim[kid] += total_shift
+                mod[kid] += total_shift
+                total_change += change[kid]
+                total_shift += shift[kid] + total_change
+            midpoint = (prelim[kids[0]] + prelim[kids[-1]]) / 2
+            if w >= 0:
+                prelim[v] = prelim[w] + separation(w, v)
+                mod[v] = prelim[v] - midpoint
+            else:
+                prelim[v] = midpoint
+        elif w >= 0:
+            prelim[v] = prelim[w] + separation(w, v)
+
+    # First walk, post order without recursion: (node, default ancestor, index of the next child)
+    stack = [[root, children[root][0] if children[root] else root, 0]]
+    while stack:
+        frame = stack[-1]
+        v, _, i = frame
+        if i < len(children[v]):
+            kid = children[v][i]
+            stack.append([kid, children[kid][0] if children[kid] else kid, 0])
+            continue
+        stack.pop()
+        finish(v)
+        if stack:
+            parent_frame = stack[-1]
+            parent_frame[1] = apportion(v, parent_frame[1])
+            parent_frame[2] += 1
+
+    # Second walk: callers come before their calls, so the sums of mods can be taken in id order
+    x = np.empty(n)
+    offset = [0.0] * (n + 1)
+    offset[root] = mod[root]
+    for v in range(n):
+        p = parent_of[v]
+        x[v] = prelim[v] + offset[p]
+        offset[v] = offset[p] + mod[v]
+    x -= (x - np.asarray(widths) / 2).min()
+    return x
+
+
+class TreeCanvas(object):
+    ''' a callgraph's recursion tree drawn as canvas items, with zoom and pan
+        Nodes show their call, tracked data and return value, and edges their call and unwind order, like the
+        graphviz rendering. Only the nodes in view become canvas items, and labels are left out once they get
+        too small to read, so large trees stay responsive. Works as a drop in replacement for CanvasImage in a
+        grid. Memo graphs are DAGs rather than trees, render them with graphviz instead.
+    '''
+
+    FONT = ('helvetica', 10)
+    EDGE_FONT = ('helvetica', 8)
+    EDGE_COLOUR = '#999999'
+    CHAR_WIDTH = 7  # average width of a character of FONT, in pixels at scale 1
+    LINE_HEIGHT = 15
+    PADDING = 8
+    LEVEL_GAP = 40  # vertical space between levels
+    MIN_TEXT_SCALE = 0.45  # labels are left out below this zoom
+    MAX_ITEMS = 4000  # nodes drawn at most, the view is sampled beyond that
+
+    def __init__(self, placeholder, graph, show_null_returns=True):
+        if graph.memo:
+            raise ValueError("TreeCanvas draws recursion trees, not memo graphs")
+        self.graph = graph
+        self.scale = 1.0
+        self.__delta = 1.3  # zoom magnitude
+        self.__pending = None  # scheduled redraw
+        self.__centering = None  # scheduled first scroll to the root
+        self.__labels = self.__make_labels(show_null_returns)
+        self.__edge_labels = self.__make_edge_labels()
+        widths = np.array([max(len(line) for line in label) * self.CHAR_WIDTH + 2 * self.PADDING for label in self.__labels], dtype=float)
+        self.__widths = widths
+        # Nodes with tracked data are taller, levels are as far apart as the tallest node needs
+        self.__heights = np.array([len(label) * self.LINE_HEIGHT + self.PADDING for label in self.__labels], dtype=float)
+        level = float(self.__heights.max()) if len(graph) else 0.0
+        self.__parents = np.array(graph.get_parents(), dtype=np.int64)
+        self.__x = tidy_layout(graph.get_parents(), widths)
+        self.__y = np.array(graph.depths(), dtype=float) * (level + self.LEVEL_GAP) + level / 2
+        self.width = float((self.__x + widths / 2).max()) if len(graph) else 0.0
+        self.height = float(self.__y.max() + level / 2) if len(graph) else 0.0
+
+        self.__frame = ttk.Frame(placeholder)
+        hbar = AutoScrollbar(self.__frame, orient='horizontal')
+        vbar = AutoScrollbar(self.__frame, orient='vertical')
+        hbar.grid(row=1, column=0, sticky='we')
+        vbar.grid(row=0, column=1, sticky='ns')
+        self.canvas = tk.Canvas(self.__frame, highlightthickness=0, xscrollcommand=hbar.set, yscrollcommand=vbar.set)
+        self.canvas.grid(row=0, column=0, sticky='nswe')
+        hbar.configure(command=self.__scroll_x)
+        vbar.configure(command=self.__scroll_y)
+        self.canvas.bind('<Configure>', lambda event: self.redraw())
+        self.canvas.bind('<ButtonPress-1>', lambda event: self.canvas.scan_mark(event.x, event.y))
+        self.canvas.bind('<B1-Motion>', self.__move_to)
+        self.canvas.bind('<MouseWheel>', self.__wheel)
+        self.canvas.bind('<Button-5>', self.__wheel)
+        self.canvas.bind('<Button-4>', self.__wheel)
+        self.__update_scrollregion()
+        # Start at the root, which is centered over the tree
+        if len(graph):
+            self.__centering = self.canvas.after_idle(self.__center_on, self.__x[0], 0)
+        self.redraw()
+
+    def __make_labels(self, show_null_returns):
+        graph = self.graph
+        labels = []
+        for node_id, node in enumerate(graph.get_nodes()):
+            label = ["%s(%s)" % (graph.fn_name(node_id), node.argstr())]
+            label += ["%s: %s" % (param, val) for param, val in (node.auxdata or {}).items()]
+            if show_null_returns or node.ret is not None:
+                label.append("ret: %s" % (node.ret, ))
+            labels.append(tuple(label))
+        return labels
+
+    def __make_edge_labels(self):
+        # call order and unwind order of every call, on the edge from its caller
+        labels = []
+        for node_id in range(len(self.graph)):
+            call, unwind = self.graph.order(node_id)
+            labels.append("%d (\u2191 %d)" % (call, unwind) if unwind else "%d" % call)
+        return labels
+
+    def grid(self, **kw):
+        self.__frame.grid(**kw)
+        self.__frame.grid(sticky='nswe')
+        self.__frame.rowconfigure(0, weight=1)
+        self.__frame.columnconfigure(0, weight=1)
+
+    def grid_forget(self, **kw):
+        self.__frame.grid_forget(**kw)
+        self.destroy()
+
+    def destroy(self):
+        for pending in (self.__pending, self.__centering):
+            if pending is not None:
+                self.canvas.after_cancel(pending)
+        self.__pending = self.__centering = None
+        self.canvas.destroy()
+        self.__frame.destroy()
+
+    def redraw(self):
+        ''' schedules one redraw for the next idle moment, however many events ask for it '''
+        if self.__pending is None:
+            self.__pending = self.canvas.after_idle(self.__draw)
+
+    def visible(self):
+        ''' ids of the nodes inside the visible part of the canvas '''
+        x0, y0, x1, y1 = self.__view()
+        half_width, half_height = self.__widths / 2, self.__heights / 2
+        inside = (self.__x + half_width >= x0) & (self.__x - half_width <= x1) & \
+                 (self.__y + half_height >= y0) & (self.__y - half_height <= y1)
+        return np.flatnonzero(inside)
+
+    def __view(self):
+        # visible area in layout coordinates
+        c = self.canvas
+        return (c.canvasx(0) / self.scale, c.canvasy(0) / self.scale,
+                c.canvasx(c.winfo_width()) / self.scale, c.canvasy(c.winfo_height()) / self.scale)
+
+    def __draw(self):
+        self.__pending = None
+        c = self.canvas
+        c.delete('all')
+        shown = self.visible()
+        sampled = len(shown) > self.MAX_ITEMS
+        if sampled:
+            shown = shown[::len(shown) // self.MAX_ITEMS + 1]
+        s = self.scale
+        x, y, parents = self.__x, self.__y, self.__parents
+        half_heights = self.__heights / 2
+
+        # Edges crossing the view, or only those into the shown nodes when the view is sampled
+        if sampled:
+            bottoms = shown[parents[shown] >= 0]
+            tops = parents[bottoms]
+        else:
+            x0, y0, x1, y1 = self.__view()
+            bottoms = np.flatnonzero(parents >= 0)
+            tops = parents[bottoms]
+            crossing = (np.minimum(x[tops], x[bottoms]) <= x1) & (np.maximum(x[tops], x[bottoms]) >= x0) & \
+                       (y[tops] <= y1) & (y[bottoms] >= y0)
+            tops, bottoms = tops[crossing], bottoms[crossing]
+        text = s >= self.MIN_TEXT_SCALE
+        edge_font = (self.EDGE_FONT[0], max(1, int(round(self.EDGE_FONT[1] * s))))
+        for top, bottom in zip(tops, bottoms):
+            y0, y1 = y[top] + half_heights[top], y[bottom] - half_heights[bottom]
+            c.create_line(x[top] * s, y0 * s, x[bottom] * s, y1 * s, fill=self.EDGE_COLOUR)
+            if text and not sampled:
+                # beside the middle of the edge, like graphviz puts edge labels
+                c.create_text((x[top] + x[bottom]) / 2 * s + 3, (y0 + y1) / 2 * s, text=self.__edge_labels[bottom], font=edge_font,
+                              fill=self.EDGE_COLOUR, anchor='w')
+
+        font = (self.FONT[0], max(1, int(round(self.FONT[1] * s))))
+        for node_id in shown:
+            half_width, half_height = self.__widths[node_id] / 2, half_heights[node_id]
+            c.create_rectangle((x[node_id] - half_width) * s, (y[node_id] - half_height) * s, (x[node_id] + half_width) * s,
+                               (y[node_id] + half_height) * s, fill='white', outline='black')
+            if text:
+                c.create_text(x[node_id] * s, y[node_id] * s, text='\n'.join(self.__labels[node_id]), font=font, justify='center')
+
+    def __update_scrollregion(self):
+        self.canvas.configure(scrollregion=(0, 0, self.width * self.scale, self.height * self.scale))
+
+    def __center_on(self, x, y):
+        self.__centering = None
+        c = self.canvas
+        width, height = self.width * self.scale, self.height * self.scale
+        if width > 0:
+            c.xview_moveto(max(0.0, (x * self.scale - c.winfo_width() / 2) / width))
+        if height > 0:
+            c.yview_moveto(max(0.0, (y * self.scale) / height))
+        self.redraw()
+
+    def __scroll_x(self, *args):
+        self.canvas.xview(*args)
+        self.redraw()
+
+    def __scroll_y(self, *args):
+        self.canvas.yview(*args)
+        self.redraw()
+
+    def __move_to(self, event):
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self.redraw()
+
+    def __wheel(self, event):
+        # Zoom around the pointer, Linux reports buttons 4 and 5, Windows and macOS a delta
+        if event.num == 5 or event.delta < 0:
+            factor = 1 / self.__delta
+        elif event.num == 4 or event.delta > 0:
+            factor = self.__delta
+        else:
+            return
+        c = self.canvas
+        x, y = c.canvasx(event.x) / self.scale, c.canvasy(event.y) / self.scale
+        self.scale *= factor
+        self.__update_scrollregion()
+        # keep the point under the pointer in place
+        width, height = self.width * self.scale, self.height * self.scale
+        if width > 0:
+            c.xview_moveto(max(0.0, (x * self.scale - event.x) / width))
+        if height > 0:
+            c.yview_moveto(max(0.0, (y * self.scale - event.y) / height))
+        self.redraw()
@@ -0,0 +1,300 @@
+# Traced runs in worker processes
+# rcviz and dpviz functions are traced in a small pool of worker processes, so a long run never blocks
+# the Tk main loop, can be stopped at any moment, and several traces run at the same time
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class TraceCancelled(Exception):
+    ''' raised from a trace job's future once it was cancelled '''
+
+
+class TraceLimitExceeded(Exception):
+    ''' raised from a trace job's future when the run went over its time or memory limit '''
+
+
+class TraceFailed(Exception):
+    ''' raised from a trace job's future when the traced call raised or the worker died
+        details holds the worker's traceback, when there is one
+    '''
+
+    def __init__(self, message, details=''):
+        super().__init__(message)
+        self.details = details
+
+
+class TraceJob(object):
+    ''' one fn.trace(*args, **kwargs) call of an rcviz or dpviz function, run by a TracePool
+        future is a concurrent.futures.Future that receives the graph or trace, or TraceCancelled,
+        TraceLimitExceeded or TraceFailed. While the job runs, elapsed is its run time in seconds and memory
+        how much the worker's memory grew in bytes (None where that can't be measured), as last reported by
+        the worker. progress is elapsed as a fraction of the time limit, None without one.
+    '''
+
+    def __init__(self, func, args, kwargs, timeout=None, memory=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.memory_limit = memory
+        self.elapsed = 0.0
+        self.memory = None
+        self.future = Future()
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def finished(cls, func, result, args=(), kwargs=None):
+        ''' a job that is already done, for results that don't need a run '''
+        job = cls(func, args, kwargs or {})
+        job.future.set_result(result)
+        return job
+
+    @property
+    def progress(self):
+        if not self.timeout:
+            return None
+        return min(self.elapsed / self.timeout, 1.0)
+
+    def cancel(self):
+        ''' stops the job, killing its worker if it already started '''
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+class TracePool(object):
+    ''' up to max_workers worker processes running TraceJobs
+        Workers are started when first needed (or by start()) and reused. A worker whose job is cancelled,
+        goes over a limit or crashes is killed, and a new one is started for the next job. Jobs wait for a
+        free worker. Results of functions with a cache are served from it and stored in it, in this process.
+        Functions and arguments are pickled to the workers, so decorated functions must be importable.
+    '''
+
+    POLL = 0.05  # seconds between checks of a running job
+
+    def __init__(self, max_workers=2, context=None):
+        self.max_workers = max_workers
+        # spawn works everywhere, and is safe in a process running Tk and threads
+        self._context = context or multiprocessing.get_context('spawn')
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._idle = queue.SimpleQueue()  # (process, connection) of the workers without a job
+
+    def submit(self, func, *args, timeout=None, memory=None, **kwargs):
+        ''' starts func.trace(*args, **kwargs) in a worker and returns its TraceJob at once
+            timeout is the longest run time in seconds and memory the most the worker's memory may grow in
+            bytes; a run over either limit is stopped with TraceLimitExceeded
+        '''
+        key = None
+        if getattr(func, 'cache', None) is not None:
+            key = func.cache_key(*args, **kwargs)
+            result = func.cache.get_object(key)
+            if result is not None:
+                return TraceJob.finished(func, result, args, kwargs)
+        job = TraceJob(func, args, kwargs, timeout, memory)
+        threading.Thread(target=self._work, args=(job, key), daemon=True).start()
+        return job
+
+    def start(self):
+        ''' starts all the workers now, so the first jobs don't wait for them to import their modules '''
+        workers = [self._new_worker() for _ in range(self.max_workers - self._idle.qsize())]
+        for worker in workers:
+            self._idle.put(worker)
+
+    def shutdown(self):
+        ''' stops the idle workers, the running ones stop once their job is done or cancelled '''
+        while True:
+            try:
+                process, connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            connection.close()  # the worker exits when it sees the connection closed
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+
+    def _work(self, job, key):
+        with self._slots:
+            if not job.future.set_running_or_notify_cancel():
+                return
+            try:
+                result = self._execute(job)
+            except BaseException as e:
+                # Any error, even one starting a worker, fails the job instead of leaving it running
+                job.future.set_exception(e)
+                return
+        try:
+            if key is not None:
+                job.func.cache.put_object(key, result)
+        finally:
+            # A result that can't be cached is still a result
+            job.future.set_result(result)
+
+    def _execute(self, job):
+        # Runs the job in a worker, which goes back to the idle ones or is killed whatever happens
+        if job.cancelled:
+            raise TraceCancelled()
+        worker = self._take()
+        try:
+            result = self._run(worker, job)
+        except BaseException as e:
+            # A worker is only reused after an error of the traced call itself
+            if isinstance(e, TraceFailed) and worker[0].is_alive():
+                self._idle.put(worker)
+            else:
+                _kill(worker)
+            raise
+        self._idle.put(worker)
+        return result
+
+    def _take(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_worker()
+            if worker[0].is_alive():
+                return worker
+            worker[1].close()
+
+    def _new_worker(self):
+        connection, child = self._context.Pipe()
+        process = self._context.Process(target=_worker, args=(child, ), daemon=True)
+        process.start()
+        child.close()
+        return process, connection
+
+    def _run(self, worker, job):
+        process, connection = worker
+        connection.send((job.func, job.args, job.kwargs, job.memory_limit))
+        start = time.monotonic()
+        while True:
+            if job.cancelled:
+                raise TraceCancelled()
+            if job.timeout is not None and time.monotonic() - start > job.timeout:
+                raise TraceLimitExceeded(f"took longer than {job.timeout:g} s")
+            if job.memory_limit is not None and job.memory is not None and job.memory > job.memory_limit:
+                raise TraceLimitExceeded(f"used more than {job.memory_limit / 2**20:.0f} MB")
+            if not connection.poll(self.POLL):
+                if not process.is_alive():
+                    raise TraceFailed(f"the worker process exited with code {process.exitcode}")
+                continue
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                process.join(1)
+                raise TraceFailed(f"the worker process exited with code {process.exitcode}")
+            if message[0] == 'progress':
+                job.elapsed, job.memory = message[1:]
+            elif message[0] == 'done':
+                job.elapsed = message[1]
+                return message[2]
+            else:
+                _, error, details, out_of_memory = message
+                if out_of_memory and job.memory_limit is not None:
+                    raise TraceLimitExceeded(f"used more than {job.memory_limit / 2**20:.0f} MB")
+                raise TraceFailed(error, details)
+
+
+def _kill(worker):
+    process, connection = worker
+    process.kill()
+    process.join()
+    connection.close()
+
+
+## Worker process side
+
+REPORT_INTERVAL = 0.1  # seconds between progress reports of a worker
+
+
+def _worker(connection):
+    lock = threading.Lock()
+
+    def send(message):
+        with lock:
+            connection.send(message)
+
+    while True:
+        try:
+            func, args, kwargs, memory_limit = connection.recv()
+        except (EOFError, OSError):
+            return
+        except Exception as e:
+            # The job arrived but can't be unpickled, like a function this process can't import
+            send(('error', f"{type(e).__name__}: {e}", traceback.format_exc(), False))
+            continue
+        start = time.perf_counter()
+        base = _memory()
+        done = threading.Event()
+        reporter = threading.Thread(target=_report, args=(send, start, base, done), daemon=True)
+        reporter.start()
+        previous = _limit_memory(memory_limit)
+        try:
+            result = func.trace(*args, **kwargs)
+        except BaseException as e:
+            result, error = None, e
+            details = traceback.format_exc()
+        else:
+            error = None
+        finally:
+            _restore_memory(previous)
+            done.set()
+            reporter.join()
+        if error is None:
+            try:
+                send(('done', time.perf_counter() - start, result))
+                continue
+            except Exception as e:
+                error, details = e, traceback.format_exc()
+        send(('error', f"{type(error).__name__}: {error}", details, isinstance(error, MemoryError)))
+
+
+def _report(send, start, base, done):
+    while not done.wait(REPORT_INTERVAL):
+        memory = _memory()
+        send(('progress', time.perf_counter() - start, None if memory is None else max(memory - base, 0)))
+
+
+def _memory():
+    # resident memory of this process in bytes, or None
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _limit_memory(limit):
+    # caps the address space at its current size plus limit, returns the previous cap to restore
+    if limit is None or resource is None:
+        return None
+    try:
+        with open('/proc/self/statm') as f:
+            size = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+        cap = size + limit
+        if hard != resource.RLIM_INFINITY:
+            cap = min(cap, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (cap, hard))
+    except (OSError, ValueError, AttributeError):
+        return None  # the parent still stops the run from the reported memory
+    return soft
+
+
+def _restore_memory(previous):
+    if previous is not None:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (previous, hard))
@@ -4,14 +4,29 @@
 # Modified 11/2019 by Brian Ward
 
 import math
+import os
+import re
+import threading
 import warnings
 import tkinter as tk
 import platform
 
+from collections import OrderedDict
+from io import BytesIO
 from tkinter import ttk
 from PIL import Image, ImageTk
 
+try:
+    import cairosvg
+except (ImportError, OSError):  # cairosvg also fails to import when the cairo library is missing
+    cairosvg = None
+
 OS = platform.system()
+HAS_CAIROSVG = cairosvg is not None  # SvgSource can be used
+
+# Pixels per unit of SVG lengths, at 96 dpi
+_UNITS = {'': 1.0, 'px': 1.0, 'pt': 96 / 72, 'pc': 16.0, 'in': 96.0, 'cm': 96 / 2.54, 'mm': 96 / 25.4}
+_LENGTH = re.compile(r'\s*([-+0-9.eE]+)\s*([a-z]*)\s*$')
 
 
 class AutoScrollbar(ttk.Scrollbar):
@@ -30,15 +45,75 @@ class AutoScrollbar(ttk.Scrollbar):
         raise tk.TclError('Cannot use place with the widget ' + self.__class__.__name__)
 
 
+class SvgSource:
+    """ Vector image from SVG data, such as graphviz output, rasterized with cairosvg at any scale """
+    def __init__(self, data):
+        if cairosvg is None:
+            raise ImportError('cairosvg and the cairo library are needed to show SVG images')
+        self.__tree = cairosvg.parser.Tree(bytestring=data.encode() if isinstance(data, str) else data)
+        viewbox = self.__tree.get('viewBox')
+        width, height = _length(self.__tree.get('width')), _length(self.__tree.get('height'))
+        if viewbox:
+            self.__viewbox = tuple(float(v) for v in re.split(r'[\s,]+', viewbox.strip()))
+        else:
+            self.__viewbox = (0.0, 0.0, width, height)
+        # Size in pixels at zoom 1, the same as graphviz's own png output
+        self.size = (math.ceil(width or self.__viewbox[2]), math.ceil(height or self.__viewbox[3]))
+        if not all(self.size):
+            raise ValueError('the SVG image has no size')
+
+    def render(self, box, size):
+        """ Rasterize the area box (x1, y1, x2, y2) of the image at zoom 1 into an image of the given size """
+        vx, vy, vw, vh = self.__viewbox
+        kx, ky = vw / self.size[0], vh / self.size[1]
+        # The parsed tree is reused, only the root's view of it changes
+        self.__tree['width'], self.__tree['height'] = str(size[0]), str(size[1])
+        self.__tree['viewBox'] = '{} {} {} {}'.format(vx + box[0] * kx, vy + box[1] * ky,
+                                                      (box[2] - box[0]) * kx, (box[3] - box[1]) * ky)
+        self.__tree['preserveAspectRatio'] = 'none'
+        output = BytesIO()
+        cairosvg.surface.PNGSurface(self.__tree, output, 96).finish()
+        output.seek(0)
+        return Image.open(output)
+
+
+class CallbackSource:
+    """ Vector image drawn by a callback: render(box, size) returns a PIL image of the area
+        box (x1, y1, x2, y2) of the image at zoom 1, scaled to size (width, height) """
+    def __init__(self, size, render):
+        self.size = size
+        self.render = render
+
+
+def _length(value):
+    """ SVG length in pixels, None for percentages and missing values """
+    match = _LENGTH.match(value or '')
+    if match is None or match.group(2) not in _UNITS:
+        return None
+    return float(match.group(1)) * _UNITS[match.group(2)]
+
+
 class CanvasImage:
-    """ Display and zoom image """
-    def __init__(self, placeholder, path):
+    """ Display and zoom image
+        The image is a file given by path, or a vector source (SvgSource, CallbackSource) that is
+        rasterized in tiles at the current zoom, only where the tiles are visible """
+    def __init__(self, placeholder, path=None, source=None):
         """ Initialize the ImageFrame """
         self.imscale = 1.0  # scale for the canvas image zoom, public for outer classes
         self.__delta = 1.3  # zoom magnitude
-        self.__filter = Image.ANTIALIAS  # could be: NEAREST, BILINEAR, BICUBIC and ANTIALIAS
+        self.__filter = Image.LANCZOS  # could be: NEAREST, BILINEAR, BICUBIC and LANCZOS
         self.__previous_state = 0  # previous state of the keyboard
         self.path = path  # path to the image, should be public for outer classes
+        self.__data = None  # contents of path when it is a file object, so each thread can open its own copy
+        if path is not None and not isinstance(path, (str, bytes, os.PathLike)):
+            self.__data = path.read()
+        self.source = source  # vector source of the image, public for outer classes
+        self.__zoom = 0  # zoom level, the number of steps zoomed in, minus the steps zoomed out
+        self.__tile_size = 256  # side of the tiles on the screen
+        self.__tiles = {}  # (zoom level, tile x, tile y) : (canvas item, PhotoImage) of the tiles on the canvas
+        self.__cache = OrderedDict()  # (zoom level, tile x, tile y) : PhotoImage, least recently used first
+        self.__cache_size = 128  # tiles in the cache, 32 MB of 256 pixel RGBA tiles
+        self.__pending = None  # after_idle() id of the scheduled redraw
         # Create ImageFrame in placeholder widget
         self.__imframe = ttk.Frame(placeholder)  # placeholder of the ImageFrame object
         # Vertical and horizontal scrollbars for canvas
@@ -62,50 +137,65 @@ class CanvasImage:
         # Handle keystrokes in idle mode, because program slows down on a weak computers,
         # when too many key stroke events in the same time
         self.canvas.bind('<Key>', lambda event: self.canvas.after_idle(self.__keystroke, event))
-        # Decide if this image huge or not
         self.__huge = False  # huge or not
-        self.__huge_size = 14000  # define size of the huge image
-        self.__band_width = 1024  # width of the tile band
-        Image.MAX_IMAGE_PIXELS = 1000000000  # suppress DecompressionBombError for big image
-        with warnings.catch_warnings():  # suppress DecompressionBombWarning for big image
-            warnings.simplefilter('ignore')
-            self.__image = Image.open(self.path)  # open image, but down't load it into RAM
-        self.imwidth, self.imheight = self.__image.size  # public for outer classes
-        if self.imwidth * self.imheight > self.__huge_size * self.__huge_size and \
-           self.__image.tile[0][0] == 'raw':  # only raw images could be tiled
-            self.__huge = True  # image is huge
-            self.__offset = self.__image.tile[0][2]  # initial tile offset
-            self.__tile = [
-                self.__image.tile[0][0],  # it have to be 'raw'
-                [0, 0, self.imwidth, 0],  # tile extent (a rectangle)
-                self.__offset,
-                self.__image.tile[0][3]
-            ]  # list of arguments to the decoder
-        self.__min_side = min(self.imwidth, self.imheight)  # get the smaller image side
-        # Create image pyramid
-        self.__pyramid = [self.smaller()] if self.__huge else [Image.open(self.path)]
-        # Set ratio coefficient for image pyramid
-        self.__ratio = max(self.imwidth, self.imheight) / self.__huge_size if self.__huge else 1.0
+        self.__image = None  # opened image file, None for vector sources
+        self.__pyramid = []  # image pyramid, empty for vector sources
+        self.__ratio = 1.0  # ratio coefficient of the image pyramid
         self.__curr_img = 0  # current image from the pyramid
-        self.__scale = self.imscale * self.__ratio  # image pyramide scale
         self.__reduction = 2  # reduction degree of image pyramid
-        (w, h), m, j = self.__pyramid[-1].size, 512, 0
-        n = math.ceil(math.log(min(w, h) / m, self.__reduction)) + 1  # image pyramid length
-        while w > m and h > m:  # top pyramid image is around 512 pixels in size
-            j += 1
-            print('\rCreating image pyramid: {j} from {n}'.format(j=j, n=n), end='')
-            w /= self.__reduction  # divide on reduction degree
-            h /= self.__reduction  # divide on reduction degree
-            self.__pyramid.append(self.__pyramid[-1].resize((int(w), int(h)), self.__filter))
-        print('\r' + (40 * ' ') + '\r', end='')  # hide printed string
+        self.__built = 0  # number of pyramid levels built so far, they are built from the largest
+        self.__shown = 0  # number of pyramid levels built when the tiles were last made
+        self.__placeholder = None  # cheap preview shown until the first pyramid level is built
+        self.__loading = None  # canvas text shown when there is no preview
+        self.__cancel = threading.Event()  # stops building the pyramid
+        self.__builder = None  # thread building the pyramid
+        self.__poll = None  # after() id of the check for new pyramid levels
+        if self.source is None:
+            # Decide if this image huge or not
+            self.__huge_size = 14000  # define size of the huge image
+            self.__band_width = 1024  # width of the tile band
+            Image.MAX_IMAGE_PIXELS = 1000000000  # suppress DecompressionBombError for big image
+            with warnings.catch_warnings():  # suppress DecompressionBombWarning for big image
+                warnings.simplefilter('ignore')
+                self.__image = self.__open()  # open image, but down't load it into RAM
+            self.imwidth, self.imheight = self.__image.size  # public for outer classes
+            if self.imwidth * self.imheight > self.__huge_size * self.__huge_size and \
+               self.__image.tile[0][0] == 'raw':  # only raw images could be tiled
+                self.__huge = True  # image is huge
+                self.__offset = self.__image.tile[0][2]  # initial tile offset
+                self.__tile = [
+                    self.__image.tile[0][0],  # it have to be 'raw'
+                    [0, 0, self.imwidth, 0],  # tile extent (a rectangle)
+                    self.__offset,
+                    self.__image.tile[0][3]
+                ]  # list of arguments to the decoder
+            # Set ratio coefficient for image pyramid
+            self.__ratio = max(self.imwidth, self.imheight) / self.__huge_size if self.__huge else 1.0
+            # Image pyramid, its levels are built in a background thread and are None until then
+            (w, h), m, n = (self.imwidth / self.__ratio, self.imheight / self.__ratio), 512, 1
+            while w > m and h > m:  # top pyramid image is around 512 pixels in size
+                w /= self.__reduction  # divide on reduction degree
+                h /= self.__reduction  # divide on reduction degree
+                n += 1
+            self.__pyramid = [None] * n
+            self.__placeholder = self.__preview()
+            self.__builder = threading.Thread(target=self.__build_pyramid, daemon=True)
+            self.__builder.start()
+        else:
+            self.imwidth, self.imheight = self.source.size  # public for outer classes
+        self.__min_side = min(self.imwidth, self.imheight)  # get the smaller image side
         # Put image into container rectangle and use it to set proper coordinates to the image
         self.container = self.canvas.create_rectangle((0, 0, self.imwidth, self.imheight), width=0)
+        if self.__builder is not None:
+            if self.__placeholder is None:
+                self.__loading = self.canvas.create_text(self.imwidth / 2, self.imheight / 2, text='Loading image...')
+            self.__poll = self.canvas.after(50, self.__wait_pyramid)
         self.__show_image()  # show image on the canvas
         self.canvas.focus_set()  # set focus on the canvas
         self.__scroll_x('moveto', 0.5)
 
     def smaller(self):
-        """ Resize image proportionally and return smaller image """
+        """ Resize image proportionally and return smaller image, None if cancelled """
         w1, h1 = float(self.imwidth), float(self.imheight)
         w2, h2 = float(self.__huge_size), float(self.__huge_size)
         aspect_ratio1 = w1 / h1
@@ -122,23 +212,80 @@ class CanvasImage:
             image = Image.new('RGB', (int(h2 * aspect_ratio1), int(h2)))
             k = h2 / h1  # compression ratio
             w = int(h2 * aspect_ratio1)  # band length
-        i, j, n = 0, 0, math.ceil(self.imheight / self.__band_width)
+        i = 0
         while i < self.imheight:
-            j += 1
-            print('\rOpening image: {j} from {n}'.format(j=j, n=n), end='')
+            if self.__cancel.is_set():
+                return None
             band = min(self.__band_width, self.imheight - i)  # width of the tile band
-            self.__tile[1][3] = band  # set band width
-            self.__tile[2] = self.__offset + self.imwidth * i * 3  # tile offset (3 bytes per pixel)
-            self.__image.close()
-            self.__image = Image.open(self.path)  # reopen / reset image
-            self.__image.size = (self.imwidth, band)  # set size of the tile band
-            self.__image.tile = [self.__tile]  # set tile
-            cropped = self.__image.crop((0, 0, self.imwidth, band))  # crop tile band
-            image.paste(cropped.resize((w, int(band * k) + 1), self.__filter), (0, int(i * k)))
+            cropped = self.__band(i, band)  # crop tile band
+            image.paste(cropped.resize((w, int(band * k) + 1), Image.BOX), (0, int(i * k)))
             i += band
-        print('\r' + (40 * ' ') + '\r', end='')  # hide printed string
         return image
 
+    def __open(self):
+        """ Open the image file, without loading it into RAM """
+        return Image.open(self.path if self.__data is None else BytesIO(self.__data))
+
+    def __band(self, top, height):
+        """ Read the rows top to top + height of a huge image """
+        tile = [self.__tile[0], (0, 0, self.imwidth, height),
+                self.__offset + self.imwidth * top * 3, self.__tile[3]]  # 3 bytes per pixel
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            image = self.__open()  # an image object of its own, so threads don't share one
+        image._size = (self.imwidth, height)  # set size of the tile band, size is read-only in Pillow
+        image.tile = [tuple(tile)]
+        return image.crop((0, 0, self.imwidth, height))
+
+    def __preview(self):
+        """ Cheap low resolution image to show until the pyramid is built, or None.
+            Huge images sample some of their rows, JPEG images are decoded at a reduced size """
+        if self.__huge:
+            h = min(self.imheight, 128)
+            w = max(1, min(self.imwidth, 1024, round(h * self.imwidth / self.imheight)))
+            preview = Image.new('RGB', (w, h))
+            for j in range(h):
+                preview.paste(self.__band(j * self.imheight // h, 1).resize((w, 1), Image.BOX), (0, j))
+            return preview
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            image = self.__open()
+        if image.draft('RGB', (self.imwidth // 8, self.imheight // 8)) is None:  # only JPEG can be drafted
+            image.close()
+            return None
+        image.load()
+        return image
+
+    def __build_pyramid(self):
+        """ Build the pyramid levels in order, largest first. Runs in a background thread """
+        if self.__huge:
+            image = self.smaller()
+        else:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                image = self.__open()
+                image.load()
+        for i in range(len(self.__pyramid)):
+            if image is None or self.__cancel.is_set():
+                return
+            self.__pyramid[i] = image
+            self.__built = i + 1
+            if i + 1 < len(self.__pyramid):
+                image = image.reduce(self.__reduction)  # box filter, much faster than resize
+
+    def __wait_pyramid(self):
+        """ Show the image again each time new pyramid levels are built, until all are """
+        self.__poll = None
+        if self.__built != self.__shown:
+            self.__shown = self.__built
+            if self.__loading is not None:
+                self.canvas.delete(self.__loading)
+                self.__loading = None
+            self.__clear_tiles()  # tiles made from a smaller level or the preview
+            self.__show_image()
+        if self.__built < len(self.__pyramid) and self.__builder.is_alive():
+            self.__poll = self.canvas.after(50, self.__wait_pyramid)
+
     def redraw_figures(self):
         """ Dummy function to redraw figures in the children classes """
         pass
@@ -176,7 +323,13 @@ class CanvasImage:
         self.__show_image()  # redraw the image
 
     def __show_image(self):
+        """ Schedule a redraw of the image, bursts of events are drawn once when the program is idle """
+        if self.__pending is None:
+            self.__pending = self.canvas.after_idle(self.__draw_image)
+
+    def __draw_image(self):
         """ Show image on the Canvas. Implements correct image zoom almost like in Google Maps """
+        self.__pending = None
         box_image = self.canvas.coords(self.container)  # get image area
         box_canvas = (
             self.canvas.canvasx(0),  # get visible area of the canvas
@@ -205,24 +358,69 @@ class CanvasImage:
         y1 = max(box_canvas[1] - box_image[1], 0)
         x2 = min(box_canvas[2], box_image[2]) - box_image[0]
         y2 = min(box_canvas[3], box_image[3]) - box_image[1]
-        if int(x2 - x1) > 0 and int(y2 - y1) > 0:  # show image if it in the visible area
-            if self.__huge and self.__curr_img < 0:  # show huge image, which does not fit in RAM
-                h = int((y2 - y1) / self.imscale)  # height of the tile band
-                self.__tile[1][3] = h  # set the tile band height
-                self.__tile[2] = self.__offset + self.imwidth * int(y1 / self.imscale) * 3
-                self.__image.close()
-                self.__image = Image.open(self.path)  # reopen / reset image
-                self.__image.size = (self.imwidth, h)  # set size of the tile band
-                self.__image.tile = [self.__tile]
-                image = self.__image.crop((int(x1 / self.imscale), 0, int(x2 / self.imscale), h))
-            else:  # show normal image
-                image = self.__pyramid[max(0, self.__curr_img)].crop(  # crop current img from pyramid
-                    (int(x1 / self.__scale), int(y1 / self.__scale), int(x2 / self.__scale), int(y2 / self.__scale)))
-            #
-            imagetk = ImageTk.PhotoImage(image.resize((int(x2 - x1), int(y2 - y1)), self.__filter))
-            imageid = self.canvas.create_image(max(box_canvas[0], box_img_int[0]), max(box_canvas[1], box_img_int[1]), anchor='nw', image=imagetk)
-            self.canvas.lower(imageid)  # set image into background
-            self.canvas.imagetk = imagetk  # keep an extra reference to prevent garbage-collection
+        self.__show_tiles(box_image, x1, y1, x2, y2)
+
+    def __show_tiles(self, box_image, x1, y1, x2, y2):
+        """ Show the tiles in the visible area (x1, y1, x2, y2) of the zoomed image and drop the others.
+            Tiles are made at the current zoom, so they stay sharp, and kept in a LRU cache by
+            (zoom level, tile x, tile y) so panning and zooming back only converts the new ones """
+        t = self.__tile_size
+        width, height = box_image[2] - box_image[0], box_image[3] - box_image[1]  # size of the zoomed image
+        visible = set()
+        if int(x2 - x1) > 0 and int(y2 - y1) > 0:
+            visible = {(self.__zoom, tx, ty) for tx in range(int(x1 // t), math.ceil(x2 / t))
+                       for ty in range(int(y1 // t), math.ceil(y2 / t))}
+        for key in set(self.__tiles) - visible:
+            self.canvas.delete(self.__tiles.pop(key)[0])
+        for key in visible:
+            if key in self.__cache:
+                self.__cache.move_to_end(key)  # recently used
+                imagetk = self.__cache[key]
+            elif key in self.__tiles:
+                continue
+            else:
+                _, tx, ty = key
+                x, y = tx * t, ty * t  # corner of the tile in the zoomed image
+                w, h = math.ceil(min(t, width - x)), math.ceil(min(t, height - y))
+                image = self.__tile_image(x, y, w, h) if w > 0 and h > 0 else None
+                if image is None:
+                    continue
+                imagetk = ImageTk.PhotoImage(image)
+                self.__cache[key] = imagetk
+                if len(self.__cache) > self.__cache_size:
+                    self.__cache.popitem(last=False)  # tiles on the canvas keep their own reference
+            if key not in self.__tiles:
+                _, tx, ty = key
+                imageid = self.canvas.create_image(box_image[0] + tx * t, box_image[1] + ty * t,
+                                                   anchor='nw', image=imagetk)
+                self.canvas.lower(imageid)  # set tile into background
+                self.__tiles[key] = (imageid, imagetk)  # keep a reference to prevent garbage-collection
+
+    def __tile_image(self, x, y, w, h):
+        """ Image of size (w, h) for the area of the zoomed image at (x, y), None if there is nothing to show yet """
+        box = (x / self.imscale, y / self.imscale,  # area of the tile in the image
+               min((x + w) / self.imscale, self.imwidth), min((y + h) / self.imscale, self.imheight))
+        if self.source is not None:  # rasterize vector image
+            return self.source.render(box, (w, h))
+        if self.__huge and self.__curr_img < 0:  # show huge image, which does not fit in RAM
+            top = int(box[1])
+            band = self.__band(top, math.ceil(box[3]) - top)
+            return band.resize((w, h), self.__filter, box=(box[0], box[1] - top, box[2], box[3] - top))
+        if self.__built:  # current image from pyramid, or the nearest larger one built so far
+            level = self.__pyramid[min(max(0, self.__curr_img), self.__built - 1)]
+        elif self.__placeholder is not None:
+            level = self.__placeholder
+        else:
+            return None
+        sx, sy = level.width / self.imwidth, level.height / self.imheight  # scale of the level
+        return level.resize((w, h), self.__filter, box=(box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy))
+
+    def __clear_tiles(self):
+        """ Remove all the tiles from the canvas and the cache """
+        for imageid, _ in self.__tiles.values():
+            self.canvas.delete(imageid)
+        self.__tiles.clear()
+        self.__cache.clear()
 
     def __move_from(self, event):
         """ Remember previous coordinates for scrolling with the mouse """
@@ -253,27 +451,31 @@ class CanvasImage:
             if event.delta < 0:  # scroll down, zoom out, smaller
                 if round(self.__min_side * self.imscale) < 30: return  # image is less than 30 pixels
                 self.imscale /= self.__delta
+                self.__zoom -= 1
                 scale /= self.__delta
             if event.delta > 0:  # scroll up, zoom in, bigger
                 i = float(min(self.canvas.winfo_width(), self.canvas.winfo_height()) >> 1)
                 if i < self.imscale: return  # 1 pixel is bigger than the visible area
                 self.imscale *= self.__delta
+                self.__zoom += 1
                 scale *= self.__delta
         else:
             # Respond to Linux (event.num) or Windows (event.delta) wheel event
             if event.num == 5 or event.delta == -120:  # scroll down, zoom out, smaller
                 if round(self.__min_side * self.imscale) < 30: return  # image is less than 30 pixels
                 self.imscale /= self.__delta
+                self.__zoom -= 1
                 scale /= self.__delta
             if event.num == 4 or event.delta == 120:  # scroll up, zoom in, bigger
                 i = float(min(self.canvas.winfo_width(), self.canvas.winfo_height()) >> 1)
                 if i < self.imscale: return  # 1 pixel is bigger than the visible area
                 self.imscale *= self.__delta
+                self.__zoom += 1
                 scale *= self.__delta
         # Take appropriate image from the pyramid
-        k = self.imscale * self.__ratio  # temporary coefficient
-        self.__curr_img = min((-1) * int(math.log(k, self.__reduction)), len(self.__pyramid) - 1)
-        self.__scale = k * math.pow(self.__reduction, max(0, self.__curr_img))
+        if self.source is None:
+            k = self.imscale * self.__ratio  # temporary coefficient
+            self.__curr_img = min((-1) * int(math.log(k, self.__reduction)), len(self.__pyramid) - 1)
         #
         self.canvas.scale('all', x, y, scale, scale)  # rescale all objects
         # Redraw some figures before showing image on the screen
@@ -299,23 +501,28 @@ class CanvasImage:
 
     def crop(self, bbox):
         """ Crop rectangle from the image and return it """
-        if self.__huge:  # image is huge and not totally in RAM
+        if self.source is not None:  # rasterize the rectangle at the image size
+            return self.source.render(bbox, (int(bbox[2] - bbox[0]), int(bbox[3] - bbox[1])))
+        elif self.__huge:  # image is huge and not totally in RAM
             band = bbox[3] - bbox[1]  # width of the tile band
-            self.__tile[1][3] = band  # set the tile height
-            self.__tile[2] = self.__offset + self.imwidth * bbox[1] * 3  # set offset of the band
-            self.__image.close()
-            self.__image = Image.open(self.path)  # reopen / reset image
-            self.__image.size = (self.imwidth, band)  # set size of the tile band
-            self.__image.tile = [self.__tile]
-            return self.__image.crop((bbox[0], 0, bbox[2], band))
-        else:  # image is totally in RAM
+            return self.__band(bbox[1], band).crop((bbox[0], 0, bbox[2], band))
+        elif self.__built:  # image is totally in RAM
             return self.__pyramid[0].crop(bbox)
+        else:  # image is still being loaded
+            return self.__open().crop(bbox)
 
     def destroy(self):
         """ ImageFrame destructor """
-        self.__image.close()
-        map(lambda i: i.close, self.__pyramid)  # close all pyramid images
-        del self.__pyramid[:]  # delete pyramid list
-        del self.__pyramid  # delete pyramid variable
+        self.__cancel.set()  # stop building the pyramid
+        for after in (self.__poll, self.__pending):
+            if after is not None:
+                self.canvas.after_cancel(after)
+        self.__poll = self.__pending = None
+        if self.__image is not None:
+            self.__image.close()
+        self.__tiles.clear()
+        self.__cache.clear()
+        self.__placeholder = None
+        self.__pyramid[:] = [None] * len(self.__pyramid)  # release pyramid images, the builder may still hold the list
         self.canvas.destroy()
         self.__imframe.destroy()
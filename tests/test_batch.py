@@ -0,0 +1,14 @@
+import numpy as np
+
+from batch import directories, frame_image
+from tablestyle import CELL_HEIGHT
+
+
+def test_repeated_inputs_get_their_own_directories():
+    inputs = [(10, 3), (8, 4), (10, 3), (10, 3)]
+    assert directories('binom', inputs) == ['n=10_k=3', 'n=8_k=4', 'n=10_k=3-2', 'n=10_k=3-3']
+
+
+def test_frame_image_draws_one_cell_per_value():
+    image = frame_image(np.arange(6).reshape(2, 3), np.zeros((2, 3), dtype=int))
+    assert image.size[1] == 2 * CELL_HEIGHT + 1
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import benchmark
+from benchmark import fit, predict, solve, regressions, untraced
+from rcviz import callgraph
+from fib import fib, fib_iter
+from lis import lis
+
+SIZES = [2, 4, 8, 16, 32]
+
+
+def test_fit_tells_power_laws_from_exponentials():
+    power = fit(SIZES, [3 * n**2 for n in SIZES])
+    assert power['model'] == 'power' and power['r2'] == pytest.approx(1)
+    assert power['a'] == pytest.approx(3) and power['b'] == pytest.approx(2)
+    exponential = fit(SIZES, [0.5 * 1.6**n for n in SIZES])
+    assert exponential['model'] == 'exponential'
+    assert exponential['a'] == pytest.approx(0.5) and exponential['b'] == pytest.approx(1.6)
+    # zeros can't be fitted in log space, too few points are left
+    assert fit(SIZES, [0, 0, 0, 1, 2]) is None
+
+
+def test_predict_and_solve_invert_each_other():
+    for curve in (fit(SIZES, [3 * n**2 for n in SIZES]), fit(SIZES, [0.5 * 1.6**n for n in SIZES])):
+        assert predict(curve, 20) == pytest.approx(curve['a'] * (20**curve['b'] if curve['model'] == 'power' else curve['b']**20))
+        assert solve(curve, predict(curve, 20)) == pytest.approx(20)
+    assert solve({'model': 'power', 'a': 1.0, 'b': 0.0}, 5) == float('inf')
+    assert solve({'model': 'exponential', 'a': 1.0, 'b': 1.0}, 5) == float('inf')
+
+
+def row(size, traced, overhead, problem='fib', formulation='recursive'):
+    return dict(problem=problem, formulation=formulation, size=size, traced={'median': traced}, overhead=overhead)
+
+
+def test_regressions_compare_the_overhead():
+    baseline = [row(10, 0.01, 4.0), row(20, 0.1, 4.0), row(30, 1.0, 4.0), row(10, 0.01, 4.0, formulation='dp')]
+    rows = [
+        row(10, 0.02, 4.9),  # within the tolerance
+        row(20, 0.2, 5.1),  # over it
+        row(30, 5e-4, 9.0),  # too quick to compare
+        row(40, 2.0, 9.0),  # no baseline
+        row(10, 0.05, 8.0, formulation='dp'),
+    ]
+    found = regressions(rows, baseline, tolerance=0.25)
+    assert [(new['formulation'], new['size']) for new, _ in found] == [('recursive', 20), ('dp', 10)]
+    assert found[0][1] is baseline[1]
+    assert regressions(rows, baseline, tolerance=1.5) == []
+
+
+def test_untraced_records_nothing():
+    sequence = [3, 1, 4, 1, 5, 9, 2, 6]
+    expected = lis.trace(sequence).result
+    with callgraph() as graph:
+        assert untraced(fib)(15) == 610
+        # lis recurses through lis_smaller, both are undecorated
+        assert untraced(lis)(sequence) == expected
+    assert len(graph) == 0
+    assert untraced(fib_iter) is fib_iter.func
+
+
+def test_stats():
+    summary = benchmark.stats([1.0, 2.0, 3.0, 4.0, 100.0])
+    assert summary['median'] == 3.0 and summary['min'] == 1.0 and summary['max'] == 100.0
+    assert summary['iqr'] == 2.0 and summary['runs'] == 5
+    assert summary['stdev'] == pytest.approx(np.std([1, 2, 3, 4, 100], ddof=1))
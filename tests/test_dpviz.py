@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from dpviz import dpviz
+
+
+def edit_distance(A, B):
+    dp_table = np.zeros((len(A) + 1, len(B) + 1), dtype=int)
+    for j in range(len(B) + 1):
+        dp_table[0][j] = j
+    for i in range(1, len(A) + 1):
+        dp_table[i][0] = i
+        for j in range(1, len(B) + 1):
+            insert = dp_table[i][j - 1] + 1
+            delete = dp_table[i - 1][j] + 1
+            replace = dp_table[i - 1][j - 1] + (A[i - 1] != B[j - 1])
+            dp_table[i][j] = min(insert, delete, replace)
+    return dp_table[-1][-1]
+
+
+def through_aliases(n):
+    dp_table = np.zeros((n, n), dtype=int)
+    for i in range(n):
+        row = dp_table[i]
+        for j in range(n):
+            row[j] = i + j
+        if i == 1:
+            dp_table.fill(0)
+    np.copyto(dp_table, 7)
+    return int(dp_table.sum())
+
+
+def frames(func, args, **kwargs):
+    viz = dpviz(func, **kwargs)
+    viz(*args)
+    return [np.asarray(table).tolist() for table in viz.tables]
+
+
+@pytest.mark.parametrize('backend, capture', [('local', 'compare'), ('local', 'writes'), ('ast', 'compare')])
+def test_backends_record_the_frames_of_settrace(backend, capture):
+    args = ('kitten', 'sitting')
+    assert frames(edit_distance, args, backend=backend, capture=capture) == frames(edit_distance, args, backend='settrace')
+
+
+def test_local_sees_writes_through_other_names():
+    # row[j] = x stores into a cell, fill and copyto are calls on lines mentioning dp_table
+    assert frames(through_aliases, (4, ), backend='local') == frames(through_aliases, (4, ), backend='settrace')
+
+
+def test_writes_rejected_with_settrace():
+    with pytest.raises(ValueError):
+        dpviz(edit_distance, backend='settrace', capture='writes')
+
+
+def add_to_rows(n):
+    dp_table = np.zeros((n, 2), dtype=int)
+    for i in range(n):
+        dp_table[i] += i + 1
+    return dp_table
+
+
+def fill_then_write(n):
+    dp_table = np.zeros(n, dtype=int)
+    dp_table.fill(3)
+    dp_table[0] = 1
+    return dp_table
+
+
+@pytest.mark.parametrize('backend', ['local', 'ast'])
+def test_writes_capture_in_place_row_arithmetic(backend):
+    assert frames(add_to_rows, (3, ), backend=backend, capture='writes') == frames(add_to_rows, (3, ), backend='settrace')
+
+
+@pytest.mark.parametrize('backend', ['local', 'ast'])
+def test_writes_capture_ends_on_the_live_table(backend):
+    # fill bypasses __setitem__, the final frame still matches the table the call returned
+    viz = dpviz(fill_then_write, backend=backend, capture='writes')
+    table = np.asarray(viz(3))
+    assert np.asarray(viz.tables[-1]).tolist() == table.tolist() == [1, 3, 3]
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from policies import RecordingPolicy
+from snapshots import ListStore, DeltaStore
+
+
+def fill(recorder, shape=(8, 8)):
+    # fills a table one cell at a time, row by row, and returns every state it went through
+    table = np.zeros(shape, dtype=np.int64)
+    states = [table.copy()]
+    recorder.observe(table)
+    for i in range(table.size):
+        table.reshape(-1)[i] = i + 1
+        recorder.observe(table)
+        states.append(table.copy())
+    recorder.finish()
+    return states
+
+
+POLICIES = {
+    'max_frames': RecordingPolicy(max_frames=10),
+    'max_frames-adaptive': RecordingPolicy(max_frames=7, sampling='adaptive'),
+    'every': RecordingPolicy(every=5),
+    'rows': RecordingPolicy(rows=True),
+    'rows-max_frames': RecordingPolicy(rows=True, max_frames=4),
+    'min_interval': RecordingPolicy(min_interval=3600),
+}
+
+
+@pytest.mark.parametrize('name', POLICIES)
+@pytest.mark.parametrize('store', [ListStore, DeltaStore])
+def test_first_and_final_states_are_kept(name, store):
+    policy = POLICIES[name]
+    recorder = policy.recorder(store())
+    states = fill(recorder)
+    frames = list(recorder.store)
+    np.testing.assert_array_equal(frames[0], states[0])
+    np.testing.assert_array_equal(frames[-1], states[-1])
+    # every kept frame is one of the states, in order
+    positions = [next(i for i, state in enumerate(states) if np.array_equal(state, frame)) for frame in frames]
+    assert positions == sorted(set(positions))
+    if policy.max_frames:
+        assert len(frames) < policy.max_frames
+
+
+def test_every():
+    recorder = RecordingPolicy(every=5).recorder(ListStore())
+    fill(recorder, (4, 5))
+    assert [int(frame.max()) for frame in recorder.store] == [0, 5, 10, 15, 20]
+
+
+def test_rows_records_row_ends():
+    recorder = RecordingPolicy(rows=True).recorder(ListStore())
+    fill(recorder, (4, 5))
+    assert [int(frame.max()) for frame in recorder.store] == [0, 5, 10, 15, 20]
+
+
+def test_min_interval_keeps_final_state():
+    recorder = RecordingPolicy(min_interval=3600).recorder(ListStore())
+    fill(recorder, (3, 3))
+    assert [int(frame.max()) for frame in recorder.store] == [0, 9]
+
+
+def test_records_all():
+    assert RecordingPolicy().records_all
+    assert not RecordingPolicy(max_frames=10).records_all
+    with pytest.raises(ValueError):
+        RecordingPolicy(max_frames=1)
+
+
+@pytest.mark.parametrize('store', [ListStore, DeltaStore])
+def test_rebound_table_keeps_its_last_frame(store):
+    recorder = RecordingPolicy(max_frames=4).recorder(store())
+    table = np.zeros(3, dtype=np.int64)
+    recorder.observe(table)
+    for i in range(2):
+        table[i] = 7 + i
+        recorder.observe(table)
+    # dp_table rebound to a larger table holding the old values
+    table = np.zeros(5, dtype=np.int64)
+    table[:2] = 7, 8
+    recorder.observe(table)
+    table[2] = 9
+    recorder.observe(table)
+    recorder.finish()
+    np.testing.assert_array_equal(recorder.store[-1], [7, 8, 9, 0, 0])
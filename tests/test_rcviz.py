@@ -0,0 +1,262 @@
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+from cache import RenderCache, make_key
+from rcviz import rcviz, callgraph
+import lis
+
+
+@rcviz
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+
+def record(n, memo=False):
+    with callgraph(memo) as graph:
+        fib(n)
+    return graph
+
+
+def test_fingerprint_follows_the_recorded_calls():
+    assert record(6).fingerprint() == record(6).fingerprint()
+    assert record(6).fingerprint() != record(7).fingerprint()
+    assert record(6).fingerprint() != record(6, memo=True).fingerprint()
+
+
+def test_render_key_needs_no_dot(monkeypatch):
+    graph = record(12)
+    cache = RenderCache()
+    key = make_key('callgraph.render', graph.fingerprint(), 'png', True, 10, None, 'depth', [], 'dot')
+    cache.put(key, b'image')
+
+    def no_dot(*args):
+        pytest.fail('DOT was generated for a cache hit')
+
+    monkeypatch.setattr(callgraph, '_dot_lines', no_dot)
+    job = graph.render_job('png', max_nodes=10, cache=cache)
+    assert job.future.result() == b'image'
+
+
+def chain(returns):
+    @rcviz
+    def f(n):
+        if n:
+            f(n - 1)
+        return returns[n]
+    return f
+
+
+def test_fingerprint_covers_every_label():
+    graphs = []
+    for returns in ([0, 1, 2, 3], [3, 3, 3, 3]):
+        f = chain(returns)
+        with callgraph() as graph:
+            f(3)
+        graphs.append(graph)
+    assert graphs[0].digest() != graphs[1].digest()
+    assert graphs[0].fingerprint() != graphs[1].fingerprint()
+
+
+def test_labels_use_str():
+    @rcviz
+    def value(v):
+        return v
+
+    with callgraph() as graph:
+        value(np.int64(0))
+        value(list(range(10)))
+        value(list(range(100)))
+    rets = [node.ret for node in graph.get_nodes()]
+    assert rets[0] == '0'
+    assert rets[1] == str(list(range(10)))
+    assert len(rets[2]) == value.max_label and rets[2].startswith('[0, 1, 2') and rets[2].endswith('...')
+
+
+def reference_parents(functions, call):
+    # parents as the original inspect.stack() version found them, from the frame that made each call
+    codes = {f.wrapped.__code__ for f in functions}
+    nodes, parents = {}, []
+
+    def profile(frame, event, arg):
+        if event != 'call' or frame.f_code not in codes:
+            return
+        caller = frame.f_back
+        while caller is not None and caller.f_code not in codes:
+            caller = caller.f_back
+        parents.append(nodes[caller] if caller is not None else -1)
+        nodes[frame] = len(parents) - 1
+
+    sys.setprofile(profile)
+    try:
+        call()
+    finally:
+        sys.setprofile(None)
+    return parents
+
+
+@rcviz
+def raises_at_one(n):
+    if n == 1:
+        raise ValueError(n)
+    total = 0
+    for k in range(n):
+        try:
+            total += raises_at_one(k)
+        except ValueError:
+            total -= 1
+    return total
+
+
+@pytest.mark.parametrize('functions, call', [
+    (lambda: [fib], lambda: fib(7)),
+    (lambda: [lis.lis, lis.lis_smaller], lambda: lis.lis([3, 1, 4, 1, 5, 9, 2])),
+    (lambda: [raises_at_one], lambda: raises_at_one(5)),
+])
+def test_parents_match_the_calling_frames(functions, call):
+    with callgraph() as graph:
+        call()
+    assert list(graph._parents) == reference_parents(functions(), call)
+    assert len(graph) > 10
+
+
+def test_raised_calls_keep_no_unwind_order():
+    with callgraph() as graph:
+        raises_at_one(4)
+    raised = [i for i, node in enumerate(graph.get_nodes()) if node.args == (1, )]
+    assert raised and all(graph.order(i)[1] == 0 for i in raised)
+    assert all(graph.order(i)[1] > 0 for i in range(1, len(graph)) if i not in raised)
+
+
+@rcviz
+def tracked_fib(n):
+    tracked_fib.track(n_squared=n * n, seen=[n])
+    if n < 2:
+        return n
+    return tracked_fib(n - 1) + tracked_fib(n - 2)
+
+
+def columns(graph):
+    nodes = graph.get_nodes()
+    return ([n.args for n in nodes], [n.kwargs for n in nodes], [n.ret for n in nodes], [n.auxdata for n in nodes],
+            [graph.fn_name(i) for i in range(len(graph))], [graph.order(i) for i in range(len(graph))],
+            [graph.hits(i) for i in range(len(graph))], [graph.time(i) for i in range(len(graph))],
+            list(graph.get_parents()), graph.edges(), graph.total_calls)
+
+
+@pytest.mark.parametrize('memo', [False, True])
+def test_pickle_round_trip(memo):
+    with callgraph(memo) as graph:
+        tracked_fib(8)
+        # pickled while recording, the running session stays behind
+        copy = pickle.loads(pickle.dumps(graph))
+    assert copy.get_stack() == [] and copy._tokens == []
+    assert columns(copy) == columns(graph)
+    assert copy.digest() == graph.digest()
+    assert copy.fingerprint() == graph.fingerprint()
+    assert graph.get_nodes()[0].auxdata == {'n_squared': 64, 'seen': '[8]'}
+
+
+def test_arrays_hold_one_entry_per_node():
+    with callgraph() as graph:
+        fib(6)
+    assert len(graph) == 25
+    for column in (graph._parents, graph._calls, graph._unwinds, graph._fns, graph._times, graph._hits):
+        assert len(column) == len(graph)
+    # the root has no edge, the others are numbered 1.. in call and in unwind order
+    assert graph.get_parents()[0] == -1 and graph.order(0) == (0, 0)
+    orders = [graph.order(i) for i in range(1, len(graph))]
+    assert sorted(c for c, _ in orders) == sorted(u for _, u in orders) == list(range(1, len(graph)))
+
+
+def test_memo_shares_equal_calls():
+    tree, dag = record(10), record(10, memo=True)
+    # one node per subproblem fib(0)..fib(10), each hit as often as the tree calls it
+    assert len(dag) == 11 and len(tree) == 177
+    assert dag.total_calls == tree.total_calls == 177
+    calls = {}
+    for node in tree.get_nodes():
+        calls[node.args] = calls.get(node.args, 0) + 1
+    assert {node.args: dag.hits(i) for i, node in enumerate(dag.get_nodes())} == calls
+    assert sum(count for _, _, count in dag.edges()) == tree.total_calls - 1
+    assert '177 calls, 11 distinct' in ''.join(dag.dot_lines())
+
+
+def test_trace_with_memo():
+    fib.cache = RenderCache()
+    try:
+        graph = fib.trace(8, memo=True)
+        assert graph.memo and graph.result == 21 and len(graph) == 9
+        cached = fib.trace(8, memo=True)
+        assert cached.memo and cached.fingerprint() == graph.fingerprint()
+        assert not fib.trace(8).memo
+        assert fib.cache_key(8, memo=True) != fib.cache_key(8)
+    finally:
+        fib.cache = None
+
+
+def descendants(graph, node_id):
+    children = graph.children()
+    below, levels, stack = [], 0, [(node_id, 0)]
+    while stack:
+        node_id, level = stack.pop()
+        levels = max(levels, level)
+        below.extend(children[node_id])
+        stack.extend((kid, level + 1) for kid in children[node_id])
+    return below, levels
+
+
+@pytest.mark.parametrize('collapse', ['depth', 'largest'])
+@pytest.mark.parametrize('max_nodes, max_depth', [(1, None), (10, None), (40, None), (None, 3), (30, 4)])
+def test_visible_keeps_within_the_budget(collapse, max_nodes, max_depth):
+    graph = record(10)
+    shown, collapsed = graph.visible(max_nodes, max_depth, collapse)
+    children = graph.children()
+    assert shown == sorted(set(shown)) and shown[0] == 0
+    if max_nodes is not None:
+        assert len(shown) <= max_nodes
+    visible = set(shown)
+    parents = graph.get_parents()
+    # every shown node hangs off a shown node, and a node is either opened whole or collapsed
+    assert all(parents[node_id] in visible for node_id in shown[1:])
+    for node_id in shown:
+        kids = set(children[node_id])
+        assert (kids <= visible) != (node_id in collapsed) or not kids
+        assert not kids & visible or kids <= visible
+    assert collapsed and collapsed <= visible
+
+
+def test_largest_subtrees_stay_collapsed():
+    graph = record(10)
+    shown, collapsed = graph.visible(20, collapse='largest')
+    sizes = {node_id: len(descendants(graph, node_id)[0]) for node_id in range(len(graph))}
+    opened = [node_id for node_id in shown if graph.children()[node_id] and node_id not in collapsed]
+    # of two siblings, the smaller subtree is opened first
+    assert max(sizes[i] for i in opened if i) <= max(sizes[i] for i in collapsed)
+    assert graph.visible(20, collapse='depth') != (shown, collapsed)
+    with pytest.raises(ValueError):
+        graph.visible(20, collapse='widest')
+
+
+def test_summary_of_a_collapsed_node():
+    graph = record(9)
+    shown, collapsed = graph.visible(12)
+    for node_id in collapsed:
+        below, levels = descendants(graph, node_id)
+        rets = [graph.get_nodes()[i].ret for i in below]
+        assert graph.summary(node_id) == (len(below), levels, min(rets), max(rets))
+    assert graph.summary(len(graph) - 1) == (0, 0, None, None)
+    dot = ''.join(graph.dot_lines(max_nodes=12))
+    assert dot.count('calls in') == len(collapsed) == dot.count('fillcolor="#dddddd"')
+    node_id = min(collapsed)
+    calls, levels, low, high = graph.summary(node_id)
+    assert f'{calls} calls in {levels} levels below | rets: {low} .. {high}' in dot
+
+
+def test_memo_graphs_are_shown_whole():
+    graph = record(10, memo=True)
+    assert graph.visible(3, 1) == (list(range(len(graph))), set())
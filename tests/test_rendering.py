@@ -0,0 +1,102 @@
+import os
+import time
+
+import graphviz as gviz
+import pytest
+
+from rendering import RenderJob, RenderCancelled
+from test_rcviz import record
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='the fake engines are shell scripts')
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    ''' installs a shell script as dot, in place of graphviz '''
+    monkeypatch.setenv('PATH', str(tmp_path) + os.pathsep + os.environ['PATH'])
+
+    def install(script):
+        path = tmp_path / 'dot'
+        path.write_text('#!/bin/sh\n' + script + '\n')
+        path.chmod(0o755)
+        return path
+    return install
+
+
+def test_lines_are_streamed_into_the_engine(engine):
+    engine('cat')  # the "image" is the DOT source it was given
+    written = []
+
+    def lines():
+        for i in range(1000):
+            written.append(i)
+            yield 'line %d\n' % i
+
+    job = RenderJob(lines(), total=1000, chunk_size=100)
+    assert job.progress == 0
+    image = job.run()
+    assert image == ''.join('line %d\n' % i for i in range(1000)).encode()
+    assert job.written == 1000 and job.progress == 1.0
+    assert RenderJob(iter(()), total=None).progress is None
+
+
+def test_render_job_of_a_graph(engine):
+    engine('cat')
+    graph = record(8)
+    job = graph.render_async('svg', max_nodes=10)
+    assert job.future.result(timeout=10).decode() == ''.join(graph.dot_lines(max_nodes=10))
+    shown, _ = graph.visible(10)
+    # a line per node and per edge, progress can pass 1 on the header and closing lines
+    assert job.total == 2 * len(shown) and job.progress == 1.0
+
+
+def test_cancel_kills_the_engine(engine, tmp_path):
+    engine('echo $$ > "%s"\ncat > /dev/null\nsleep 60' % (tmp_path / 'pid'))
+    job = RenderJob(iter(['digraph {}\n'])).start()
+    deadline = time.monotonic() + 10
+    while not (tmp_path / 'pid').exists() or not (tmp_path / 'pid').read_text().strip():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    job.cancel()
+    with pytest.raises(RenderCancelled):
+        job.future.result(timeout=10)
+    assert job.cancelled and job._process.poll() is not None
+    with pytest.raises(ProcessLookupError):
+        os.kill(int((tmp_path / 'pid').read_text()), 0)
+
+
+def test_cancel_stops_writing(engine):
+    engine('cat > /dev/null')
+    job = RenderJob(None)
+
+    def lines():
+        for i in range(100):
+            if i == 10:
+                job.cancel()
+            yield 'line\n'
+
+    job.lines = lines()
+    with pytest.raises(RenderCancelled):
+        job.run()
+    assert job.written == 10
+
+
+def test_cancel_before_start_never_runs_the_engine(engine, tmp_path):
+    engine('touch "%s"' % (tmp_path / 'ran'))
+    job = RenderJob(iter(['digraph {}\n']))
+    job.cancel()
+    with pytest.raises(RenderCancelled):
+        job.run()
+    assert not (tmp_path / 'ran').exists()
+
+
+def test_engine_errors_reach_the_future(engine, monkeypatch, tmp_path):
+    engine('cat > /dev/null\necho "syntax error" >&2\nexit 3')
+    with pytest.raises(gviz.CalledProcessError) as failure:
+        RenderJob(iter(['digraph {\n'])).run()
+    assert failure.value.returncode == 3 and b'syntax error' in failure.value.stderr
+    monkeypatch.setenv('PATH', str(tmp_path / 'empty'))
+    with pytest.raises(gviz.ExecutableNotFound):
+        RenderJob(iter(['digraph {}\n']), engine='neato').run()
+    with pytest.raises(ValueError):
+        RenderJob(iter(()), engine='latex')
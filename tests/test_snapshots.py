@@ -0,0 +1,203 @@
+import numpy as np
+import pytest
+
+from snapshots import SnapshotStore, ListStore, DeltaStore, MemmapStore, Cursor, value_range
+
+
+def mixed_tables():
+    # a float table, an int table of the same shape, then floats again, each changing a few cells per frame
+    rng = np.random.default_rng(0)
+    tables = []
+    for dtype in (np.float64, np.int64, np.float64):
+        table = np.zeros((6, 5), dtype=dtype)
+        tables.append(table.copy())
+        for _ in range(12):
+            table.reshape(-1)[rng.integers(0, table.size, 3)] = rng.integers(1, 100, 3)
+            tables.append(table.copy())
+    return tables
+
+
+def assert_same_frames(store, expected):
+    assert len(store) == len(expected)
+    for i, table in enumerate(expected):
+        assert store[i].dtype == table.dtype
+        np.testing.assert_array_equal(store[i], table)
+    for table, frame in zip(expected, store):
+        np.testing.assert_array_equal(frame, table)
+
+
+@pytest.mark.parametrize('make', [lambda tmp_path: DeltaStore(keyframe_ratio=0.5),
+                                  lambda tmp_path: MemmapStore(tmp_path / 'trace', ram_budget=256, keyframe_ratio=0.5)])
+def test_mixed_dtypes_match_list_store(make, tmp_path):
+    reference, store = ListStore(), make(tmp_path)
+    for table in mixed_tables():
+        assert store.append(table) == reference.append(table)
+    assert_same_frames(store, list(reference))
+
+    kept = [0, 3, 13, 14, 20, len(reference) - 1]
+    reference.select(kept)
+    store.select(kept)
+    assert_same_frames(store, list(reference))
+
+
+def test_memmap_mixed_dtypes_reload(tmp_path):
+    reference, store = ListStore(), MemmapStore(tmp_path, ram_budget=256, keyframe_ratio=0.5)
+    for table in mixed_tables():
+        reference.append(table)
+        store.append(table)
+    store.flush()
+    assert_same_frames(MemmapStore.load(tmp_path), list(reference))
+
+
+STORES = {
+    'list': lambda tmp_path: ListStore(),
+    'delta': lambda tmp_path: DeltaStore(),
+    'delta-small-segments': lambda tmp_path: DeltaStore(keyframe_ratio=0.1),
+    'memmap': lambda tmp_path: MemmapStore(tmp_path / 'trace', ram_budget=512, keyframe_ratio=0.3),
+}
+
+
+def filled_tables():
+    # the states of a DP table filled one cell at a time, row by row
+    table = np.zeros((5, 7), dtype=np.int64)
+    tables = [table.copy()]
+    for i in range(table.size):
+        table.reshape(-1)[i] = i * i + 1
+        tables.append(table.copy())
+    return tables
+
+
+@pytest.mark.parametrize('kind', STORES)
+def test_round_trip(kind, tmp_path):
+    store = STORES[kind](tmp_path)
+    tables = filled_tables()
+    for table in tables:
+        assert store.append(table)
+    assert_same_frames(store, tables)
+    np.testing.assert_array_equal(store[-1], tables[-1])
+    assert [t.tolist() for t in store[2:5]] == [t.tolist() for t in tables[2:5]]
+    with pytest.raises(IndexError):
+        store[len(tables)]
+
+
+@pytest.mark.parametrize('kind', STORES)
+def test_round_trip_diffs(kind, tmp_path):
+    store = STORES[kind](tmp_path)
+    tables = filled_tables()
+    store.append(tables[0])
+    for i in range(1, len(tables)):
+        assert store.append_diff([i - 1], [tables[i].reshape(-1)[i - 1]])
+    assert_same_frames(store, tables)
+
+
+@pytest.mark.parametrize('kind', STORES)
+def test_duplicates_are_dropped(kind, tmp_path):
+    store = STORES[kind](tmp_path)
+    table = np.arange(6).reshape(2, 3)
+    assert store.append(table)
+    assert not store.append(table.copy())
+    assert len(store) == 1
+
+
+@pytest.mark.parametrize('kind', STORES)
+def test_stored_frames_are_copies(kind, tmp_path):
+    store = STORES[kind](tmp_path)
+    table = np.zeros(4, dtype=np.int64)
+    store.append(table)
+    table[0] = 1
+    store.append(table)
+    table[1] = 2
+    assert store[0].tolist() == [0, 0, 0, 0]
+    assert store[1].tolist() == [1, 0, 0, 0]
+
+
+@pytest.mark.parametrize('kind', STORES)
+def test_select(kind, tmp_path):
+    store = STORES[kind](tmp_path)
+    tables = filled_tables()
+    for table in tables:
+        store.append(table)
+    kept = [0, 1, 9, 20, len(tables) - 1]
+    store.select(kept)
+    assert_same_frames(store, [tables[i] for i in kept])
+    # appending continues from the newest kept frame
+    table = tables[-1].copy()
+    table[0, 0] = -1
+    assert store.append(table)
+    np.testing.assert_array_equal(store[-1], table)
+
+
+def test_memmap_reload(tmp_path):
+    store = MemmapStore(tmp_path, ram_budget=512, keyframe_ratio=0.3)
+    tables = filled_tables()
+    for table in tables:
+        store.append(table)
+    store.flush()
+    assert_same_frames(MemmapStore.load(tmp_path), tables)
+
+
+def test_incomplete_store_can_not_be_created():
+
+    class Incomplete(SnapshotStore):
+
+        def append(self, table):
+            return True
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@pytest.mark.parametrize('kind', STORES)
+def test_cursor(kind, tmp_path):
+    store = STORES[kind](tmp_path)
+    tables = filled_tables()
+    for table in tables:
+        store.append(table)
+    cursor = store.cursor()
+    previous = None
+    # forward one frame at a time, then jumps forward, back and in place
+    for i in list(range(len(tables))) + [3, 3, 10, 30, 0, len(tables) - 1, 5]:
+        table = cursor.seek(i)
+        np.testing.assert_array_equal(table, tables[i])
+        expected = np.flatnonzero(tables[i] != previous) if previous is not None else []
+        assert sorted(cursor.changed) == list(expected)
+        previous = tables[i]
+    # the stored frames were not touched by the cursor
+    assert_same_frames(store, tables)
+
+
+def test_cursor_over_list():
+    tables = filled_tables()
+    cursor = Cursor(tables)
+    for i in (0, 1, 2, 1):
+        np.testing.assert_array_equal(cursor.seek(i), tables[i])
+    assert list(cursor.changed) == [1]
+    with pytest.raises(IndexError):
+        cursor.seek(len(tables))
+
+
+def test_delta_diffs():
+    store = DeltaStore()
+    tables = filled_tables()
+    for table in tables:
+        store.append(table)
+    assert store.diff(0) is None
+    ids, values = store.diff(4)
+    assert list(ids) == [3] and list(values) == [10]
+
+
+@pytest.mark.parametrize('kind', STORES)
+def test_value_range_covers_middle_frames(kind, tmp_path):
+    store = STORES[kind](tmp_path)
+    tables = filled_tables()
+    # a middle frame overwrites a cell with a value below the first and last frames
+    dip = tables[10].copy()
+    dip[0, 0] = -50
+    tables = tables[:11] + [dip] + tables[11:]
+    tables[-1] = tables[-1].astype(float)
+    tables[-1][0, 1] = np.nan
+    for table in tables:
+        store.append(table)
+    assert value_range(store) == (-50, 34 * 34 + 1)
+    assert value_range(tables) == (-50, 34 * 34 + 1)
+    assert value_range([np.full(3, np.nan)]) is None
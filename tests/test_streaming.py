@@ -0,0 +1,84 @@
+import time
+
+import numpy as np
+import pytest
+
+from dpviz import dpviz
+from streaming import Snapshot, SnapshotStream
+
+progress = []
+
+
+def count_up(n, fail=False):
+    dp_table = np.zeros(n, dtype=int)
+    for i in range(n):
+        dp_table[i] = i + 1
+        progress.append(i)
+    if fail:
+        raise KeyError('no answer')
+    return int(dp_table.sum())
+
+
+def test_stream_yields_every_recorded_state():
+    viz = dpviz(count_up, backend='local')
+    stream = viz.stream(5)
+    snapshots = list(stream)
+    assert stream.done and stream.result == 15
+    assert [s.index for s in snapshots] == list(range(6))
+    assert all(s.name == 'dp_table' for s in snapshots)
+    assert [s.table.tolist() for s in snapshots] == [np.asarray(t).tolist() for t in stream.trace.tables]
+
+
+def test_sink_sees_each_state_as_recorded():
+    seen = []
+    viz = dpviz(count_up, backend='local', sink=seen.append)
+    viz(3)
+    assert all(isinstance(s, Snapshot) for s in seen)
+    assert [s.table.tolist() for s in seen] == [[0, 0, 0], [1, 0, 0], [1, 2, 0], [1, 2, 3]]
+
+
+def test_full_queue_blocks_the_traced_function():
+    progress.clear()
+    stream = dpviz(count_up, backend='local').stream(50, maxsize=2)
+    time.sleep(0.3)
+    # two states wait in the queue and the function waits to record the third
+    assert stream._queue.qsize() == 2
+    assert len(progress) < 3
+    assert len(list(stream)) == 51
+    assert len(progress) == 50
+
+
+def test_closing_early_cancels_the_traced_function():
+    progress.clear()
+    stream = dpviz(count_up, backend='local').stream(1000, maxsize=1)
+    first = [next(stream), next(stream)]
+    stream.close(timeout=5)
+    assert [s.index for s in first] == [0, 1]
+    assert stream.done and not stream._thread.is_alive()
+    # TraceCancelled stopped the function, it doesn't reach the consumer
+    assert len(progress) < 10
+    assert stream.result is None
+    assert list(stream) == []
+
+
+def test_stream_as_context_manager_closes():
+    with dpviz(count_up, backend='local').stream(1000, maxsize=1) as stream:
+        next(stream)
+    assert stream.done and not stream._thread.is_alive()
+
+
+def test_errors_reach_the_consumer():
+    stream = dpviz(count_up, backend='local').stream(3, fail=True)
+    with pytest.raises(KeyError):
+        list(stream)
+    assert stream.done
+
+
+def test_poll_does_not_block():
+    stream = SnapshotStream(maxsize=4)
+    assert stream.poll() == []
+    stream.start(lambda: [stream.put(Snapshot('t', i, None)) for i in range(3)] and 'done')
+    stream._thread.join(5)
+    assert [s.index for s in stream.poll(limit=2)] == [0, 1]
+    assert [s.index for s in stream.poll()] == [2]
+    assert stream.done and stream.result == 'done'
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from tracked import TrackedArray
+
+
+def written(table):
+    return [(int(e['index']), int(e['new'])) for e in table.log.events]
+
+
+def test_views_report_into_the_root_log():
+    table = TrackedArray(np.zeros((3, 4), dtype=np.int64))
+    table[1][2] = 5
+    table[2, 0] = 6
+    table[0][1:3] = 7
+    table.reshape(-1)[11] = 8
+    table[::-1][0][3] = 9  # negative strides, row 2
+    table[:, 1][2] = 4  # column view
+    assert written(table) == [(6, 5), (8, 6), (1, 7), (2, 7), (11, 8), (11, 9), (9, 4)]
+    assert table[2][3] == 9 and table[2][1] == 4
+
+
+def test_copies_are_not_tracked():
+    table = TrackedArray(np.zeros((3, 3), dtype=np.int64))
+    for fresh in (table + 1, table[[0, 2]], table.copy(), table[1] * 2):
+        assert fresh.log is None
+        fresh[0] = 1
+    assert len(table.log) == 0
+    np.testing.assert_array_equal(table, 0)
+
+
+@pytest.mark.parametrize('record_reads', [False, True])
+def test_reads(record_reads):
+    table = TrackedArray(np.arange(9).reshape(3, 3), record_reads)
+    table[2][2] = table[1][1] + table[2][1]
+    reads = sorted(int(i) for i in table.log.reads['index'])
+    assert reads == ([4, 7] if record_reads else [])
+    if record_reads:
+        assert table.log.edges().tolist() == [[4, 8], [7, 8]]
+
+
+def test_listeners_see_changed_cells():
+    table = TrackedArray(np.zeros((2, 2), dtype=np.int64))
+    seen = []
+    table.log.listeners.append(lambda ids, new: seen.append((ids.tolist(), new.tolist())))
+    table[0][0] = 0  # unchanged
+    table[1][1] = 3
+    table[0] = [1, 2]
+    assert seen == [([3], [3]), ([0, 1], [1, 2])]
+
+
+def test_in_place_ufuncs_report_their_writes():
+    table = TrackedArray(np.zeros((2, 3), dtype=np.int64))
+    row = table[1]
+    row += 2
+    assert written(table) == [(3, 2), (4, 2), (5, 2)]
+    assert table.log.events['old'].tolist() == [0, 0, 0]
+    # np.add.at reports every cell of its target
+    np.add.at(table.reshape(-1), [0, 0], 1)
+    assert written(table)[3:] == [(0, 2), (1, 0), (2, 0), (3, 2), (4, 2), (5, 2)]
+    assert table.log.events['old'].tolist()[3:] == [0, 0, 0, 2, 2, 2]
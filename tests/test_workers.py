@@ -0,0 +1,41 @@
+import sys
+
+import pytest
+
+from fib import fib
+from rcviz import rcviz
+from workers import TracePool, TraceFailed
+
+
+def test_worker_start_failure_fails_the_job(monkeypatch):
+    pool = TracePool(1)
+
+    def no_worker():
+        raise OSError('no more processes')
+
+    monkeypatch.setattr(pool, '_new_worker', no_worker)
+    job = pool.submit(fib, 5)
+    with pytest.raises(OSError, match='no more processes'):
+        job.future.result(timeout=5)
+    # the slot was given back, the next job fails the same way instead of waiting
+    with pytest.raises(OSError):
+        pool.submit(fib, 5).future.result(timeout=5)
+
+
+def test_job_that_can_not_be_unpickled_reports_why(monkeypatch):
+    def only_here(n):
+        return n
+
+    # found by name in this process only, the worker imports this module without it
+    only_here.__qualname__ = 'only_in_the_parent'
+    func = rcviz(only_here)
+    monkeypatch.setattr(sys.modules[__name__], 'only_in_the_parent', func, raising=False)
+    pool = TracePool(1)
+    try:
+        with pytest.raises(TraceFailed, match='AttributeError') as failure:
+            pool.submit(func, 3).future.result(timeout=60)
+        assert 'only_in_the_parent' in failure.value.details
+        # the worker survived and runs the next job
+        assert pool.submit(fib, 6).future.result(timeout=60).result == 8
+    finally:
+        pool.shutdown()